@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+    bench_load_locale [--strings N] [--repeat N]
+
+    Compare time and peak memory of loading a large locale file with flask_ptrans.ptrans.load_strings_file,
+    against the old way of doing json.load and then flattening the Pootle entries in a second pass.
+    Both of Pootle's JSON formats are measured: simple {strid: value} and full {strid: {value, comment}}.
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from flask_ptrans.ptrans import load_strings_file
+
+
+def two_pass_load(filepath):
+    """ how load_locale used to do it """
+    with open(filepath, "r", encoding="utf-8") as jsonfile:
+        string_dict = json.load(jsonfile)
+        for k, v in string_dict.items():
+            if type(v) is dict:
+                string_dict[k] = v.get("value")
+    return string_dict
+
+
+def make_locale_file(dirpath, num_strings, full_format):
+    """ write a locale file with num_strings strings, with comments if full_format """
+    strings = {}
+    for i in range(num_strings):
+        value = "Translated string number {0} with a {{placeholder}} in it".format(i)
+        if full_format:
+            strings["section{0}_string_{1}".format(i % 50, i)] = {
+                "value": value, "comment": "Translator comment explaining string {0} in some detail".format(i)}
+        else:
+            strings["section{0}_string_{1}".format(i % 50, i)] = value
+    filepath = os.path.join(dirpath, "full.json" if full_format else "simple.json")
+    with open(filepath, "w", encoding="utf-8") as f:
+        json.dump(strings, f, indent=2)
+    return filepath
+
+
+def measure(loader, filepath, repeat):
+    """ :return: (best time in seconds, peak traced memory in bytes) """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        loader(filepath)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    loader(filepath)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    add = ap.add_argument
+    add("-n", "--strings", type=int, default=100000, help="number of strings in each file [%(default)s]")
+    add("-r", "--repeat", type=int, default=5, help="number of timed loads, best is reported [%(default)s]")
+    args = ap.parse_args()
+    dirpath = tempfile.mkdtemp()
+    try:
+        for full_format in (False, True):
+            filepath = make_locale_file(dirpath, args.strings, full_format)
+            size = os.path.getsize(filepath)
+            print("{0} format, {1} strings, {2:.1f} MB".format(
+                "full" if full_format else "simple", args.strings, size / 1e6))
+            assert two_pass_load(filepath) == load_strings_file(filepath)
+            for name, loader in (("two-pass json.load", two_pass_load), ("load_strings_file", load_strings_file)):
+                best, peak = measure(loader, filepath, args.repeat)
+                print("  {0:<20} {1:8.1f} ms  peak {2:8.1f} MB".format(name, best * 1000, peak / 1e6))
+            os.unlink(filepath)
+    finally:
+        os.rmdir(dirpath)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+    load_harness [--locales N] [--strings N] [--tags N] [--threads N] [--requests N] [--warm FRACTION] [--json]
+                 [--extension] [--background-loading]
+
+    Drive a Flask app using flask-ptrans, like the one in the example directory, from several threads through the
+    WSGI test client, and report throughput and latency percentiles. Run it with two releases of flask-ptrans
+    installed in turn, to see whether request latency under concurrency has changed.
+
+    Like the example, the app uses the global string store set up by init_localisation(), chooses the locale with
+    best_locale() and passes it to render_template(), so it works with any release. With --extension, it uses a
+    PTrans extension object instead, which releases before it was added don't have.
+
+    Everything is generated in a temporary directory, from --seed, so runs are repeatable: locale files with
+    --strings strings each, and --templates pages extending a base template, each with --tags {% ptrans %} tags.
+    Requests choose a page at random, and an Accept-Language header like a browser's, favouring popular
+    locales. Some headers match no locale, so the default is used.
+
+    The most popular --warm fraction of the locales are loaded before the run starts, and the rest are cold, loaded
+    by the first request that needs them. Latencies are reported for requests in warm and cold locales separately
+    as well as overall. The --warmup requests (in warm locales only) compile the templates, and aren't counted.
+
+    It imports flask_ptrans, so run it with the release under test installed, or from the repository root with
+    the repository on the path: PYTHONPATH=. python benchmarks/load_harness.py
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import flask
+
+from flask_ptrans import ptrans
+
+
+# in rough order of popularity
+LOCALES = ["en-GB", "en-US", "es-ES", "de-DE", "fr-FR", "it-IT", "pt-BR", "es-MX", "ja-JP", "ko-KR",
+           "zh-CN", "nl-NL", "ru-RU", "pl-PL", "zh-TW", "sv-SE", "tr-TR", "pt-PT", "da-DK", "nb-NO",
+           "fi-FI", "en-AU", "fr-CA", "en-IN", "cs-CZ", "hu-HU", "ro-RO", "el-GR", "th-TH", "vi-VN",
+           "id-ID", "ms-MY", "ar-AE", "he-IL", "uk-UA", "hr-HR", "bg-BG", "sk-SK", "ca-ES", "es-AR"]
+UNMATCHED = ["sw-KE,sw;q=0.9", "am-ET", "yo-NG,en;q=0.1", "*"]     # headers with no locale file to match
+
+
+def strid(page, tag):
+    return "page{0}_string_{1}".format(page, tag)
+
+
+def make_site(dirpath, locales, num_strings, num_templates, num_tags):
+    """
+    Write locale files and templates
+    :return: (localisation directory, template directory)
+    """
+    localisation_dir = os.path.join(dirpath, "localisation")
+    template_dir = os.path.join(dirpath, "templates")
+    os.makedirs(localisation_dir)
+    os.makedirs(template_dir)
+    strids = [strid(page, tag) for page in range(num_templates) for tag in range(num_tags)]
+    strids.extend("filler_string_{0}".format(i) for i in range(max(0, num_strings - len(strids))))
+    for locale in locales:
+        strings = {key: "{0} text for {1}, with some more words in it".format(locale, key) for key in strids}
+        filename = locale.lower() + ".json"     # the string store looks for lower case file names
+        with open(os.path.join(localisation_dir, filename), "w", encoding="utf-8") as f:
+            json.dump(strings, f)
+    with open(os.path.join(template_dir, "base.html"), "w", encoding="utf-8") as f:
+        f.write('<!DOCTYPE html>\n<html lang="{{locale}}">\n<head><title>{% block title %}{% endblock %}</title></head>'
+                '\n<body>\n{% block content %}{% endblock %}\n</body>\n</html>\n')
+    for page in range(num_templates):
+        lines = ['{% extends "base.html" %}',
+                 '{% block title %}{% ptrans ' + strid(page, 0) + ' %}Page title{% endptrans %}{% endblock %}',
+                 '{% block content %}']
+        for tag in range(1, num_tags):
+            lines.append('<p class="item-{0}">{{% ptrans {1} %}}Fallback text {0}{{% endptrans %}}</p>'.format(
+                tag, strid(page, tag)))
+        lines.append('{% endblock %}')
+        with open(os.path.join(template_dir, "page{0}.html".format(page)), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+    return localisation_dir, template_dir
+
+
+def make_app(localisation_dir, template_dir, extension=False, background_loading=False):
+    """
+    Flask app serving the generated pages
+    :param extension: use a PTrans extension object, rather than the global string store as the example does
+    :return: (app, string store)
+    """
+    app = flask.Flask(__name__, template_folder=template_dir)
+    if extension:
+        app.config["PTRANS_LOCALISATION_DIR"] = localisation_dir
+        app.config["PTRANS_BACKGROUND_LOADING"] = background_loading
+        ptrans.PTrans(app)
+
+        @app.route("/page/<int:page>")
+        def page_view(page):
+            return flask.render_template("page{0}.html".format(page), page=page)
+
+        return app, app.extensions["ptrans"]
+
+    if background_loading:
+        ptrans.init_localisation(localisation_dir, background_loading=True)
+    else:
+        ptrans.init_localisation(localisation_dir)   # releases without background loading don't take the argument
+    app.jinja_env.add_extension('flask_ptrans.ptrans.ptrans')
+
+    @app.route("/page/<int:page>")
+    def page_view(page):
+        return flask.render_template("page{0}.html".format(page), locale=ptrans.best_locale(), page=page)
+
+    return app, ptrans._global_string_store
+
+
+def accept_language(locale, rand):
+    """ Accept-Language header for a browser preferring a locale, in one of the ways browsers write them """
+    lang = locale.partition("-")[0]
+    return rand.choice([
+        locale,
+        "{0},{1};q=0.9".format(locale, lang),
+        "{0},{1};q=0.9,en-US;q=0.8,en;q=0.7".format(locale, lang),
+        "{0};q=0.8,{1}".format(lang, locale.replace("-", "_").lower()),
+    ])
+
+
+def make_requests(locales, num_templates, count, rand):
+    """ :return: list of (url, Accept-Language header, locale wanted or None), favouring popular locales """
+    weights = [1.0 / (rank + 1) for rank in range(len(locales))]
+    requests = []
+    for _ in range(count):
+        url = "/page/{0}".format(rand.randrange(num_templates))
+        if rand.random() < 0.05:
+            requests.append((url, rand.choice(UNMATCHED), None))
+        else:
+            locale = rand.choices(locales, weights)[0]
+            requests.append((url, accept_language(locale, rand), locale))
+    return requests
+
+
+def drive(app, requests, results):
+    """ make requests with a test client of its own, adding (locale, seconds, status) to results """
+    client = app.test_client()
+    timings = []
+    for url, header, locale in requests:
+        start = time.perf_counter()
+        response = client.get(url, headers={"Accept-Language": header})
+        response.get_data()
+        timings.append((locale, time.perf_counter() - start, response.status_code))
+    results.extend(timings)
+
+
+def percentile(sorted_values, fraction):
+    """ nearest-rank percentile of a sorted list """
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, int(math.ceil(fraction * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def summarise(timings):
+    latencies = sorted(seconds for _, seconds, _ in timings)
+    return {"requests": len(latencies),
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "p99.9_ms": percentile(latencies, 0.999) * 1000,
+            "max_ms": (latencies[-1] if latencies else float("nan")) * 1000}
+
+
+def run(args):
+    rand = random.Random(args.seed)
+    locales = LOCALES[:args.locales]
+    num_warm = int(round(len(locales) * args.warm))
+    warm_locales = locales[:num_warm]
+    dirpath = tempfile.mkdtemp()
+    try:
+        localisation_dir, template_dir = make_site(dirpath, locales, args.strings, args.templates, args.tags)
+        app, string_store = make_app(localisation_dir, template_dir, args.extension, args.background_loading)
+        for locale in warm_locales:
+            string_store.load_locale(locale.lower())    # spelt as best_locale() gives it, like the file name
+        if args.background_loading:
+            string_store.wait_for_loading()
+        warmup = []
+        drive(app, make_requests(warm_locales or locales[:1], args.templates, args.warmup, rand), warmup)
+        if any(status != 200 for _, _, status in warmup):
+            raise SystemExit("warmup requests failed, see the log")
+        requests = make_requests(locales, args.templates, args.requests, rand)
+        results = []
+        threads = [threading.Thread(target=drive, args=(app, requests[i::args.threads], results))
+                   for i in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(dirpath)
+    report = {"threads": args.threads, "locales": len(locales), "warm_locales": num_warm,
+              "elapsed_s": elapsed, "throughput_rps": len(results) / elapsed,
+              "errors": sum(1 for _, _, status in results if status != 200),
+              "all": summarise(results),
+              "warm": summarise([t for t in results if t[0] is None or t[0] in warm_locales]),
+              "cold": summarise([t for t in results if t[0] is not None and t[0] not in warm_locales])}
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    add = ap.add_argument
+    add("-l", "--locales", type=int, default=30, help="number of locales, at most {0} [%(default)s]".format(
+        len(LOCALES)))
+    add("-s", "--strings", type=int, default=20000, help="number of strings in each locale file [%(default)s]")
+    add("-p", "--templates", type=int, default=10, help="number of page templates [%(default)s]")
+    add("-t", "--tags", type=int, default=200, help="number of ptrans tags in each page [%(default)s]")
+    add("-j", "--threads", type=int, default=8, help="number of threads making requests [%(default)s]")
+    add("-n", "--requests", type=int, default=5000, help="number of requests measured [%(default)s]")
+    add("-w", "--warm", type=float, default=0.5, help="fraction of locales loaded before the run [%(default)s]")
+    add("--warmup", type=int, default=100, help="number of requests before the run, not measured [%(default)s]")
+    add("--extension", action="store_true", help="use a PTrans extension object, rather than the global store")
+    add("--background-loading", action="store_true", help="load cold locales in a background thread")
+    add("--seed", type=int, default=0, help="random seed for the locales and pages requested [%(default)s]")
+    add("--json", action="store_true", help="print the report as JSON")
+    args = ap.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, sort_keys=True))
+        return
+    print("{0} requests, {1} threads, {2} locales ({3} warm): {4:.0f} requests/s, {5} errors".format(
+        report["all"]["requests"], report["threads"], report["locales"], report["warm_locales"],
+        report["throughput_rps"], report["errors"]))
+    for name in ("all", "warm", "cold"):
+        summary = report[name]
+        print("  {0:<5} {1:6d} requests  p50 {2:8.2f} ms  p99 {3:8.2f} ms  p99.9 {4:8.2f} ms  max {5:8.2f} ms".format(
+            name, summary["requests"], summary["p50_ms"], summary["p99_ms"], summary["p99.9_ms"], summary["max_ms"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+    Jinja2 extension for caching rendered fragments of localised templates
+
+    Adds the following syntax to template files:
+
+    {% ptranscache "footer" %} ... {% endptranscache %}
+
+    The body is rendered once for each combination of the key ("footer"), the locale, and the version of
+    that locale's strings in the string store, and the output is reused after that. Use it for parts of a page
+    like headers, footers and menus, that contain lots of {% ptrans %} tags but nothing else that varies.
+    The key can be any expression, so it can include anything else the fragment depends on.
+
+    Like {% ptrans %}, it uses {{locale}}, or the locale bound to the string store if that isn't defined.
+
+    The cache is the environment's ptrans_fragment_cache attribute, by default an LRUFragmentCache
+    holding a limited number of fragments in this process. Anything with the same get/set methods will do,
+    for example a MappingFragmentCache around a dict shared between processes.
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+import collections
+import threading
+
+import jinja2.ext
+import jinja2.nodes
+
+from flask_ptrans.ptrans import _global_string_store
+
+
+class LRUFragmentCache(object):
+    """
+    In-process cache of rendered fragments, discarding the least recently used beyond maxsize
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._fragments = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ :return: cached fragment for the key, or None """
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+            return fragment
+
+    def set(self, key, fragment):
+        with self._lock:
+            self._fragments[key] = fragment
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.maxsize:
+                self._fragments.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+    def __len__(self):
+        return len(self._fragments)
+
+
+class MappingFragmentCache(object):
+    """
+    Cache of rendered fragments kept in any mapping, e.g. a dict shared between processes by a
+    multiprocessing.Manager. It is up to the mapping to limit its size.
+    """
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def get(self, key):
+        """ :return: cached fragment for the key, or None """
+        return self.mapping.get(key)
+
+    def set(self, key, fragment):
+        self.mapping[key] = fragment
+
+    def clear(self):
+        self.mapping.clear()
+
+    def __len__(self):
+        return len(self.mapping)
+
+
+class PootleFragmentCacheExtension(jinja2.ext.Extension):
+    """
+    Provide the {% ptranscache %} tag
+    """
+    tags = {'ptranscache'}
+
+    def __init__(self, environment):
+        jinja2.ext.Extension.__init__(self, environment)
+        environment.extend(ptrans_fragment_cache=LRUFragmentCache())
+
+    def parse(self, parser):
+        """
+        :param parser: parser for HTML templates
+        :return: a jinja2.nodes.Node defining how to render the contents of the tag at run-time
+        """
+        lineno = next(parser.stream).lineno     # skip 'ptranscache' token
+        key = parser.parse_expression()
+        body = parser.parse_statements(('name:endptranscache',), drop_needle=True)
+        call = self.call_method('_cached_fragment', [key, jinja2.nodes.Name('locale', 'load')])
+        return jinja2.nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _cached_fragment(self, key, locale, caller):
+        """
+        :return: rendered fragment from the cache, or by rendering the body of the tag if it's not there
+        """
+        environment = self.environment
+        string_store = getattr(environment, "ptrans_store", _global_string_store)
+        if not isinstance(locale, (str, type(u''))):
+            locale = string_store.current_locale
+        if locale:
+            locale = string_store.canonical_locale(locale)  # so 'en-gb' and 'en-GB' share the store and the cache
+        if environment.is_async:
+            return self._cached_fragment_async(string_store, key, locale, caller)
+        if locale and locale not in string_store.locales:
+            string_store.load_locale(locale)    # so that loading it while rendering doesn't change the version
+        cache_key = (key, locale, string_store.catalog_version(locale))
+        fragment = environment.ptrans_fragment_cache.get(cache_key)
+        if fragment is None:
+            fragment = caller()
+            environment.ptrans_fragment_cache.set(cache_key, fragment)
+        return fragment
+
+    async def _cached_fragment_async(self, string_store, key, locale, caller):
+        """
+        _cached_fragment() in an environment with enable_async, where the strings may come from an async
+        locale hook and the body of the tag is rendered by a coroutine
+        """
+        if locale and locale not in string_store.locales:
+            await string_store.load_locale_async(locale)
+        cache_key = (key, locale, string_store.catalog_version(locale))
+        fragment = self.environment.ptrans_fragment_cache.get(cache_key)
+        if fragment is None:
+            fragment = await caller()
+            self.environment.ptrans_fragment_cache.set(cache_key, fragment)
+        return fragment
+
+
+ptranscache = PootleFragmentCacheExtension
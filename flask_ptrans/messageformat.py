@@ -0,0 +1,348 @@
+"""
+    ICU-style message formatting, with plural and select arguments
+
+    A message like
+
+        "{count, plural, =0 {No flights} one {# flight} other {# flights}} to {city}"
+
+    is parsed once by compile_message() into a CompiledMessage, which is called with the arguments:
+
+        compile_message(source, "en-GB")(count=3, city="Paris")  ->  "3 flights to Paris"
+
+    Supported: simple {name} arguments; {name, plural, ...} with exact =N matches, an optional offset:N,
+    the plural categories of the locale's language, and # for the number; {name, select, ...} choosing by
+    value, with 'other' for anything else. Other argument types such as {n, number} are inserted as they are.
+    Apostrophes quote syntax characters as in ICU: '{' is a literal brace and '' is an apostrophe.
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+
+
+class MessageSyntaxError(ValueError):
+    """ a message could not be parsed """
+
+
+# Plural rules, following the CLDR categories for integers and simple decimals
+
+def _plural_one_other(n):
+    return "one" if n == 1 else "other"
+
+
+def _plural_zero_one_other(n):
+    """ e.g. French: 0 and 1 are both singular """
+    return "one" if 0 <= n < 2 else "other"
+
+
+def _plural_other(n):
+    return "other"
+
+
+def _plural_east_slavic(n):
+    if n != int(n):
+        return "other"
+    n = int(n)
+    if n % 10 == 1 and n % 100 != 11:
+        return "one"
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return "few"
+    return "many"
+
+
+def _plural_west_slavic(n):
+    """ Czech and Slovak """
+    if n == 1:
+        return "one"
+    if n != int(n):
+        return "many"
+    return "few" if 2 <= n <= 4 else "other"
+
+
+def _plural_polish(n):
+    if n != int(n):
+        return "other"
+    n = int(n)
+    if n == 1:
+        return "one"
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return "few"
+    return "many"
+
+
+def _plural_south_slavic(n):
+    """ Croatian, Serbian, Bosnian """
+    if n != int(n):
+        return "other"
+    n = int(n)
+    if n % 10 == 1 and n % 100 != 11:
+        return "one"
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return "few"
+    return "other"
+
+
+def _plural_romanian(n):
+    if n == 1:
+        return "one"
+    if n != int(n) or n == 0 or 2 <= n % 100 <= 19:
+        return "few"
+    return "other"
+
+
+def _plural_arabic(n):
+    if n != int(n):
+        return "other"
+    n = int(n)
+    if n in (0, 1, 2):
+        return ("zero", "one", "two")[n]
+    if 3 <= n % 100 <= 10:
+        return "few"
+    if 11 <= n % 100 <= 99:
+        return "many"
+    return "other"
+
+
+PLURAL_RULES = {}   # {language or locale:function(n) returning plural category}
+PLURAL_RULES.update(dict.fromkeys(
+    ["en", "de", "nl", "sv", "da", "no", "nb", "nn", "fi", "et", "it", "es", "ca", "gl", "el", "hu", "tr",
+     "bg", "pt-pt", "he", "af", "eu", "is"], _plural_one_other))
+PLURAL_RULES.update(dict.fromkeys(["fr", "pt", "hi", "bn", "fa", "hy"], _plural_zero_one_other))
+PLURAL_RULES.update(dict.fromkeys(["ja", "zh", "ko", "th", "vi", "id", "ms", "lo", "my"], _plural_other))
+PLURAL_RULES.update(dict.fromkeys(["ru", "uk", "be"], _plural_east_slavic))
+PLURAL_RULES.update(dict.fromkeys(["cs", "sk"], _plural_west_slavic))
+PLURAL_RULES.update(dict.fromkeys(["hr", "sr", "bs"], _plural_south_slavic))
+PLURAL_RULES.update({"pl": _plural_polish, "ro": _plural_romanian, "ar": _plural_arabic})
+
+
+def plural_rule(locale):
+    """
+    :param locale: locale code, e.g. 'pt-BR'
+    :return: function giving the plural category of a number in the locale, for the locale or its language
+    """
+    locale = locale.lower()
+    return PLURAL_RULES.get(locale) or PLURAL_RULES.get(locale.partition("-")[0], _plural_one_other)
+
+
+class Argument(object):
+    """ {name} """
+
+    def __init__(self, name):
+        self.name = name
+
+    def render(self, args, rule, number, out):
+        out.append(type(u'')(args[self.name]))
+
+
+class Number(object):
+    """ # in a plural argument """
+
+    def render(self, args, rule, number, out):
+        out.append(type(u'')(number))
+
+
+class Plural(object):
+    """ {name, plural, offset:N =N {...} category {...} ...} """
+
+    def __init__(self, name, offset, options):
+        self.name = name
+        self.offset = offset
+        self.exact = {}         # {number:parts} for =N options
+        self.categories = {}    # {category:parts}
+        for selector, parts in options:
+            if selector.startswith("="):
+                try:
+                    self.exact[float(selector[1:])] = parts
+                except ValueError:
+                    raise MessageSyntaxError("invalid plural selector {0}".format(selector))
+            else:
+                self.categories[selector] = parts
+        if "other" not in self.categories:
+            raise MessageSyntaxError("no 'other' option for plural {0}".format(name))
+
+    def render(self, args, rule, number, out):
+        value = args[self.name]
+        if isinstance(value, (str, type(u''))):
+            value = _to_number(value)   # e.g. count="3" from a query string
+        parts = self.exact.get(value)
+        number = value - self.offset
+        if parts is None:
+            parts = self.categories.get(rule(number)) or self.categories["other"]
+        _render(parts, args, rule, number, out)
+
+
+class Select(object):
+    """ {name, select, value {...} ... other {...}} """
+
+    def __init__(self, name, options):
+        self.name = name
+        self.options = dict(options)
+        if "other" not in self.options:
+            raise MessageSyntaxError("no 'other' option for select {0}".format(name))
+
+    def render(self, args, rule, number, out):
+        parts = self.options.get(type(u'')(args[self.name])) or self.options["other"]
+        _render(parts, args, rule, number, out)
+
+
+def _to_number(text):
+    """ number written in a string, e.g. 3 for "3", raising ValueError if it isn't one """
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def _render(parts, args, rule, number, out):
+    for part in parts:
+        if isinstance(part, type(u'')):
+            out.append(part)
+        else:
+            part.render(args, rule, number, out)
+
+
+class CompiledMessage(object):
+    """
+    A parsed message, formatted by calling it with keyword arguments.
+    Raises KeyError if an argument is missing, and TypeError or ValueError if a plural argument isn't a number.
+    """
+
+    def __init__(self, source, locale="en-GB"):
+        self.source = source
+        self.rule = plural_rule(locale)
+        self.parts = _MessageParser(source).parse()
+        if all(isinstance(part, type(u'')) for part in self.parts):
+            self.text = u''.join(self.parts)   # nothing to insert, so always the same
+        else:
+            self.text = None
+
+    def __call__(self, **kwargs):
+        if self.text is not None:
+            return self.text
+        out = []
+        _render(self.parts, kwargs, self.rule, None, out)
+        return u''.join(out)
+
+
+compile_message = CompiledMessage
+
+
+class _MessageParser(object):
+    """
+    Recursive descent parser, turning a message into a list of parts: strings, and Argument, Number,
+    Plural and Select objects whose options are lists of parts themselves
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.pos = 0
+
+    def parse(self):
+        parts = self.parse_parts(in_plural=False)
+        if self.pos < len(self.source):
+            raise MessageSyntaxError("unmatched }} at {0}".format(self.pos))
+        return parts
+
+    def parse_parts(self, in_plural):
+        """ parse text and arguments, up to a closing brace or the end """
+        source = self.source
+        parts = []
+        text = []
+        while self.pos < len(source):
+            c = source[self.pos]
+            if c == "'":
+                following = source[self.pos + 1:self.pos + 2]
+                if following == "'":
+                    text.append("'")
+                    self.pos += 2
+                elif following and (following in "{}" or (in_plural and following == "#")):
+                    end = source.find("'", self.pos + 1)
+                    if end < 0:
+                        end = len(source)
+                    text.append(source[self.pos + 1:end])
+                    self.pos = end + 1
+                else:
+                    text.append(c)
+                    self.pos += 1
+            elif c == "{" or c == "}" or (c == "#" and in_plural):
+                if text:
+                    parts.append(u''.join(text))
+                    text = []
+                if c == "}":
+                    break
+                if c == "{":
+                    parts.append(self.parse_argument(in_plural))
+                else:
+                    parts.append(Number())
+                    self.pos += 1
+            else:
+                text.append(c)
+                self.pos += 1
+        if text:
+            parts.append(u''.join(text))
+        return parts
+
+    def read_until(self, stops):
+        """ :return: stripped text up to the next of the stop characters, which must be found """
+        start = self.pos
+        while self.pos < len(self.source) and self.source[self.pos] not in stops:
+            self.pos += 1
+        if self.pos >= len(self.source):
+            raise MessageSyntaxError("unterminated argument at {0}".format(start - 1))
+        return self.source[start:self.pos].strip()
+
+    def parse_argument(self, in_plural):
+        """ parse {name}, {name, type} or {name, type, options} starting at the opening brace """
+        self.pos += 1
+        name = self.read_until(",}")
+        if not name:
+            raise MessageSyntaxError("argument with no name at {0}".format(self.pos))
+        if self.source[self.pos] == "}":
+            self.pos += 1
+            return Argument(name)
+        self.pos += 1
+        arg_type = self.read_until(",}")
+        if arg_type not in ("plural", "select"):
+            self.read_until("}")   # ignore any style, e.g. {n, number, integer}
+            self.pos += 1
+            return Argument(name)
+        if self.source[self.pos] != ",":
+            raise MessageSyntaxError("no options for {0} {1}".format(arg_type, name))
+        self.pos += 1
+        offset = 0
+        options = []
+        while True:
+            selector = self.read_until("{}")
+            if selector.startswith("offset:") and arg_type == "plural":
+                offset_text, space, selector = selector[len("offset:"):].strip().partition(" ")
+                try:
+                    offset = int(offset_text)
+                except ValueError:
+                    raise MessageSyntaxError("invalid offset in plural {0}".format(name))
+                selector = selector.strip()
+            if self.source[self.pos] == "}":
+                if selector:
+                    raise MessageSyntaxError("no message for {0} in {1}".format(selector, name))
+                self.pos += 1
+                break
+            if not selector or len(selector.split()) > 1:
+                raise MessageSyntaxError("invalid selector '{0}' in {1}".format(selector, name))
+            self.pos += 1
+            parts = self.parse_parts(in_plural=in_plural or arg_type == "plural")
+            if self.pos >= len(self.source):
+                raise MessageSyntaxError("unterminated option {0} in {1}".format(selector, name))
+            self.pos += 1
+            options.append((selector, parts))
+        if arg_type == "plural":
+            return Plural(name, offset, options)
+        return Select(name, options)
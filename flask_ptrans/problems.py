@@ -0,0 +1,113 @@
+"""
+    Deduplicated, rate-limited reporting of translation problems
+
+    A broken string on a busy page can go wrong thousands of times a second. The problem reporter logs the
+    first occurrence of each (kind, locale, strid) as it happens, and only counts the repeats. A background
+    thread logs how many times each problem was repeated, once per interval.
+
+    Reporting a problem that has been seen before only increments a counter, and the number of different problems
+    tracked is limited, so the cost on the hot path stays small however many problems there are.
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+import logging
+import threading
+
+
+class ProblemReporter(object):
+    """
+    Log each different problem once, and periodic counts of the times it happened again.
+    Counts may be slightly low when several threads report the same problem at the same moment.
+    """
+
+    def __init__(self, logger=None, interval=60.0, max_problems=1000):
+        """
+        :param logger: logger to report to [default is the root logger]
+        :param interval: seconds between reports of repeated problems
+        :param max_problems: maximum number of different problems to track; more are only counted in total
+        """
+        self.logger = logger or logging.getLogger()
+        self.interval = interval
+        self.max_problems = max_problems
+        self._repeats = {}      # {(kind, locale, strid):times repeated since last flush}
+        self._untracked = 0     # problems not tracked because there were already too many
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None     # background thread flushing counts, started when first needed
+
+    def report(self, kind, locale, strid, level, message, *args):
+        """
+        Report a problem, logging the message (formatted with the args) only if it hasn't been reported before
+        :param kind: kind of problem, e.g. 'missing-argument'
+        :param locale: locale where it happened
+        :param strid: string ID it happened to, or None
+        :param level: logging level, e.g. logging.ERROR
+        :param message: log message, with % placeholders for args
+        """
+        key = (kind, locale, strid)
+        repeats = self._repeats.get(key)
+        if repeats is not None:
+            self._repeats[key] = repeats + 1
+            return
+        with self._lock:
+            if key in self._repeats:
+                self._repeats[key] += 1
+                return
+            if len(self._repeats) >= self.max_problems:
+                self._untracked += 1
+                return
+            self._repeats[key] = 0
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_periodically, name="ptrans-problems")
+                self._thread.daemon = True
+                self._thread.start()
+        self.logger.log(level, message, *args)
+
+    def flush(self):
+        """
+        Log how many times each problem happened again since the last flush
+        """
+        with self._lock:
+            repeated = [(key, repeats) for key, repeats in self._repeats.items() if repeats]
+            for key, repeats in repeated:
+                self._repeats[key] = 0
+            untracked, self._untracked = self._untracked, 0
+        for (kind, locale, strid), repeats in sorted(repeated, key=lambda item: -item[1]):
+            self.logger.warning("ptrans %s for %s locale %s repeated %d times", kind, strid, locale, repeats)
+        if untracked:
+            self.logger.warning("ptrans %d more problems of other kinds, strings or locales", untracked)
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        """
+        Stop the background thread, and log any counts not flushed yet
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    @property
+    def problems(self):
+        """ set of (kind, locale, strid) for the problems reported so far """
+        with self._lock:
+            return set(self._repeats)
+
+
+# Problem reporter used by string stores unless they are given their own
+default_reporter = ProblemReporter()
@@ -33,13 +33,50 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and limitations under the License.
 
 """
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
+import inspect
 import logging
+import threading
 import glob
+import hashlib
 import os.path
 import json
+import contextlib
+import sys
 
 import jinja2.ext
 import jinja2.nodes
+import jinja2.utils
+
+from flask_ptrans import messageformat, problems, usage
+from flask_ptrans.scripts import pseudolocalise
+
+
+MANIFEST_FILENAME = "_manifest.json"     # written by ptrans_aggregate alongside the locale files
+UNKNOWN_LOCALE = "und"      # key for locales beyond the limit of unknown ones, which get no strings
+MAX_LOCALE_SPELLINGS = 4096     # limit of locale strings remembered with their canonical form
+MAX_SHARD_QUERIES = 4096    # limit of string IDs and prefixes remembered with the shards that may hold them
+MAX_MESSAGES = 4096         # limit of compiled messages kept by lookup_message(), discarding the least recently used
+MAX_SUBSET_JSON = 4096      # limit of serialised subsets kept by subset_json(), discarding the least recently used
+
+
+def format_locale(locale):
+    """
+    Locale code with the usual separator and case for each part, e.g. 'en_gb' -> 'en-GB', 'ZH-HANT-TW' -> 'zh-Hant-TW'
+    """
+    parts = locale.strip().replace("_", "-").split("-")
+    formatted = [parts[0].lower()]
+    for part in parts[1:]:
+        if len(part) == 2 or (len(part) == 3 and part.isdigit()):
+            formatted.append(part.upper())     # region
+        elif len(part) == 4 and part.isalpha() and len(formatted) == 1:
+            formatted.append(part.title())     # script
+        else:
+            formatted.append(part.lower())
+    return "-".join(formatted)
 
 
 class LazyLocalisedStringStore(object):
@@ -50,14 +87,70 @@ class LazyLocalisedStringStore(object):
     If no file for an exactly matching locale is available, localisations for a
     partial match (same language but not same variant) will be used. This decision
     is made once when attempting to load a locale for the first time.
+
+    Locales are kept under a canonical key, e.g. 'en-GB' for 'en_gb' or 'EN-gb'. Only max_unknown_locales
+    locales that aren't known and haven't been loaded are given keys of their own. Beyond that, they share
+    the key of their language, or UNKNOWN_LOCALE, so made-up locales can't make the store grow without limit.
+    With a locale hook, a locale only counts as unknown once the hook has given no strings for it.
+
+    If the manifest says a locale was split into shards by ptrans_aggregate, only the
+    shards holding the strings asked for are loaded, and the rest are loaded as needed.
+
+    A pseudo-locale can be configured, whose strings are pseudo-localised on demand from
+    those of a base locale, so no file is needed for it.
+
+    With background_loading, a locale that isn't loaded yet is loaded by a background thread,
+    and meanwhile lookups get the fallback text (or strings of another locale of the same language
+    if one is loaded). Other locales of the same language are then loaded in advance too.
+
+    A locale can be bound to the current context (thread, greenlet or asyncio task) with
+    bind_locale(), for the duration of a request or render. Then lookup_current() goes straight
+    to its strings, and templates don't need to be given the locale.
+
+    With an overlay_directory, a tenant (e.g. a white-label brand) can be bound to the current context
+    with bind_tenant(). Its overlay files, overlay_directory/TENANT/LOCALE.json, hold only the strings it
+    overrides, and lookups see them on top of the locale's strings through a LayeredCatalog.
     """
 
-    def __init__(self, localisation_directory=None, allow_empty=False, locale_hook=None):
+    def __init__(self, localisation_directory=None, allow_empty=False, locale_hook=None,
+                 pseudo_locale=None, pseudo_base_locale="en-GB", background_loading=False, problem_reporter=None,
+                 usage_recorder=None, max_unknown_locales=256, overlay_directory=None):
         self.locales = {}               # {locale:dict_of_strings}
-        self._known_locales = set()     # locales known to have a file that will match them
+        self._known_locales = None      # locales known to have a file that will match them, once found
+        self._known_lower = (None, frozenset())     # (known_locales, the same in lower case)
+        self._canonical = {}            # {locale as given:canonical locale}
+        self._unknown_locales = set()   # canonical locales not known when first seen
+        self.max_unknown_locales = max_unknown_locales
         self.localisation_dir = localisation_directory  # path to directory containing LOCALE.json files
         self.allow_empty = allow_empty  # accept empty translations? If not, they are treated as though missing
         self.locale_hook = locale_hook
+        self._manifest = None           # {locale:entry} from the manifest file, if there is one
+        self._manifest_aliases = {}     # {language:locale} from the manifest file
+        self._loaded_shards = {}        # {locale:set_of_shard_names} for sharded locales
+        self._partial_locales = set()   # locales of which only some shards are loaded so far
+        self._shard_queries = {}        # {(manifest locale, prefixes, exact):set of shards that may hold them}
+        self.pseudo_locale = pseudo_locale  # e.g. 'qps-ploc', served by pseudo-localising the base locale
+        self.pseudo_base_locale = pseudo_base_locale
+        self._pseudo_strings = None     # PseudoLocalisedStrings for the pseudo-locale, once used
+        self._bound = contextvars.ContextVar("ptrans_bound_locale", default=None)  # bound by bind_locale()
+        self.background_loading = background_loading    # load locales in a background thread?
+        self.executor = None            # executor for background loading, created when first needed
+        self._pending = {}              # {locale:future} for locales being loaded in the background
+        self._pending_lock = threading.Lock()
+        self._async_pending = {}        # {locale:task} for locales being fetched from an async locale hook
+        self.generation = 0             # incremented whenever strings are reloaded or come from the locale hook
+        self._versions = {}             # {locale:catalog_version} for loaded locales
+        self._messages = collections.OrderedDict()  # {(locale, strid):(source, CompiledMessage or None)}, LRU first
+        self._messages_lock = threading.Lock()
+        self.problems = problem_reporter or problems.default_reporter   # where to report broken strings etc.
+        self.usage = usage_recorder     # UsageRecorder counting a sample of lookups, if any
+        self.overlay_dir = overlay_directory    # path to directory containing TENANT/LOCALE.json overlay files
+        self._tenant = contextvars.ContextVar("ptrans_bound_tenant", default=None)  # bound by bind_tenant()
+        self._tenants = None            # tenants with a directory in the overlay directory, once found
+        self._overlays = {}             # {(tenant, locale):(overlay_strings, version)} for those tenants
+        self._layered = {}              # {(tenant, locale):LayeredCatalog}
+        self._subset_json = collections.OrderedDict()   # {(locale, prefixes, catalog_version):Markup}, LRU first
+        self._subset_json_lock = threading.Lock()
 
     def install_locale_hook(self, locale_hook):
         self.locale_hook = locale_hook
@@ -71,11 +164,22 @@ class LazyLocalisedStringStore(object):
         :param format_kwargs: if present, insert these into the string with str.format()
         :return: localised string or the fallback
         """
+        if not isinstance(locale, (str, type(u''))) and self._bound.get() is not None:
+            locale = self._bound.get()[0]   # e.g. not passed to the template, so use the bound locale
         if not isinstance(locale, (str, type(u''))):
-            logging.error("locale is a %s for %s", locale.__class__.__name__, strid)
+            self.problems.report("bad-locale", locale.__class__.__name__, strid, logging.ERROR,
+                                 "locale is a %s for %s", locale.__class__.__name__, strid)
             translated = fallback
         else:
-            locale_dict = self.locales.get(locale) or self.load_locale(locale)
+            locale = self._canonical.get(locale) or self.canonical_locale(locale)
+            if self.usage is not None:
+                self.usage.record(locale, strid)
+            locale_dict = self.locales.get(locale)
+            if not locale_dict and (locale_dict is None or self.locale_hook) or \
+                    locale in self._partial_locales and strid not in locale_dict and self._needs_shards(locale, strid):
+                locale_dict = self.load_locale(locale, strid=strid)
+            if self.overlay_dir is not None and self._tenant.get() is not None:
+                locale_dict = self.tenant_catalog(self._tenant.get(), locale, locale_dict)
             # Invariant: locale_dict is a dict (possibly empty, possibly alias to another
             #  loaded previously)
             translated = locale_dict.get(strid, fallback)
@@ -84,13 +188,19 @@ class LazyLocalisedStringStore(object):
             if not translated and not self.allow_empty:
                 translated = fallback
         if format_kwargs:
-            if not isinstance(translated, type(u'')):   # ensure it's unicode, can't insert unicode into a bytestring
-                translated = translated.decode('utf-8')
-            try:
-                translated = translated.format(**format_kwargs)
-            except KeyError as err:
-                logging.error("No {%s} in string %s, locale %s", err.args[0], strid, locale)
-                pass
+            translated = self._format(translated, strid, locale, format_kwargs)
+        return translated
+
+    def _format(self, translated, strid, locale, format_kwargs):
+        """ insert keyword arguments into a translated string with str.format() """
+        if not isinstance(translated, type(u'')):   # ensure it's unicode, can't insert unicode into a bytestring
+            translated = translated.decode('utf-8')
+        try:
+            translated = translated.format(**format_kwargs)
+        except KeyError as err:
+            self.problems.report("missing-argument", locale, strid, logging.ERROR,
+                                 "No {%s} in string %s, locale %s", err.args[0], strid, locale)
+            pass
         return translated
 
     def lookup_cascade(self, locale, strid, fallback=None, fallback_locale="en-GB", **format_kwargs):
@@ -98,11 +208,179 @@ class LazyLocalisedStringStore(object):
         Localised version of a string, fallback to 1) fallback string, 2) other locale, 3) key
         """
         if not fallback:
-            fallback_dict = self.locales.get(fallback_locale) or self.load_locale(fallback_locale)
+            fallback_locale = self._canonical.get(fallback_locale) or self.canonical_locale(fallback_locale)
+            fallback_dict = self.locales.get(fallback_locale)
+            if not fallback_dict and (fallback_dict is None or self.locale_hook) or \
+                    fallback_locale in self._partial_locales and strid not in fallback_dict and \
+                    self._needs_shards(fallback_locale, strid):
+                fallback_dict = self.load_locale(fallback_locale, strid=strid)
+            if self.overlay_dir is not None and self._tenant.get() is not None:
+                fallback_dict = self.tenant_catalog(self._tenant.get(), fallback_locale, fallback_dict)
             fallback = fallback_dict.get(strid, strid)
         translated = self.lookup(locale, strid, fallback, **format_kwargs)
         return translated
 
+    def lookup_message(self, locale, strid, fallback=None, fallback_locale="en-GB", **format_kwargs):
+        """
+        Localised version of a message with ICU-style plural and select arguments, with the same fallbacks
+        as lookup_cascade(), e.g. "{count, plural, one {# flight} other {# flights}}".
+        Each message is parsed once for each locale, and kept until the locale is reloaded, or it is one of the
+        least recently used beyond MAX_MESSAGES.
+        :param locale: locale code, e.g. 'pt-BR', or None for the locale bound to the current context
+        :param format_kwargs: arguments to insert into the message
+        :return: formatted message, or the string as it is if the message is invalid
+        """
+        if not isinstance(locale, (str, type(u''))):
+            locale = self.current_locale or locale
+        else:
+            locale = self.canonical_locale(locale)
+        source = self.lookup_cascade(locale, strid, fallback, fallback_locale)
+        if not isinstance(locale, (str, type(u''))) or not isinstance(source, (str, type(u''))):
+            return source
+        key = (locale, strid)
+        with self._messages_lock:
+            cached = self._messages.get(key)
+            if cached is not None:
+                self._messages.move_to_end(key)
+        if cached is None or cached[0] != source:
+            try:
+                message = messageformat.compile_message(source, locale)
+            except messageformat.MessageSyntaxError as err:
+                self.problems.report("invalid-message", locale, strid, logging.ERROR,
+                                     "Invalid message %s, locale %s: %s", strid, locale, err)
+                message = None
+            cached = (source, message)
+            with self._messages_lock:
+                self._messages[key] = cached
+                self._messages.move_to_end(key)
+                while len(self._messages) > MAX_MESSAGES:
+                    self._messages.popitem(last=False)
+        if cached[1] is None:
+            return source
+        try:
+            return cached[1](**format_kwargs)
+        except KeyError as err:
+            self.problems.report("missing-argument", locale, strid, logging.ERROR,
+                                 "No {%s} in string %s, locale %s", err.args[0], strid, locale)
+            return source
+        except (TypeError, ValueError) as err:
+            self.problems.report("invalid-argument", locale, strid, logging.ERROR,
+                                 "Invalid argument for string %s, locale %s: %s", strid, locale, err)
+            return source
+
+    def bind_locale(self, locale, fallback_locale="en-GB"):
+        """
+        Bind a locale to the current context, so lookup_current() uses it.
+        Its strings, and those of the fallback locale, are loaded now if they weren't already.
+        If a tenant is bound, bind it first: lookup_current() sees its overlays as they were at this point.
+        :param locale: locale code, e.g. 'pt-BR'
+        :param fallback_locale: locale for strings missing from the first one
+        :return: token to pass to unbind_locale()
+        """
+        locale = self.canonical_locale(locale)
+        fallback_locale = self.canonical_locale(fallback_locale)
+        # shards of sharded locales are still loaded only as they are needed
+        locale_dict = self.locales.get(locale)
+        if locale_dict is None or not (locale_dict or self.locale_hook is None):
+            locale_dict = self.load_locale(locale, prefixes=())
+        fallback_dict = self.locales.get(fallback_locale)
+        if fallback_dict is None or not (fallback_dict or self.locale_hook is None):
+            fallback_dict = self.load_locale(fallback_locale, prefixes=())
+        tenant = self._tenant.get()
+        if self.overlay_dir is not None and tenant is not None:
+            locale_dict = self.tenant_catalog(tenant, locale, locale_dict)
+            fallback_dict = self.tenant_catalog(tenant, fallback_locale, fallback_dict)
+        return self._bound.set((locale, locale_dict, fallback_locale, fallback_dict))
+
+    def unbind_locale(self, token):
+        """
+        Restore the binding in the current context to what it was before bind_locale() returned the token
+        """
+        self._bound.reset(token)
+
+    @contextlib.contextmanager
+    def using_locale(self, locale, fallback_locale="en-GB"):
+        """
+        Context manager that binds a locale to the current context for the duration of a with statement
+        """
+        token = self.bind_locale(locale, fallback_locale)
+        try:
+            yield self
+        finally:
+            self.unbind_locale(token)
+
+    @property
+    def current_locale(self):
+        """ locale bound to the current context, or None """
+        binding = self._bound.get()
+        return binding[0] if binding is not None else None
+
+    def lookup_current(self, strid, fallback=None, **format_kwargs):
+        """
+        Localised version of a string in the locale bound to the current context, with the same fallbacks
+        as lookup_cascade(), but without having to find the strings for the locale each time.
+        """
+        binding = self._bound.get()
+        if binding is None:
+            return self.lookup_cascade(None, strid, fallback, **format_kwargs)
+        locale, locale_dict, fallback_locale, fallback_dict = binding
+        if locale in self._partial_locales and strid not in locale_dict and self._needs_shards(locale, strid) or \
+                fallback_locale in self._partial_locales and strid not in fallback_dict and \
+                self._needs_shards(fallback_locale, strid):
+            # let it load the shards needed
+            return self.lookup_cascade(locale, strid, fallback, fallback_locale, **format_kwargs)
+        if self.usage is not None:
+            self.usage.record(locale, strid)
+        translated = locale_dict.get(strid)
+        if isinstance(translated, dict):
+            translated = translated.get("value")
+        if translated is None or not (translated or self.allow_empty):
+            translated = fallback or fallback_dict.get(strid, strid)
+        if format_kwargs:
+            translated = self._format(translated, strid, locale, format_kwargs)
+        return translated
+
+    def lookup_tag(self, locale, strid, fallback):
+        """
+        Localised version of a string for a {% ptrans %} tag: the same as lookup_cascade(), but
+        using lookup_current() if the template's locale is the bound one, or it has no locale
+        """
+        binding = self._bound.get()
+        if binding is not None and (locale is binding[0] or not isinstance(locale, (str, type(u'')))):
+            return self.lookup_current(strid, fallback)
+        return self.lookup_cascade(locale, strid, fallback)
+
+    def lookup_tag_async(self, locale, strid, fallback):
+        """
+        lookup_tag() for templates in a jinja2 environment with enable_async. If the strings for the locale are
+        still to come from the locale hook, returns an awaitable that fetches them without blocking the event loop,
+        otherwise the string itself, so lookups of loaded locales stay synchronous.
+        """
+        if self._awaiting_hook(locale):
+            return self._after_loading((locale,), self.lookup_tag, locale, strid, fallback)
+        return self.lookup_tag(locale, strid, fallback)
+
+    def lookup_cascade_async(self, locale, strid, fallback=None, fallback_locale="en-GB", **format_kwargs):
+        """
+        lookup_cascade() for templates in a jinja2 environment with enable_async, as for lookup_tag_async()
+        """
+        wanted = (locale,) if fallback else (locale, fallback_locale)
+        if any(self._awaiting_hook(wanted_locale) for wanted_locale in wanted):
+            return self._after_loading(wanted, self.lookup_cascade, locale, strid, fallback, fallback_locale,
+                                       **format_kwargs)
+        return self.lookup_cascade(locale, strid, fallback, fallback_locale, **format_kwargs)
+
+    def _awaiting_hook(self, locale):
+        """ True if the strings for a locale are still to be fetched from the locale hook """
+        if self.locale_hook is None or not isinstance(locale, (str, type(u''))):
+            return False
+        return not self.locales.get(self._canonical.get(locale) or self.canonical_locale(locale))
+
+    async def _after_loading(self, locales, method, *args, **kwargs):
+        for locale in locales:
+            await self.load_locale_async(locale)
+        return method(*args, **kwargs)
+
     def subset(self, locale, *prefixes):
         """
         Return a subset of the string store for a specified locale, where the string IDs match any of the
@@ -111,65 +389,399 @@ class LazyLocalisedStringStore(object):
         :param prefixes: array of prefixes e.g. ['flights_payment_', 'shared_country_']
         :return: a dict containing keys and values
         """
+        if not isinstance(locale, (str, type(u''))) and self._bound.get() is not None:
+            locale = self._bound.get()[0]
         if not isinstance(locale, (str, type(u''))):
-            logging.error("locale is a %s for subset %s", locale.__class__.__name__, prefixes)
+            self.problems.report("bad-locale", locale.__class__.__name__, prefixes, logging.ERROR,
+                                 "locale is a %s for subset %s", locale.__class__.__name__, prefixes)
             return {}
-        locale_dict = self.locales.get(locale) or self.load_locale(locale)
+        locale = self._canonical.get(locale) or self.canonical_locale(locale)
+        if self.usage is not None:
+            for prefix in prefixes:
+                self.usage.record(locale, prefix + "*")
+        locale_dict = self.locales.get(locale)
+        if not locale_dict and (locale_dict is None or self.locale_hook) or \
+                locale in self._partial_locales and self._needs_shards(locale, prefixes=prefixes):
+            locale_dict = self.load_locale(locale, prefixes=prefixes)
+        if self.overlay_dir is not None and self._tenant.get() is not None:
+            locale_dict = self.tenant_catalog(self._tenant.get(), locale, locale_dict)
+        if isinstance(locale_dict, PseudoLocalisedStrings):
+            return locale_dict.subset(prefixes)
         trans = {k: v for (k, v) in locale_dict.items()
                  if any(k.startswith(p) for p in prefixes)}
         return trans
 
-    def load_locale(self, locale):  # -> dict
+    def subset_json(self, locale, *prefixes):
+        """
+        The same strings as subset(), serialised as JSON that is safe to put in HTML, e.g. in a <script> element.
+        It is kept for each locale, set of prefixes and catalog version, so it is only built again when the
+        strings change, or when it is one of the least recently used beyond MAX_SUBSET_JSON.
+        :param locale: locale code, e.g. 'pt-BR', or None for the locale bound to the current context
+        :param prefixes: array of prefixes e.g. ['flights_payment_', 'shared_country_']
+        :return: jinja2 Markup of a JSON object, with keys in sorted order
+        """
+        if not isinstance(locale, (str, type(u''))) and self._bound.get() is not None:
+            locale = self._bound.get()[0]
+        key = None
+        if isinstance(locale, (str, type(u''))):
+            locale = self._canonical.get(locale) or self.canonical_locale(locale)
+            key = (locale, prefixes, self.catalog_version(locale))
+            with self._subset_json_lock:
+                cached = self._subset_json.get(key)
+                if cached is not None:
+                    self._subset_json.move_to_end(key)
+            if cached is not None:
+                if self.usage is not None:
+                    for prefix in prefixes:
+                        self.usage.record(locale, prefix + "*")
+                return cached
+        # with background loading, a locale that isn't loaded yet (or not all its shards) gives interim strings
+        interim = self.background_loading and (key is None or key[2] is None or locale in self._partial_locales)
+        markup = jinja2.utils.htmlsafe_json_dumps(self.subset(locale, *prefixes), sort_keys=True)
+        if key is not None and not interim:
+            version = self.catalog_version(locale)  # the locale may only just have been loaded
+            if version is not None:
+                key = (locale, prefixes, version)
+                with self._subset_json_lock:
+                    self._subset_json[key] = markup
+                    self._subset_json.move_to_end(key)
+                    while len(self._subset_json) > MAX_SUBSET_JSON:
+                        self._subset_json.popitem(last=False)
+        return markup
+
+    def bind_tenant(self, tenant):
+        """
+        Bind a tenant to the current context, so lookups see its overlays on top of the strings of each locale
+        :param tenant: name of a directory in the overlay directory, or None for no tenant
+        :return: token to pass to unbind_tenant()
+        """
+        return self._tenant.set(tenant)
+
+    def unbind_tenant(self, token):
+        """
+        Restore the tenant bound to the current context to what it was before bind_tenant() returned the token
+        """
+        self._tenant.reset(token)
+
+    @contextlib.contextmanager
+    def using_tenant(self, tenant):
+        """
+        Context manager that binds a tenant to the current context for the duration of a with statement
+        """
+        token = self.bind_tenant(tenant)
+        try:
+            yield self
+        finally:
+            self.unbind_tenant(token)
+
+    @property
+    def current_tenant(self):
+        """ tenant bound to the current context, or None """
+        return self._tenant.get()
+
+    @property
+    def tenants(self):
+        """
+        Set of the tenants with a directory of overlay files in the overlay directory
+        """
+        if self._tenants is not None:   # memoize
+            return self._tenants
+        tenants = set()
+        if self.overlay_dir and os.path.isdir(self.overlay_dir):
+            tenants.update(name for name in os.listdir(self.overlay_dir)
+                           if not name.startswith(".") and os.path.isdir(os.path.join(self.overlay_dir, name)))
+        self._tenants = frozenset(tenants)
+        return self._tenants
+
+    def tenant_catalog(self, tenant, locale, locale_dict):
+        """
+        Strings of a locale as a tenant sees them: a LayeredCatalog of the tenant's overlay on top of the
+        locale's strings, or the locale's strings themselves if the tenant overrides none of them.
+        The view is kept for each tenant and locale, so every request for them shares it.
+        :param tenant: tenant name
+        :param locale: canonical locale code, e.g. 'pt-BR'
+        :param locale_dict: strings loaded for the locale
+        """
+        layered = self._layered.get((tenant, locale))
+        if layered is not None and layered.base is locale_dict:
+            return layered
+        overlay = self.load_overlay(tenant, locale)
+        if not overlay:
+            return locale_dict
+        layered = self._layered[(tenant, locale)] = LayeredCatalog(overlay, locale_dict)
+        return layered
+
+    def load_overlay(self, tenant, locale):  # -> dict
+        """
+        Strings a tenant overrides in a locale, loaded from its best matching overlay file the first time
+        :param tenant: tenant name
+        :param locale: canonical locale code, e.g. 'pt-BR'
+        :return: dict {strid:string}, empty if the tenant has no overlay for the locale
+        """
+        loaded = self._overlays.get((tenant, locale))
+        if loaded is None:
+            filepath = self.best_overlay_file(tenant, locale)
+            if filepath:
+                stat = os.stat(filepath)
+                loaded = (load_strings_file(filepath), "{0:x}-{1:x}".format(stat.st_mtime_ns, stat.st_size))
+            elif tenant not in self.tenants:
+                return {}   # tenants come from requests, so only keep entries for those with a directory
+            else:
+                loaded = ({}, "")
+            self._overlays[(tenant, locale)] = loaded
+        return loaded[0]
+
+    def best_overlay_file(self, tenant, locale):
+        """ first choice is exact match, second is any other locale with same language, in the tenant's directory """
+        if not self.overlay_dir:
+            return None
+        if not tenant or tenant != os.path.basename(tenant) or tenant.startswith("."):
+            self.problems.report("bad-tenant", locale, tenant, logging.ERROR, "ptrans invalid tenant %r", tenant)
+            return None
+        if tenant not in self.tenants:
+            return None
+        locale = locale.lower()
+        for filename in (locale + ".json", locale.partition("-")[0] + "-*.json"):
+            file_list = sorted(glob.glob(os.path.join(self.overlay_dir, tenant, filename)))
+            if file_list:
+                return file_list[0]
+        return None
+
+    def load_locale(self, locale, strid=None, prefixes=None):  # -> dict
         """
         Load best match for requested locale dict
+        :param locale: locale code, e.g. 'pt-BR'
+        :param strid: if the locale is sharded, only load the shards that may hold this string ID
+        :param prefixes: if the locale is sharded, only load the shards that may hold string IDs with these prefixes
+        """
+        locale = self._canonical.get(locale) or self.canonical_locale(locale)
+        if self.pseudo_locale and locale.lower() == self.pseudo_locale.lower():
+            if self._pseudo_strings is None:
+                self._pseudo_strings = PseudoLocalisedStrings(self, self.pseudo_base_locale)
+            self.locales[locale] = self._pseudo_strings
+            return self._pseudo_strings
+        if self.background_loading:
+            return self.load_in_background(locale, strid, prefixes)
+        return self.load_locale_now(locale, strid, prefixes)
+
+    def load_locale_now(self, locale, strid=None, prefixes=None):  # -> dict
+        """
+        Load best match for requested locale dict, without returning until it is loaded
         """
         # first try the hook function if one was provided
         if self.locale_hook:
-            lang, hyphen, variant = locale.partition("-")
             string_dict = self.locale_hook(locale)
-            if string_dict:
-                self.locales[locale] = string_dict
-                if lang not in self.locales:
-                    self.locales[lang] = string_dict    # set this as the default locale for the base language too
-            else:
-                if hyphen and lang in self.locales:
-                    self.locales[locale] = string_dict = self.locales[lang]    # make do with base language locale
-            return string_dict
+            if inspect.isawaitable(string_dict):
+                string_dict = self._await_hook(locale, string_dict)
+                if string_dict is None:
+                    return {}   # still being fetched
+            return self._add_hook_strings(locale, string_dict)
+
+        # See if the manifest says it is split into shards
+        actual_locale = self.manifest and self._manifest_locale(locale.lower())
+        if actual_locale and "shards" in self.manifest[actual_locale]:
+            return self.load_shards(locale, actual_locale, strid, prefixes)
 
         # See if we have strings in a file
         filepath = self.best_file_for_locale(locale.lower())
         if not filepath:
-            logging.warning("ptrans no translations for locale %s", locale)
+            self.problems.report("no-translations", locale, None, logging.WARNING,
+                                 "ptrans no translations for locale %s", locale)
             self.locales[locale] = {}  # give up, always fall back to untranslated text
+            self._versions[locale] = ""
             return {}
         else:
             actual_locale_file = os.path.basename(filepath)
-            actual_locale = os.path.splitext(actual_locale_file)[0]
+            actual_locale = self.canonical_locale(os.path.splitext(actual_locale_file)[0])
             if actual_locale in self.locales:
                 string_dict = self.locales[locale] = self.locales[actual_locale]  # alias to already loaded locale
             else:
-                logging.info("ptrans loading %s", filepath)
-                with open(filepath, "r", encoding="utf-8") as jsonfile:
-                    try:
-                        string_dict = json.load(jsonfile)
-                        # in case files haven't been aggregated and simplified...
-                        for k, v in string_dict.items():
-                            # can cope with both of Pootle's JSON formats
-                            if type(v) is dict:
-                                # we only want the string value, not the comments
-                                string_dict[k] = v.get("value")
-                    except ValueError:
-                        logging.error("ptrans invalid json in %s", filepath)
-                        string_dict = {}    # give up, fall back to untranslated text
-                self.locales[locale] = string_dict
+                string_dict = load_strings_file(filepath)
                 self.locales[actual_locale] = string_dict
+                self._versions[actual_locale] = self.file_version(actual_locale, filepath)
+                self.locales[locale] = string_dict
+            self._versions[locale] = self._versions.get(actual_locale)
             return string_dict
 
+    def _add_hook_strings(self, locale, string_dict):
+        """ keep the strings the locale hook gave for a locale, or make do with its language if it gave none """
+        lang, hyphen, variant = locale.partition("-")
+        if string_dict:
+            self.generation += 1
+            self.locales[locale] = string_dict
+            self._versions[locale] = "hook-{0}".format(self.generation)
+            if lang not in self.locales:
+                self.locales[lang] = string_dict    # set this as the default locale for the base language too
+                self._versions[lang] = self._versions[locale]
+        else:
+            if locale not in self._unknown_locales and len(self._unknown_locales) < self.max_unknown_locales:
+                self._unknown_locales.add(locale)
+            if hyphen and lang in self.locales:
+                string_dict = self.locales[lang]    # make do with base language locale
+                if locale in self._unknown_locales:     # and keep it, unless beyond the limit of unknown locales
+                    self.locales[locale] = string_dict
+                    self._versions[locale] = self._versions.get(lang)
+        return string_dict or {}
+
+    def _await_hook(self, locale, awaitable):
+        """
+        Result of an async locale hook called from synchronous code. With no event loop running in this thread,
+        it is run to completion. Otherwise the event loop can't be blocked, so the fetch carries on as a task
+        and None is returned, to use the fallbacks meanwhile.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(_wait_for(awaitable))
+        if locale in self._async_pending:
+            if inspect.iscoroutine(awaitable):
+                awaitable.close()   # already being fetched
+        else:
+            self._async_pending[locale] = loop.create_task(self._fetch_from_hook(locale, awaitable))
+        return None
+
+    async def load_locale_async(self, locale, strid=None, prefixes=None):  # -> dict
+        """
+        Load best match for requested locale dict, awaiting the locale hook if it is a coroutine function.
+        Concurrent calls for a locale share one call of the hook.
+        """
+        locale = self._canonical.get(locale) or self.canonical_locale(locale)
+        locale_dict = self.locales.get(locale)
+        if locale_dict and locale not in self._partial_locales:
+            return locale_dict
+        if self.locale_hook is None or (self.pseudo_locale and locale.lower() == self.pseudo_locale.lower()):
+            return self.load_locale(locale, strid, prefixes)
+        task = self._async_pending.get(locale)
+        if task is None:
+            task = self._async_pending[locale] = asyncio.ensure_future(self._fetch_from_hook(locale))
+        return await asyncio.shield(task)   # a cancelled caller mustn't cancel the fetch for the others
+
+    async def _fetch_from_hook(self, locale, awaitable=None):
+        try:
+            string_dict = awaitable if awaitable is not None else self.locale_hook(locale)
+            if inspect.isawaitable(string_dict):
+                string_dict = await string_dict
+            return self._add_hook_strings(locale, string_dict)
+        finally:
+            self._async_pending.pop(locale, None)
+
+    def load_in_background(self, locale, strid=None, prefixes=None):  # -> dict
+        """
+        Start loading a locale in a background thread, unless it is already being loaded.
+        :return: strings to use in the meantime: the part of the locale loaded so far if any, otherwise
+          another locale of the same language that is loaded already, otherwise empty
+        """
+        if locale in self._partial_locales and not self._needs_shards(locale, strid, prefixes):
+            return self.locales[locale]     # nothing more to load for this
+        # take the interim strings before submitting, or the load could finish first and replace them
+        lang = locale.partition("-")[0]
+        interim = self.locales.get(locale) or self.locales.get(lang)
+        if not interim:
+            interim = next((string_dict for loaded_locale, string_dict in list(self.locales.items())
+                            if loaded_locale.partition("-")[0] == lang and string_dict), {})
+        with self._pending_lock:
+            if locale not in self._pending:
+                if self.executor is None:
+                    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+                self._pending[locale] = self.executor.submit(self._load_and_prefetch, locale, strid, prefixes)
+        return interim
+
+    def _load_and_prefetch(self, locale, strid, prefixes):
+        """
+        Load a locale in a background thread, then start loading other known locales of the same language
+        """
+        try:
+            string_dict = self.load_locale_now(locale, strid, prefixes)
+        finally:
+            with self._pending_lock:
+                self._pending.pop(locale, None)
+        lang = locale.partition("-")[0]
+        for sibling in sorted(self.canonical_locale(known) for known in self.known_locales):
+            if sibling.partition("-")[0] == lang and sibling not in self.locales:
+                # load all of a sibling, or at least the shards wanted for this locale
+                self.load_in_background(sibling, strid, prefixes)
+        return string_dict
+
+    def wait_for_loading(self, timeout=None):
+        """
+        Wait until locales being loaded in the background (and any they cause to be loaded) are ready
+        :param timeout: maximum seconds to wait for each locale
+        """
+        while True:
+            with self._pending_lock:
+                futures = list(self._pending.values())
+            if not futures:
+                return
+            done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+            if not_done:
+                return
+
+    def load_shards(self, locale, actual_locale, strid=None, prefixes=None):  # -> dict
+        """
+        Load the shards of a sharded locale that may contain the string ID or prefixes, into one dict
+        which is shared by all the shards of that locale.
+        :param locale: locale code requested, e.g. 'pt-BR'
+        :param actual_locale: locale in the manifest that is the best match for it, e.g. 'pt-br'
+        :param strid: string ID wanted, or None
+        :param prefixes: string ID prefixes wanted, or None (load all shards if neither is given)
+        """
+        actual_key = self.canonical_locale(actual_locale)
+        string_dict = self.locales.get(actual_key)
+        if string_dict is None:
+            string_dict = {}
+            self._loaded_shards[actual_locale] = set()
+            self._partial_locales.add(actual_key)
+        self.locales[actual_key] = self.locales[locale] = string_dict     # the actual locale first, as for files
+        self._versions[locale] = self._versions[actual_key] = self.manifest[actual_locale].get("hash")
+        loaded = self._loaded_shards[actual_locale]
+        shards = self.manifest[actual_locale]["shards"]
+        for name in sorted(self.wanted_shards(actual_locale, strid, prefixes) - loaded):
+            string_dict.update(load_strings_file(os.path.join(self.localisation_dir, shards[name]["file"])))
+            loaded.add(name)
+        if len(loaded) < len(shards):
+            self._partial_locales.add(locale)
+        else:
+            # all shards are in, so no need to check again for any locale sharing this dict
+            self._partial_locales = {k for k in self._partial_locales if self.locales.get(k) is not string_dict}
+        return string_dict
+
+    def wanted_shards(self, actual_locale, strid=None, prefixes=None):
+        """
+        Names of the shards of a sharded locale that may contain the string ID or prefixes, remembered
+        so that asking again for strings not in any shard loaded costs a dict lookup
+        :param actual_locale: locale in the manifest, e.g. 'pt-br'
+        :param strid: string ID wanted, or None
+        :param prefixes: string ID prefixes wanted, or None (all shards if neither is given)
+        :return: set of shard names
+        """
+        if strid is not None:
+            prefixes = (strid,)
+        key = (actual_locale, tuple(prefixes) if prefixes is not None else None, strid is not None)
+        wanted = self._shard_queries.get(key)
+        if wanted is None:
+            wanted = frozenset(shards_for_prefixes(self.manifest[actual_locale]["shards"], prefixes,
+                                                   exact=strid is not None))
+            if len(self._shard_queries) < MAX_SHARD_QUERIES:
+                self._shard_queries[key] = wanted
+        return wanted
+
+    def _needs_shards(self, locale, strid=None, prefixes=None):
+        """ True if a partly loaded locale has shards still to load that may hold the string ID or prefixes """
+        actual_locale = self._manifest_locale(locale.lower())
+        return not self.wanted_shards(actual_locale, strid, prefixes) <= self._loaded_shards[actual_locale]
+
     def best_file_for_locale(self, locale):
         """ first choice is exact match, second is any other locale with same language """
         if not self.localisation_dir:
             return None
         lang, hyphen, variant = locale.partition('-')
+        manifest = self.manifest
+        if manifest:
+            # no need to search the directory, the manifest says what is there
+            actual_locale = self._manifest_locale(locale)
+            if not actual_locale or "file" not in manifest[actual_locale]:
+                return None
+            return os.path.join(self.localisation_dir, manifest[actual_locale]["file"])
         candidates = [locale + ".json",     # exactly matching locale
                       lang + "-*.json"]     # set of locale files in same language group
         best_match = None
@@ -180,43 +792,505 @@ class LazyLocalisedStringStore(object):
                 break
         return best_match
 
+    def file_version(self, actual_locale, filepath):
+        """
+        Cheap version of the strings in a locale file: its content hash from the manifest if there is one,
+        otherwise its modification time and size
+        """
+        entry = self.manifest.get(actual_locale.lower())
+        if entry and entry.get("hash"):
+            return entry["hash"]
+        stat = os.stat(filepath)
+        return "{0:x}-{1:x}".format(stat.st_mtime_ns, stat.st_size)
+
+    def catalog_version(self, locale=None):
+        """
+        Version of the strings loaded for a locale, which changes when they are reloaded with different content.
+        It is the content hash from the manifest, or the modification time and size of the file, or a
+        generation number if the strings came from the locale hook. If a tenant is bound and has an overlay
+        for the locale, the tenant and the version of its overlay are added.
+        :param locale: locale code, e.g. 'pt-BR', or None for the locale bound to the current context
+        :return: version string, or None if the locale isn't loaded
+        """
+        if not isinstance(locale, (str, type(u''))):
+            locale = self.current_locale
+        if locale and self.pseudo_locale and locale.lower() == self.pseudo_locale.lower():
+            locale = self.pseudo_base_locale    # pseudo-localised from these strings
+        locale = self._canonical.get(locale) or locale and self.canonical_locale(locale)
+        version = self._versions.get(locale)
+        tenant = self._tenant.get()
+        if version is not None and self.overlay_dir is not None and tenant is not None and \
+                self.load_overlay(tenant, locale):
+            version = "{0}+{1}-{2}".format(version, tenant, self._overlays[(tenant, locale)][1])
+        return version
+
+    def warm_from_profile(self, profile, max_locales=None):
+        """
+        Load the locales used according to a usage profile, most used first. Only the shards of sharded locales
+        that hold the strings used are loaded.
+        :param profile: filename of a profile written by a UsageRecorder, or {locale:{strid:count}}
+        :param max_locales: maximum number of locales to load [default all in the profile]
+        :return: list of the locales loaded
+        """
+        if not isinstance(profile, dict):
+            profile = usage.load_profile(profile)
+        warmed = []
+        for locale, strids in usage.hottest_locales(profile)[:max_locales]:
+            locale = self.canonical_locale(locale)
+            self.load_locale(locale, prefixes=[strid.rstrip("*") for strid in strids])
+            warmed.append(locale)
+        return warmed
+
+    def memory_stats(self, load_all=False):
+        """
+        Memory taken by the strings of each loaded locale, e.g. to see how much of a worker's memory they account for
+        :param load_all: load every known locale first, so that all of those on disk are measured
+        :return: {locale:{"type", "alias_of", "keys", "value_bytes", "deep_size", "duplicated_keys"}} where
+          type is the class of the strings (e.g. 'dict'), alias_of is the locale whose strings it shares (as
+          load_locale() does for locales without a file of their own) or None, keys is the number of strings,
+          value_bytes the total UTF-8 length of their values, deep_size an estimate of the bytes used by the dict,
+          its keys and values (each object counted once), and duplicated_keys the number of string IDs also
+          held by the strings of another locale. Aliases have the figures of the strings they share.
+        """
+        if load_all:
+            for locale in sorted(self.known_locales):
+                self.load_locale(locale)
+            self.wait_for_loading()
+        owners = {}     # {id(strings):first locale they were loaded for}
+        for locale, string_dict in list(self.locales.items()):
+            owners.setdefault(id(string_dict), locale)
+        key_counts = {}     # {strid:number of different locales' strings containing it}
+        for locale in owners.values():
+            string_dict = self.locales[locale]
+            if isinstance(string_dict, dict):
+                for strid in string_dict:
+                    key_counts[strid] = key_counts.get(strid, 0) + 1
+        measured = {}
+        for locale in owners.values():
+            string_dict = self.locales[locale]
+            if isinstance(string_dict, dict):
+                measured[locale] = {
+                    "keys": len(string_dict),
+                    "value_bytes": sum(len(value.encode("utf-8")) for value in string_dict.values()
+                                       if isinstance(value, type(u''))),
+                    "deep_size": _deep_size(string_dict),
+                    "duplicated_keys": sum(1 for strid in string_dict if key_counts[strid] > 1)}
+            else:
+                # e.g. pseudo-localised or SQLite strings, not held in memory as a dict
+                measured[locale] = {"keys": 0, "value_bytes": 0, "deep_size": sys.getsizeof(string_dict),
+                                    "duplicated_keys": 0}
+        stats = {}
+        for locale, string_dict in list(self.locales.items()):
+            owner = owners[id(string_dict)]
+            stats[locale] = dict(measured[owner], type=string_dict.__class__.__name__,
+                                 alias_of=owner if owner != locale else None)
+        return stats
+
+    def reload_locale(self, locale):
+        """
+        Forget the strings loaded for a locale (and for other locales sharing them), and load them again,
+        e.g. after the localisation files have been updated
+        :param locale: locale code, e.g. 'pt-BR'
+        :return: the reloaded strings
+        """
+        locale = self.canonical_locale(locale)
+        string_dict = self.locales.get(locale)
+        names = {k for k, v in self.locales.items() if k == locale or v is string_dict}
+        for name in names:
+            del self.locales[name]
+            self._versions.pop(name, None)
+            self._loaded_shards.pop(name.lower(), None)
+            self._partial_locales.discard(name)
+        self._messages = collections.OrderedDict(
+            (key, cached) for key, cached in self._messages.items() if key[0] not in names)
+        self._overlays = {key: loaded for key, loaded in self._overlays.items() if key[1] not in names}
+        self._layered = {key: layered for key, layered in self._layered.items() if key[1] not in names}
+        self._subset_json = collections.OrderedDict(
+            (key, markup) for key, markup in self._subset_json.items() if key[0] not in names)
+        self.generation += 1
+        self._manifest = None   # files may have changed, so read the manifest again
+        self._shard_queries = {}
+        self._known_locales = None
+        self._canonical = {}
+        return self.load_locale(locale)
+
+    def reload(self):
+        """
+        Forget all the strings loaded, so they are loaded again as needed
+        """
+        self.generation += 1
+        self.locales = {}
+        self._versions = {}
+        self._messages = collections.OrderedDict()
+        self._overlays = {}
+        self._layered = {}
+        self._tenants = None
+        self._subset_json = collections.OrderedDict()
+        self._loaded_shards = {}
+        self._partial_locales = set()
+        self._shard_queries = {}
+        self._manifest = None
+        self._known_locales = None
+        self._canonical = {}
+        self._unknown_locales = set()
+
+    def _manifest_locale(self, locale):
+        """ locale in the manifest that is the best match: exact match, or default for the same language """
+        if locale in self.manifest:
+            return locale
+        return self._manifest_aliases.get(locale.partition('-')[0])
+
     @property
     def known_locales(self):
         """
         Set of the locales directly provided by localised files (including generic languages of specific locales)
         """
-        if self._known_locales:     # memoize
+        if self._known_locales is not None:     # memoize
             return self._known_locales
-        if not self.localisation_dir:
-            return set()
-        file_list = glob.glob(os.path.join(self.localisation_dir, "*.json"))
-        for filepath in file_list:
-            locale = os.path.splitext(os.path.basename(filepath))[0]
-            self._known_locales.add(locale)
-            lang, hyphen, variant = locale.partition('-')
-            if hyphen:
-                self._known_locales.add(lang)
-        return self._known_locales
+        known_locales = set()
+        if self.pseudo_locale:
+            known_locales.add(self.pseudo_locale)
+        manifest = self.manifest
+        if manifest:
+            known_locales.update(manifest)
+            known_locales.update(self._manifest_aliases)
+        elif self.localisation_dir:
+            file_list = glob.glob(os.path.join(self.localisation_dir, "*.json"))
+            for filepath in file_list:
+                locale = os.path.splitext(os.path.basename(filepath))[0]
+                if locale.startswith("_"):
+                    continue    # not a locale, e.g. the manifest
+                known_locales.add(locale)
+                lang, hyphen, variant = locale.partition('-')
+                if hyphen:
+                    known_locales.add(lang)
+        self._known_locales = known_locales
+        return known_locales
+
+    def canonical_locale(self, locale):
+        """
+        Key for a locale in this store: the locale with the usual separator and case (see format_locale), interned.
+        Unknown locales (without a file to match them) are given keys of their own up to max_unknown_locales.
+        Beyond that, they get the key of their language if it is known, or UNKNOWN_LOCALE, which has no strings.
+        With a locale hook, there's no telling which locales are unknown before asking it, so every locale keeps
+        its own key, and _add_hook_strings counts the ones the hook has nothing for.
+        :param locale: locale code as given, e.g. 'pt_br'
+        :return: canonical locale code, e.g. 'pt-BR'
+        """
+        canonical = self._canonical.get(locale)
+        if canonical is not None:
+            return canonical
+        canonical = format_locale(locale)
+        if self.pseudo_locale and canonical.lower() == self.pseudo_locale.lower():
+            canonical = self.pseudo_locale
+        elif canonical not in self.locales and canonical not in self._unknown_locales and self.locale_hook is None:
+            known, known_lower = self._known_lower
+            if known is not self.known_locales:
+                known = self.known_locales
+                known_lower = frozenset(k.lower() for k in known)
+                self._known_lower = (known, known_lower)
+            if canonical.lower() not in known_lower:
+                if len(self._unknown_locales) < self.max_unknown_locales:
+                    self._unknown_locales.add(canonical)
+                else:
+                    lang = canonical.partition("-")[0]
+                    canonical = lang if lang in known_lower else UNKNOWN_LOCALE
+        canonical = sys.intern(canonical)
+        if len(self._canonical) < MAX_LOCALE_SPELLINGS:
+            self._canonical[locale] = self._canonical[canonical] = canonical
+        return canonical
+
+    @property
+    def manifest(self):
+        """
+        Locales listed in the manifest written by ptrans_aggregate, if there is one in the localisation
+        directory: {locale:{"file", "hash", "strings", "bytes", "aliases"}}. Empty if there is no manifest.
+        """
+        if self._manifest is None:
+            self._manifest = {}
+            if self.localisation_dir:
+                filepath = os.path.join(self.localisation_dir, MANIFEST_FILENAME)
+                if os.path.exists(filepath):
+                    with open(filepath, "r", encoding="utf-8") as manifest_file:
+                        try:
+                            self._manifest = json.load(manifest_file)["locales"]
+                        except (ValueError, KeyError):
+                            logging.error("ptrans invalid manifest %s", filepath)
+                    self._manifest_aliases = {alias: locale for locale, entry in self._manifest.items()
+                                              for alias in entry.get("aliases", [])}
+        return self._manifest
+
+
+class PseudoLocalisedStrings(object):
+    """
+    Read-only dict-like view of the strings of a base locale, pseudo-localised when first asked for.
+    Each result is cached per string ID, along with the text it came from, so it is only mangled again
+    if that text changes. Strings missing from the base locale are pseudo-localised from the default given.
+    """
+
+    def __init__(self, store, base_locale, seed=0):
+        self.store = store
+        self.base_locale = store.canonical_locale(base_locale)  # the key its strings are kept under
+        self.mangling_map = pseudolocalise.ManglingMap(seed)
+        self.cache = {}     # {strid:(source_text, mangled_text)}
+
+    def base_strings(self, strid=None, prefixes=None):
+        """ strings of the base locale, making sure those for strid or prefixes are loaded if given """
+        store = self.store
+        base_dict = store.locales.get(self.base_locale)
+        if not base_dict and (base_dict is None or store.locale_hook) or \
+                self.base_locale in store._partial_locales and (strid is None or strid not in base_dict) and \
+                store._needs_shards(self.base_locale, strid, prefixes):
+            base_dict = store.load_locale(self.base_locale, strid=strid, prefixes=prefixes)
+        return base_dict
+
+    def get(self, strid, default=None):
+        source = self.base_strings(strid).get(strid) or default
+        if not source or not isinstance(source, (str, type(u''))):
+            return source
+        cached = self.cache.get(strid)
+        if cached is not None and cached[0] == source:
+            return cached[1]
+        mangled = pseudolocalise.mangle_string(source, self.mangling_map)
+        self.cache[strid] = (source, mangled)
+        return mangled
+
+    def __getitem__(self, strid):
+        mangled = self.get(strid)
+        if mangled is None:
+            raise KeyError(strid)
+        return mangled
+
+    def __contains__(self, strid):
+        return strid in self.base_strings(strid)
+
+    def keys(self):
+        return self.base_strings().keys()
+
+    def items(self):
+        return [(k, self.get(k)) for k in list(self.keys())]
+
+    def subset(self, prefixes):
+        """ pseudo-localised strings whose IDs start with any of the prefixes, mangling only those """
+        prefixes = tuple(prefixes)
+        return {k: self.get(k) for k in list(self.base_strings(prefixes=prefixes).keys()) if k.startswith(prefixes)}
+
+
+class LayeredCatalog(object):
+    """
+    Read-only dict-like view of a tenant's overlay on top of the strings of a locale. The overlay holds only
+    the strings the tenant overrides, and the base strings are shared with every other tenant. A flattened
+    dict of both is only built when all the strings are asked for (e.g. by subset()), and kept until the base
+    strings change.
+    """
+
+    def __init__(self, overlay, base):
+        self.overlay = overlay
+        self.base = base
+        self._flat = (None, None)  # (number of base strings it was built from, merged dict)
+
+    def get(self, strid, default=None):
+        value = self.overlay.get(strid)
+        if value is None:
+            return self.base.get(strid, default)
+        return value
+
+    def __getitem__(self, strid):
+        value = self.get(strid)
+        if value is None:
+            raise KeyError(strid)
+        return value
+
+    def __contains__(self, strid):
+        return strid in self.overlay or strid in self.base
+
+    def __bool__(self):
+        return bool(self.overlay) or bool(self.base)
+
+    def flattened(self):
+        """ dict of all the strings, with those of the overlay in place of the base ones """
+        base_size = len(self.base) if isinstance(self.base, dict) else None
+        size, flat = self._flat
+        if flat is None or base_size is None or size != base_size:     # e.g. more shards have been loaded
+            flat = dict(self.base.items())
+            flat.update(self.overlay)
+            if base_size is not None:
+                self._flat = (base_size, flat)
+        return flat
+
+    def keys(self):
+        return self.flattened().keys()
+
+    def items(self):
+        return self.flattened().items()
+
+
+def _deep_size(string_dict):
+    """ estimated bytes used by a dict of strings and its keys and values, counting each object once """
+    seen = set()
+    size = sys.getsizeof(string_dict)
+    for item in string_dict.items():
+        for obj in item:
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                size += sys.getsizeof(obj)
+    return size
+
+
+def load_strings_file(filepath):
+    """
+    Load a dict of strings from a JSON file in either of Pootle's formats.
+    Entries like {"value": ..., "comment": ...} are reduced to their value as they are decoded,
+    so the full nested structure is never held in memory alongside the flattened one.
+    :param filepath: path to JSON file
+    :return: dict {strid:string}, empty if the file isn't valid JSON
+    """
+    logging.info("ptrans loading %s", filepath)
+    with open(filepath, "r", encoding="utf-8") as jsonfile:
+        try:
+            string_dict = json.load(jsonfile, object_hook=_pootle_value)
+            if not isinstance(string_dict, dict):
+                # the top level had a string ID "value", so it was mistaken for an entry
+                jsonfile.seek(0)
+                string_dict = json.load(jsonfile)
+            # entries with no "value" at all are left as dicts by _pootle_value
+            for k, v in string_dict.items():
+                if type(v) is dict:
+                    string_dict[k] = v.get("value")
+        except ValueError:
+            logging.error("ptrans invalid json in %s", filepath)
+            string_dict = {}    # give up, fall back to untranslated text
+    return string_dict
+
+
+def _pootle_value(obj):
+    """
+    object_hook for json.load: an object that looks like a Pootle entry is decoded as just its value,
+    we only want the string value, not the comments
+    """
+    if "value" in obj:
+        return obj["value"]
+    return obj
+
+
+def shards_for_prefixes(shards, prefixes=None, exact=False):
+    """
+    Names of the shards that may hold string IDs beginning with any of the prefixes.
+    A shard with no prefixes of its own is the default, for string IDs not matching any other shard.
+    :param shards: {name:{"prefixes":[...], ...}} from a manifest entry
+    :param prefixes: string ID prefixes, or None for all shards
+    :param exact: the prefixes are complete string IDs, so shards for longer prefixes can't hold them
+    :return: set of shard names
+    """
+    if prefixes is None:
+        return set(shards)
+    wanted = set()
+    for prefix in prefixes:
+        claimed = False
+        for name, shard in shards.items():
+            for shard_prefix in shard.get("prefixes", ()):
+                if prefix.startswith(shard_prefix):
+                    claimed = True
+                    wanted.add(name)
+                elif not exact and shard_prefix.startswith(prefix):
+                    wanted.add(name)
+        if not claimed:
+            wanted.update(name for name, shard in shards.items() if not shard.get("prefixes"))
+    return wanted
 
 
 # This global string store is a singleton
 _global_string_store = LazyLocalisedStringStore()
 
 
+class TemplateStringRegistry(object):
+    """
+    The string IDs and fallbacks in each template, recorded by the {% ptrans %} extension as templates are
+    parsed, and the templates each one includes, extends or imports, where they are named by constant strings.
+    The manifest of a template includes the strings of all the templates it depends on.
+    """
+
+    def __init__(self, environment=None):
+        self.environment = environment  # to parse templates that haven't been parsed yet
+        self.strings = {}               # {template_name:{strid:fallback}}
+        self.dependencies = {}          # {template_name:[template_name]}
+        self._lock = threading.Lock()
+
+    def forget(self, name):
+        """ forget what was recorded for a template, before it is parsed again """
+        with self._lock:
+            self.strings[name] = {}
+            self.dependencies[name] = []
+
+    def add_string(self, name, strid, fallback):
+        with self._lock:
+            self.strings.setdefault(name, {})[strid] = fallback
+
+    def add_dependency(self, name, template_name):
+        with self._lock:
+            dependencies = self.dependencies.setdefault(name, [])
+            if template_name not in dependencies:
+                dependencies.append(template_name)
+
+    def manifest(self, name):
+        """
+        Strings used by a template and the templates it depends on, parsing any that haven't been yet
+        :param name: template name
+        :return: {strid:fallback}
+        """
+        strings = {}
+        seen = set()
+        to_visit = [name]
+        while to_visit:
+            template_name = to_visit.pop()
+            if template_name in seen:
+                continue
+            seen.add(template_name)
+            if template_name not in self.strings and self.environment is not None:
+                try:
+                    self.environment.get_template(template_name)    # parsing it records its strings
+                except jinja2.TemplateNotFound:
+                    logging.warning("ptrans template %s not found for manifest of %s", template_name, name)
+            for strid, fallback in self.strings.get(template_name, {}).items():
+                strings.setdefault(strid, fallback)
+            to_visit.extend(reversed(self.dependencies.get(template_name, [])))
+        return strings
+
+
 class PootleTranslationExtension(jinja2.ext.Extension):
     """
     Provide the {% ptrans %} tag
     """
     tags = {'ptrans'}
+    dependency_tags = {'include', 'extends', 'import', 'from'}
 
     def __init__(self, environment):
         """
         extend the environment so ptrans_lookup function is available
         """
         jinja2.ext.Extension.__init__(self, environment)
-        environment.globals.update(
-            ptrans_get=_global_string_store.lookup_cascade,
-            ptrans_subset=_global_string_store.subset)
+        environment.extend(ptrans_registry=TemplateStringRegistry(environment))
+        bind_environment(environment, _global_string_store)
+
+    def filter_stream(self, stream):
+        """
+        Record the templates that a template includes, extends or imports by name, as it is tokenized
+        """
+        registry = self.environment.ptrans_registry
+        if stream.name is not None:
+            registry.forget(stream.name)
+        previous = None
+        dependency = False  # in a tag naming other templates?
+        for token in stream:
+            if token.type == 'name' and previous is not None and previous.type == 'block_begin':
+                dependency = token.value in self.dependency_tags
+            elif dependency and token.type == 'string' and previous.type in ('name', 'lbracket', 'comma'):
+                if stream.name is not None:
+                    registry.add_dependency(stream.name, token.value)
+            elif token.type not in ('lbracket', 'comma'):
+                dependency = False  # the rest of the tag can't be resolved statically
+            previous = token
+            yield token
 
     def parse(self, parser):
         """
@@ -246,9 +1320,13 @@ class PootleTranslationExtension(jinja2.ext.Extension):
         name = parser.stream.expect('name')
         if name.value != 'endptrans':
             parser.fail('ptrans blocks can only contain text, not control structures', name.lineno)
+        if parser.name is not None:
+            self.environment.ptrans_registry.add_string(parser.name, strid, fallback)
 
-        # make a Call node that calls ptrans_lookup with the locale, strid and fallback
-        ptrans_node = jinja2.nodes.Call(jinja2.nodes.Name('ptrans_get', 'load'),
+        # make a Call node that calls ptrans_tag with the locale, strid and fallback
+        # (in an async environment the call is awaited if need be, so it can wait for an async locale hook)
+        tag_function = 'ptrans_tag_async' if self.environment.is_async else 'ptrans_tag'
+        ptrans_node = jinja2.nodes.Call(jinja2.nodes.Name(tag_function, 'load'),
                                         [jinja2.nodes.Name('locale', 'load'),
                                          jinja2.nodes.Const(strid),
                                          jinja2.nodes.Const(fallback)],
@@ -259,8 +1337,37 @@ class PootleTranslationExtension(jinja2.ext.Extension):
 ptrans = PootleTranslationExtension
 
 
-def init_localisation(localisation_directory=None, allow_empty=False, locale_hook=None):
+async def _wait_for(awaitable):
+    return await awaitable
+
+
+def bind_environment(environment, string_store):
+    """
+    Make the template functions in a jinja2 environment use the given string store
+    """
+    environment.ptrans_store = string_store
+    environment.globals.update(
+        ptrans_get=string_store.lookup_cascade,
+        ptrans_current=string_store.lookup_current,
+        ptrans_tag=string_store.lookup_tag,
+        ptrans_tag_async=string_store.lookup_tag_async,
+        ptrans_get_async=string_store.lookup_cascade_async,
+        ptrans_subset=string_store.subset,
+        ptrans_subset_json=string_store.subset_json,
+        ptrans_version=string_store.catalog_version,
+        ptrans_message=string_store.lookup_message)
+
+
+def init_localisation(localisation_directory=None, allow_empty=False, locale_hook=None, pseudo_locale=None,
+                      background_loading=False):
     _global_string_store.localisation_dir = localisation_directory
+    _global_string_store.background_loading = background_loading
+    _global_string_store.pseudo_locale = pseudo_locale
+    _global_string_store._pseudo_strings = None
+    _global_string_store._manifest = None   # directory may have changed, so look for its manifest again
+    _global_string_store._shard_queries = {}
+    _global_string_store._known_locales = None
+    _global_string_store._canonical = {}
     if callable(locale_hook):
         _global_string_store.install_locale_hook(locale_hook)
     _global_string_store.allow_empty = allow_empty
@@ -286,3 +1393,150 @@ def best_locale():
     except ImportError:
         pass
     return locale
+
+
+class PTrans(object):
+    """
+    Flask extension object, for applications that want their own string store rather than the global one.
+
+        ptrans = PTrans(app)
+
+    or, with an application factory:
+
+        ptrans = PTrans()
+        ...
+        ptrans.init_app(app)
+
+    Settings are taken from app.config:
+        PTRANS_LOCALISATION_DIR  path to directory containing LOCALE.json files
+        PTRANS_ALLOW_EMPTY       accept empty translations (default False)
+        PTRANS_LOCALE_HOOK       function to provide translations instead of files
+        PTRANS_PSEUDO_LOCALE     name of pseudo-locale to provide, e.g. 'qps-ploc'
+        PTRANS_BACKGROUND_LOADING  load locales in a background thread, using fallbacks until they are ready
+        PTRANS_DEFAULT_LOCALE    locale if nothing better matches the request (default 'en-GB')
+        PTRANS_USAGE_PROFILE     file to record a sample of string usage in, and to warm up from at startup
+        PTRANS_USAGE_SAMPLE_RATE fraction of lookups to record (default 0.01)
+        PTRANS_OVERLAY_DIR       path to directory containing TENANT/LOCALE.json overlay files
+
+    Each app gets its own string store and template functions. The locale for a request is chosen once,
+    when first needed, and kept on flask.g. It is available to all templates as {{locale}}.
+    """
+
+    def __init__(self, app=None):
+        self.locale_selector_func = None
+        self.tenant_selector_func = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        usage_profile = config.get("PTRANS_USAGE_PROFILE")
+        usage_recorder = None
+        if usage_profile:
+            usage_recorder = usage.UsageRecorder(usage_profile, config.get("PTRANS_USAGE_SAMPLE_RATE", 0.01))
+        string_store = LazyLocalisedStringStore(
+            config.get("PTRANS_LOCALISATION_DIR"),
+            allow_empty=config.get("PTRANS_ALLOW_EMPTY", False),
+            locale_hook=config.get("PTRANS_LOCALE_HOOK"),
+            pseudo_locale=config.get("PTRANS_PSEUDO_LOCALE"),
+            background_loading=config.get("PTRANS_BACKGROUND_LOADING", False),
+            usage_recorder=usage_recorder,
+            overlay_directory=config.get("PTRANS_OVERLAY_DIR"))
+        if usage_profile:
+            string_store.warm_from_profile(usage_profile)
+        app.extensions["ptrans"] = string_store
+        app.jinja_env.add_extension(PootleTranslationExtension)
+        bind_environment(app.jinja_env, string_store)
+        app.context_processor(self._inject_locale)
+        app.before_request(self._bind_locale)
+        app.teardown_request(self._unbind_locale)
+
+    def localeselector(self, func):
+        """
+        Decorator for a function that chooses the locale for a request (e.g. from the URL),
+        instead of matching the Accept-Language header. If it returns None, the header is used.
+        """
+        self.locale_selector_func = func
+        return func
+
+    def tenantselector(self, func):
+        """
+        Decorator for a function that chooses the tenant for a request (e.g. from the host name), whose
+        overlays are then used on top of the strings of the locale. If it returns None, there are no overlays.
+        """
+        self.tenant_selector_func = func
+        return func
+
+    @property
+    def string_store(self):
+        """ string store of the current app """
+        import flask
+        return flask.current_app.extensions["ptrans"]
+
+    def get_locale(self):
+        """
+        Locale for the current request, chosen once per request
+        :return: canonical locale code
+        """
+        import flask
+        locale = getattr(flask.g, "ptrans_locale", None)
+        if locale is None:
+            locale = flask.g.ptrans_locale = self.string_store.canonical_locale(self.select_locale())
+        return locale
+
+    def select_locale(self):
+        """
+        Choose the best locale for the current request
+        :return: locale code
+        """
+        import flask
+        locale = None
+        if self.locale_selector_func is not None:
+            locale = self.locale_selector_func()
+        if not locale and flask.has_request_context():
+            locale = flask.request.accept_languages.best_match(self.string_store.known_locales)
+        return locale or flask.current_app.config.get("PTRANS_DEFAULT_LOCALE", "en-GB")
+
+    def localised_etag(self, *extra):
+        """
+        ETag for a localised page, from the URL, the locale of the request, and the version of its strings
+        :param extra: anything else the page depends on, as strings
+        :return: entity tag
+        """
+        import flask
+        locale = self.get_locale()
+        parts = [flask.request.full_path, locale, self.string_store.catalog_version(locale) or ""]
+        parts.extend(extra)
+        return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def make_conditional(self, response, *extra):
+        """
+        Set the ETag of a localised response with localised_etag(), add Accept-Language to its Vary header,
+        and turn it into 304 Not Modified if the request's If-None-Match has the same ETag
+        :param response: flask response
+        :param extra: anything else the page depends on, as strings
+        :return: the response
+        """
+        import flask
+        response = flask.current_app.make_response(response)
+        response.set_etag(self.localised_etag(*extra))
+        response.vary.add("Accept-Language")
+        return response.make_conditional(flask.request)
+
+    def _inject_locale(self):
+        return {"locale": self.get_locale()}
+
+    def _bind_locale(self):
+        import flask
+        if self.tenant_selector_func is not None:
+            flask.g.ptrans_tenant_token = self.string_store.bind_tenant(self.tenant_selector_func())
+        flask.g.ptrans_token = self.string_store.bind_locale(self.get_locale())
+
+    def _unbind_locale(self, exc):
+        import flask
+        token = flask.g.pop("ptrans_token", None)
+        if token is not None:
+            self.string_store.unbind_locale(token)
+        tenant_token = flask.g.pop("ptrans_tenant_token", None)
+        if tenant_token is not None:
+            self.string_store.unbind_tenant(tenant_token)
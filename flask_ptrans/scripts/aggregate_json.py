@@ -8,6 +8,17 @@
     2. value of key must be a string or a dict with a "value" that is a string.
     3. the keys of the output file are sorted
 
+    A manifest (_manifest.json) is written alongside the locale files, recording for each locale its
+    file name, content hash, string count, size in bytes, and any language-group aliases it serves.
+
+    Optionally each locale can be split into shards, by string ID prefix or by the subdirectory the
+    strings came from, written as _shards/LOCALE/SHARD.json. The manifest records which string ID prefixes
+    each shard holds, so the string store can load just the shards it needs. Directories whose names start
+    with an underscore are not searched for source files, so shards aren't read back in as locales next time.
+
+    Optionally all the locales can also be written to one indexed SQLite database, for use with
+    flask_ptrans.sqlite_store.SqliteLocalisedStringStore.
+
 Copyright 2015 Skyscanner Ltd
 
 Licensed under the Apache License, Version 2.0 (the "License");
@@ -28,17 +39,26 @@ from __future__ import unicode_literals, print_function
 import os
 import argparse
 import glob
+import hashlib
 import re
 import logging
-from collections import defaultdict
+import sqlite3
+from collections import Counter, defaultdict
 import json
 
+from flask_ptrans.ptrans import MANIFEST_FILENAME
+
+DEFAULT_SHARD = "_other"    # shard for string IDs that don't match any of the shard prefixes
+SHARDS_DIRNAME = "_shards"  # directory for the shards of sharded locales, which isn't searched for sources
+
 
-def extract_all_locales(sources, pattern="*.json", encoding="utf-8"):
+def extract_all_locales(sources, pattern="*.json", encoding="utf-8", key_owners=None):
     """
-    Aggregate all translated strings into one dict per locale
+    Aggregate all translated strings into one dict per locale.
+    Files in directories whose names start with an underscore (such as SHARDS_DIRNAME) are ignored.
     :param sources: list of source directories
     :param pattern: glob pattern for files to consider
+    :param key_owners: if given, dict to update with {key:owner}, the owner being the directory the key was found in
     :return: dict of dicts of all strings found, {locale:{key:value}}
     """
     all_locales = defaultdict(dict)
@@ -47,23 +67,29 @@ def extract_all_locales(sources, pattern="*.json", encoding="utf-8"):
     for source in sources:
         filename_pattern = os.path.join(source, pattern)
         for filename in glob.glob(filename_pattern):
+            subdirs = os.path.relpath(os.path.dirname(filename), source).split(os.sep)
+            if any(subdir.startswith("_") for subdir in subdirs):
+                continue    # e.g. shards written by a previous run
             basename = os.path.basename(filename)
             locale_match = locale_rx.match(basename)
             if not locale_match:
                 continue
             locale = locale_match.group('locale')
             locale_dict = all_locales[locale]
-            total_errors += extract_locale_strings(filename, locale_dict, encoding)
+            owner = os.path.basename(os.path.dirname(filename)) if key_owners is not None else None
+            total_errors += extract_locale_strings(filename, locale_dict, encoding, key_owners, owner)
     # put count of errors in the dict if there were any
     if total_errors:
         all_locales["ERRORS"] = total_errors
     return all_locales
 
 
-def extract_locale_strings(filename, locale_dict, encoding):
+def extract_locale_strings(filename, locale_dict, encoding, key_owners=None, owner=None):
     """
     :param filename: JSON file containing strings
     :param locale_dict: dictionary to update with strings
+    :param key_owners: if given, dict to update with {key:owner} for the keys read from this file
+    :param owner: owner of the keys in this file
     :returns number of errors found
     """
     errors = 0
@@ -95,20 +121,184 @@ def extract_locale_strings(filename, locale_dict, encoding):
             if not value:
                 continue    # don't include empty strings
             locale_dict[k] = value
+            if key_owners is not None:
+                key_owners.setdefault(k, owner)
         return errors
 
 
-def save_locale_files(destination, all_locales):
+def save_locale_files(destination, all_locales, minify=False, shard_prefixes=None, key_owners=None):
     """
     :param destination: destination directory
     :param all_locales: dict of all locales and their strings {locale:{key:value}}
-    :return:
+    :param minify: write compact JSON with no whitespace at all
+    :param shard_prefixes: if given, split each locale into shards by these string ID prefixes
+    :param key_owners: if given, split each locale into shards by owner of each key {key:owner}
+    :return: manifest of the files written {locale:{file, hash, strings, bytes, aliases}}
+      (sharded locales have {shards:{shard:{file, hash, strings, bytes, prefixes}}} instead of a file)
     """
+    manifest = {}
     for locale, string_dict in all_locales.items():
-        filename = os.path.join(destination, locale + ".json")
-        with open(filename, "w") as f:
-            json.dump(string_dict, f, sort_keys=True, indent=0)
-            logger.info("Wrote %s strings in %s", len(string_dict), filename)
+        if shard_prefixes or key_owners:
+            locale_dir = os.path.join(destination, SHARDS_DIRNAME, locale)
+            if not os.path.isdir(locale_dir):
+                os.makedirs(locale_dir)
+            shards = {}
+            for shard, (prefixes, shard_dict) in shard_strings(string_dict, shard_prefixes, key_owners).items():
+                basename = shard + ".json"
+                shards[shard] = write_json_file(os.path.join(locale_dir, basename), shard_dict, minify)
+                shards[shard]["file"] = SHARDS_DIRNAME + "/" + locale + "/" + basename
+                shards[shard]["prefixes"] = prefixes
+            entry = {
+                "shards": shards,
+                "hash": hashlib.sha1("".join(shards[k]["hash"] for k in sorted(shards)).encode("ascii")).hexdigest(),
+                "strings": sum(shard["strings"] for shard in shards.values()),
+                "bytes": sum(shard["bytes"] for shard in shards.values()),
+            }
+        else:
+            basename = locale + ".json"
+            entry = write_json_file(os.path.join(destination, basename), string_dict, minify)
+            entry["file"] = basename
+        entry["aliases"] = []
+        manifest[locale] = entry
+    for lang, locale in language_aliases(manifest).items():
+        manifest[locale]["aliases"].append(lang)
+    return manifest
+
+
+def write_json_file(filename, string_dict, minify=False):
+    """
+    :param filename: file to write
+    :param string_dict: dict of strings {key:value}
+    :param minify: write compact JSON with no whitespace at all
+    :return: dict of {hash, strings, bytes} describing the file written
+    """
+    if minify:
+        text = json.dumps(string_dict, sort_keys=True, separators=(",", ":"))
+    else:
+        text = json.dumps(string_dict, sort_keys=True, indent=0)
+    data = text.encode("utf-8")
+    with open(filename, "wb") as f:
+        f.write(data)
+        logger.info("Wrote %s strings in %s", len(string_dict), filename)
+    return {
+        "hash": hashlib.sha1(data).hexdigest(),
+        "strings": len(string_dict),
+        "bytes": len(data),
+    }
+
+
+def shard_strings(string_dict, shard_prefixes=None, key_owners=None):
+    """
+    Split the strings of one locale into shards, either by key prefix or by owner.
+    A key matching more than one prefix goes in the shard for the longest one.
+    Shards by owner are described by the prefixes of their keys, up to and including
+    the first underscore or hyphen.
+    :param string_dict: dict of strings {key:value}
+    :param shard_prefixes: list of key prefixes, each one naming a shard
+    :param key_owners: dict of {key:owner}, each owner naming a shard
+    :return: {shard:(prefixes, {key:value})}
+    """
+    shards = defaultdict(dict)
+    if key_owners:
+        for k, v in string_dict.items():
+            shards[key_owners.get(k, DEFAULT_SHARD)][k] = v
+        return {shard: (sorted(set(key_prefix(k) for k in shard_dict)), shard_dict)
+                for shard, shard_dict in shards.items()}
+    by_length = sorted(set(shard_prefixes), key=len, reverse=True)
+    names = shard_names(by_length)
+    for k, v in string_dict.items():
+        prefix = next((p for p in by_length if k.startswith(p)), None)
+        shards[prefix][k] = v
+    return {(names[prefix] if prefix else DEFAULT_SHARD): ([prefix] if prefix else [], shard_dict)
+            for prefix, shard_dict in shards.items()}
+
+
+def key_prefix(key):
+    """ key up to and including the first underscore or hyphen, or the whole key if there are none """
+    return re.match(r'[^_-]*[_-]?', key).group()
+
+
+def shard_name(prefix):
+    """ name of shard for a key prefix, e.g. 'flights' for 'flights_' """
+    return prefix.strip("_-") or prefix
+
+
+def shard_names(prefixes):
+    """
+    Names of the shards for key prefixes. Prefixes that would share a name, e.g. 'flights_' and 'flights-',
+    are named by the prefix itself instead.
+    :param prefixes: list of distinct key prefixes
+    :return: dict {prefix:shard name}
+    :raises ValueError: if two shards still have the same name
+    """
+    names = {prefix: shard_name(prefix) for prefix in prefixes}
+    counts = Counter(names.values())
+    names = {prefix: (name if counts[name] == 1 else prefix) for prefix, name in names.items()}
+    clashes = sorted(prefix for prefix, name in names.items()
+                     if name == DEFAULT_SHARD or list(names.values()).count(name) > 1)
+    if clashes:
+        raise ValueError("shard prefixes {0} would share a shard name".format(", ".join(clashes)))
+    return names
+
+
+def language_aliases(locales):
+    """
+    The locale that serves as the default for each language group, the same way that
+    LazyLocalisedStringStore picks one when it has no exact match: the first of the locales
+    with that language.
+    :param locales: collection of locale names
+    :return: dict {language:locale}
+    """
+    aliases = {}
+    for locale in sorted(locales):
+        lang, hyphen, variant = locale.partition("-")
+        if hyphen and lang not in aliases:
+            aliases[lang] = locale
+    return aliases
+
+
+def save_manifest(destination, manifest):
+    """
+    :param destination: destination directory
+    :param manifest: dict of {locale:{file, hash, strings, bytes, aliases}} as returned by save_locale_files
+    """
+    filename = os.path.join(destination, MANIFEST_FILENAME)
+    with open(filename, "w") as f:
+        json.dump({"locales": manifest}, f, sort_keys=True, indent=2)
+        logger.info("Wrote manifest of %s locales in %s", len(manifest), filename)
+
+
+def save_sqlite_catalog(filename, all_locales, manifest=None):
+    """
+    Write all locales to a SQLite database, replacing any existing one.
+    :param filename: database file to write
+    :param all_locales: dict of all locales and their strings {locale:{key:value}}
+    :param manifest: manifest from save_locale_files, to record hashes of the locales (otherwise they are computed)
+    """
+    if os.path.exists(filename):
+        os.unlink(filename)
+    connection = sqlite3.connect(filename)
+    try:
+        with connection:
+            connection.executescript("""
+                CREATE TABLE strings (
+                    locale TEXT NOT NULL, strid TEXT NOT NULL, value TEXT NOT NULL,
+                    PRIMARY KEY (locale, strid)) WITHOUT ROWID;
+                CREATE TABLE locales (locale TEXT PRIMARY KEY, hash TEXT, strings INTEGER NOT NULL);
+                CREATE TABLE aliases (alias TEXT PRIMARY KEY, locale TEXT NOT NULL);
+                """)
+            for locale, string_dict in sorted(all_locales.items()):
+                connection.executemany("INSERT INTO strings VALUES (?, ?, ?)",
+                                       ((locale, k, v) for k, v in sorted(string_dict.items())))
+                if manifest:
+                    content_hash = manifest[locale]["hash"]
+                else:
+                    content_hash = hashlib.sha1(json.dumps(string_dict, sort_keys=True).encode("utf-8")).hexdigest()
+                connection.execute("INSERT INTO locales VALUES (?, ?, ?)", (locale, content_hash, len(string_dict)))
+            connection.executemany("INSERT INTO aliases VALUES (?, ?)", sorted(language_aliases(all_locales).items()))
+        logger.info("Wrote %s locales in %s", len(all_locales), filename)
+    finally:
+        connection.close()
 
 
 def main():
@@ -116,6 +306,11 @@ def main():
     add = ap.add_argument
     add("-v", "--verbose", default=False, action='store_true', help="Verbose output")
     add("-e", "--encoding", default="utf-8", help="input encoding (default utf-8)")
+    add("-m", "--minify", default=False, action='store_true', help="write compact JSON without whitespace")
+    add("-s", "--shard-prefix", default=[], action='append', help="split locales into shards by string ID prefix")
+    add("--shard-by-owner", default=False, action='store_true',
+        help="split locales into shards by the directory strings were found in")
+    add("--sqlite", metavar="FILE", help="also write all locales to this SQLite database")
     add("destination", help="directory to put aggregated files")
     add("sources", nargs="*", help="directory to look for json files [default is subdirs of destination]")
     args = ap.parse_args()
@@ -133,11 +328,20 @@ def main():
     else:
         logger.setLevel(logging.INFO)
 
-    all_locales = extract_all_locales(sources, pattern=file_pattern, encoding=args.encoding)
+    key_owners = {} if args.shard_by_owner else None
+    all_locales = extract_all_locales(sources, pattern=file_pattern, encoding=args.encoding, key_owners=key_owners)
     # only write output files if there were no errors, have failing exit code otherwise
     num_errors = all_locales.pop("ERRORS", 0)
     if num_errors == 0:
-        save_locale_files(args.destination, all_locales)
+        try:
+            manifest = save_locale_files(args.destination, all_locales, minify=args.minify,
+                                         shard_prefixes=args.shard_prefix, key_owners=key_owners)
+        except ValueError as err:
+            logger.error("%s", err)
+            raise SystemExit(1)
+        save_manifest(args.destination, manifest)
+        if args.sqlite:
+            save_sqlite_catalog(args.sqlite, all_locales, manifest)
     else:
         raise SystemExit(1)
 
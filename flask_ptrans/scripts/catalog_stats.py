@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+  catalog_stats.py [--sort locale|keys|bytes|size] [--json] [LOCALISATION_DIR]
+
+  Load every locale in a localisation directory (as a LazyLocalisedStringStore would) and report the memory taken
+  by each: the number of strings, the total size of their values, an estimate of the bytes used by the loaded
+  dict and its keys and values, and how many of its string IDs other locales have too. Locales that share the
+  strings of another, because they have no file of their own, are shown as aliases of it.
+
+  The total counts the strings shared by several locales once, and is compared with the memory traced while
+  loading them, to show how much of a worker's memory the catalogs account for.
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import sys
+import tracemalloc
+
+from flask_ptrans import ptrans
+
+SORT_FIELDS = {"locale": None, "keys": "keys", "bytes": "value_bytes", "size": "deep_size"}
+
+
+def directory_stats(localisation_dir):
+    """
+    Load all the locales in a directory and measure them
+    :return: ({locale:stats} as from LazyLocalisedStringStore.memory_stats, bytes traced while loading them)
+    """
+    string_store = ptrans.LazyLocalisedStringStore(localisation_dir)
+    tracemalloc.start()
+    try:
+        for locale in sorted(string_store.known_locales):
+            string_store.load_locale(locale)
+        traced = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return string_store.memory_stats(), traced
+
+
+def totals(stats):
+    """ :return: sums of the figures for the strings of each locale, counting those shared by aliases once """
+    owners = [figures for figures in stats.values() if figures["alias_of"] is None]
+    return {field: sum(figures[field] for figures in owners)
+            for field in ("keys", "value_bytes", "deep_size", "duplicated_keys")}
+
+
+def write_table(stats, traced, out, sort="locale"):
+    field = SORT_FIELDS[sort]
+    if field is None:
+        locales = sorted(stats)
+    else:
+        locales = sorted(stats, key=lambda locale: (-stats[locale][field], locale))
+    out.write("{0:<12} {1:<12} {2:>9} {3:>12} {4:>12} {5:>10}\n".format(
+        "locale", "alias of", "keys", "value KB", "size KB", "dup keys"))
+    for locale in locales:
+        figures = stats[locale]
+        out.write("{0:<12} {1:<12} {2:>9} {3:>12.1f} {4:>12.1f} {5:>10}\n".format(
+            locale, figures["alias_of"] or "", figures["keys"], figures["value_bytes"] / 1024.0,
+            figures["deep_size"] / 1024.0, figures["duplicated_keys"]))
+    total = totals(stats)
+    out.write("{0:<12} {1:<12} {2:>9} {3:>12.1f} {4:>12.1f} {5:>10}\n".format(
+        "total", "", total["keys"], total["value_bytes"] / 1024.0, total["deep_size"] / 1024.0,
+        total["duplicated_keys"]))
+    out.write("{0:.1f} KB traced while loading\n".format(traced / 1024.0))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    add = ap.add_argument
+    add("directory", nargs="?", default=".", help="directory containing LOCALE.json files [%(default)s]")
+    add("-s", "--sort", default="locale", choices=sorted(SORT_FIELDS), help="order of locales [%(default)s]")
+    add("--json", default=False, action="store_true", help="output JSON instead of a table")
+    args = ap.parse_args()
+    stats, traced = directory_stats(args.directory)
+    if args.json:
+        json.dump({"locales": stats, "total": totals(stats), "traced_bytes": traced}, sys.stdout, indent=2,
+                  sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        write_table(stats, traced, sys.stdout, sort=args.sort)
+
+if __name__ == '__main__':
+    main()
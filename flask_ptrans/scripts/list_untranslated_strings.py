@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 """
   list_untranslated_strings.py --dir DIRECTORY --locale LOCALE
+  list_untranslated_strings.py --matrix [--format json|csv] DIRECTORY ...
 
   scan en-gb.json files, and see which strings in them haven't been translated to the specified locale yet
   default directory is ., default locale is it-IT
 
+  With --matrix, compare every locale found in the directories at once, and output the percentage
+  of strings translated for each locale and directory (owner), with the keys that are missing.
+
 Copyright 2015 Skyscanner Ltd
 
 Licensed under the Apache License, Version 2.0 (the "License");
@@ -21,8 +25,14 @@ See the License for the specific language governing permissions and limitations
 """
 
 from __future__ import print_function, unicode_literals
+import csv
+import glob
 import json
 import argparse
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
 
 def load_strings(directory, locale):
@@ -31,19 +41,114 @@ def load_strings(directory, locale):
         return json.load(f)
 
 
+def string_value(v):
+    """ value of an entry in either of Pootle's formats """
+    if type(v) is dict:
+        return v.get("value")
+    return v
+
+
+def translated_keys(string_dict):
+    """ set of keys with nonempty values """
+    return {k for k, v in string_dict.items() if string_value(v)}
+
+
+def find_locales(dirs):
+    """ sorted list of locales with a file in any of the directories """
+    locale_rx = re.compile(r'(?P<locale>[a-z]+(-[a-z]+)?)\.json$')
+    locales = set()
+    for dirname in dirs:
+        for filename in glob.glob(os.path.join(dirname, "*.json")):
+            locale_match = locale_rx.match(os.path.basename(filename))
+            if locale_match:
+                locales.add(locale_match.group('locale'))
+    return sorted(locales)
+
+
+_english_keys = {}  # {directory:set_of_keys} for the worker processes comparing each locale
+
+
+def _init_worker(english_keys):
+    global _english_keys
+    _english_keys = english_keys
+
+
+def missing_for_locale(locale):
+    """
+    :return: (locale, {directory:set_of_missing_keys}) comparing the locale with the English keys in each directory
+    """
+    missing = {}
+    for dirname, english in _english_keys.items():
+        try:
+            other = translated_keys(load_strings(dirname, locale))
+        except (IOError, OSError):
+            other = set()
+        missing[dirname] = english - other
+    return locale, missing
+
+
+def coverage_matrix(dirs, locales=None, processes=None):
+    """
+    Compare every locale with en-GB in each of the directories
+    :param dirs: list of directories containing en-gb.json and other locale files
+    :param locales: locales to compare [default is all that have files]
+    :param processes: size of process pool [default is number of CPUs]
+    :return: ({directory:number_of_english_strings}, {locale:{directory:sorted_list_of_missing_keys}})
+    """
+    english_keys = {dirname: translated_keys(load_strings(dirname, 'en-GB')) for dirname in dirs}
+    if locales is None:
+        locales = [locale for locale in find_locales(dirs) if locale != 'en-gb']
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(english_keys,)) as executor:
+        missing = {locale: {dirname: sorted(keys) for dirname, keys in by_dir.items()}
+                   for locale, by_dir in executor.map(missing_for_locale, locales)}
+    totals = {dirname: len(keys) for dirname, keys in english_keys.items()}
+    return totals, missing
+
+
+def coverage_percent(total, num_missing):
+    return round(100.0 * (total - num_missing) / total, 1) if total else 100.0
+
+
+def write_matrix(totals, missing, out, output_format="json"):
+    """
+    Write the coverage matrix of locales and directories, as CSV or as JSON (which also lists the missing keys)
+    """
+    dirs = sorted(totals)
+    grand_total = sum(totals.values())
+    coverage = {}
+    for locale, by_dir in missing.items():
+        coverage[locale] = {dirname: coverage_percent(totals[dirname], len(by_dir[dirname])) for dirname in dirs}
+        coverage[locale]["all"] = coverage_percent(grand_total, sum(len(keys) for keys in by_dir.values()))
+    if output_format == "csv":
+        writer = csv.writer(out)
+        writer.writerow(["locale"] + dirs + ["all"])
+        for locale in sorted(coverage):
+            writer.writerow([locale] + [coverage[locale][dirname] for dirname in dirs + ["all"]])
+    else:
+        json.dump({"strings": totals, "coverage": coverage, "missing": missing}, out, indent=2, sort_keys=True)
+        out.write("\n")
+
+
 def main():
     ap = argparse.ArgumentParser()
     add = ap.add_argument
     add("dirs", default=[], nargs="*", help="directories to search for en-gb.json files [default .]")
     add("--locale", default="it-IT")
+    add("-m", "--matrix", default=False, action="store_true", help="compare all locales and output coverage")
+    add("-f", "--format", default="json", choices=["json", "csv"], help="format of coverage matrix [%(default)s]")
+    add("-j", "--jobs", type=int, default=None, help="with --matrix, number of processes [default is CPU count]")
     args = ap.parse_args()
     if not args.dirs:
         args.dirs = ["."]
+    if args.matrix:
+        totals, missing = coverage_matrix(args.dirs, processes=args.jobs)
+        write_matrix(totals, missing, sys.stdout, output_format=args.format)
+        return
     for dirname in args.dirs:
         english_dict = load_strings(dirname, 'en-GB')
         other_dict = load_strings(dirname, args.locale)
         missing = sorted(k for k in english_dict
-                         if english_dict[k].get("value") and not other_dict.get(k, {}).get("value"))
+                         if string_value(english_dict[k]) and not string_value(other_dict.get(k, {})))
         for m in missing:
             print(m)
 
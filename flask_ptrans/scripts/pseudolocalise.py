@@ -1,9 +1,14 @@
 #! /usr/bin/env python
 """
     pseudolocalise json_file
+    pseudolocalise --batch [--seed N] directory ...
 
     read translatable strings in the json file, and emit a pseudo-localised version.
 
+    In batch mode, find every en-gb.json file in the directory trees and write a pseudo-localised
+    qps-ploc.json beside each one, in parallel. Each character is always mangled the same way for
+    a given seed, so output only changes where the English strings change.
+
 Copyright 2015 Skyscanner Ltd
 
 Licensed under the Apache License, Version 2.0 (the "License");
@@ -21,11 +26,13 @@ See the License for the specific language governing permissions and limitations
 
 from __future__ import print_function, unicode_literals
 import argparse
+import os
 import sys
 import json
 import unicodedata
 import random
 import re
+from concurrent.futures import ProcessPoolExecutor
 
 
 THINGS_ABOVE = ["TILDE", "DIAERESIS", "RING ABOVE", "CIRCUMFLEX ACCENT", "CARON"]
@@ -40,6 +47,35 @@ MANGLING_CHARS = (
     [unicodedata.lookup("COMBINING {0} OVERLAY".format(name)) for name in THINGS_THROUGH]
 )
 
+PLACEHOLDER_RX = re.compile(
+    r"""(     # group of
+        \{    # opening brace
+        [-a-zA-Z0-9 :!_.,+<>=^]+   # identifiers and numbers and limited Python formatting syntax
+        \}    # closing brace
+        )""", re.X)
+
+PRECOMPUTED_RANGE = range(0x20, 0x250)     # ASCII and Latin-1 and Latin Extended characters
+
+
+class ManglingMap(dict):
+    """
+    Table for str.translate, mapping each character to itself followed by a combining character.
+    The choice is made once per character, from a random generator with the given seed, so the same
+    seed always gives the same mangling. Characters outside the usual range are added when first seen.
+    """
+
+    def __init__(self, seed=None):
+        rng = random.Random(seed)
+        dict.__init__(self, ((i, chr(i) + rng.choice(MANGLING_CHARS)) for i in PRECOMPUTED_RANGE))
+        self.offset = rng.randrange(len(MANGLING_CHARS))
+
+    def __missing__(self, i):
+        mangled = self[i] = chr(i) + MANGLING_CHARS[(i + self.offset) % len(MANGLING_CHARS)]
+        return mangled
+
+
+_default_mangling_map = ManglingMap()
+
 
 def mangle_char(c):
     """
@@ -50,44 +86,98 @@ def mangle_char(c):
     return c + random.choice(MANGLING_CHARS)
 
 
-def mangle_string(s):
+def mangle_string(s, mangling_map=None):
     """
     pseudolocalise the characters of a string, but preserving any parts inside
     braces, which are placeholders for inserted values, and shouldn't be translated.
+    :param s: string to mangle
+    :param mangling_map: a ManglingMap, for a given seed [default is one chosen at random for this process]
     """
-    placeholder_rx = re.compile(
-        r"""(     # group of
-            \{    # opening brace
-            [-a-zA-Z0-9 :!_.,+<>=^]+   # identifiers and numbers and limited Python formatting syntax
-            \}    # closing brace
-            )""", re.X)
-    parts = placeholder_rx.split(s)
+    if mangling_map is None:
+        mangling_map = _default_mangling_map
+    parts = PLACEHOLDER_RX.split(s)
     for i, part in enumerate(parts):
         if not part.startswith("{"):    # mangle its contents
-            parts[i] = ''.join(mangle_char(c) for c in part)
+            parts[i] = part.translate(mangling_map)
     return '[' + ''.join(parts) + ']'
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    add = ap.add_argument
-    add("-v", "--verbose", default=False, action="store_true")
-    add("filename")
-    args = ap.parse_args()
-
-    with open(args.filename) as json_file:
-        string_dict = json.load(json_file)
+def pseudolocalise_dict(string_dict, mangling_map=None, verbose=False):
+    """
+    pseudolocalise all the strings in a dict loaded from a translation file (in either format), in place
+    """
     for key, trans in string_dict.items():
         if isinstance(trans, dict):
             before = trans.get("value", "")
-            mangled = mangle_string(before)
+            mangled = mangle_string(before, mangling_map)
             trans["value"] = mangled
         else:
             before = trans
-            mangled = mangle_string(before)
+            mangled = mangle_string(before, mangling_map)
             string_dict[key] = mangled
-        if args.verbose:
+        if verbose:
             print(before.encode('utf-8'), "->", mangled.encode('utf-8'), file=sys.stderr)
+    return string_dict
+
+
+def pseudolocalise_file(source, destination, seed=None):
+    """
+    read a translation file and write a pseudo-localised version of it
+    :return: destination
+    """
+    with open(source, encoding="utf-8") as json_file:
+        string_dict = json.load(json_file)
+    pseudolocalise_dict(string_dict, ManglingMap(seed))
+    with open(destination, "w", encoding="utf-8") as json_file:
+        json_file.write(json.dumps(string_dict, sort_keys=True, indent=2))
+    return destination
+
+
+def pseudolocalise_trees(directories, seed=0, source_locale="en-gb", target_locale="qps-ploc", processes=None):
+    """
+    pseudolocalise every source locale file in the directory trees, writing each result
+    as a target locale file in the same directory
+    :param directories: list of directories to search
+    :param seed: seed for choice of mangling characters
+    :param processes: size of process pool [default is number of CPUs]
+    :return: list of files written
+    """
+    sources = []
+    for directory in directories:
+        for dirpath, dirnames, basenames in os.walk(directory):
+            if source_locale + ".json" in basenames:
+                sources.append(os.path.join(dirpath, source_locale + ".json"))
+    destinations = [os.path.join(os.path.dirname(source), target_locale + ".json") for source in sorted(sources)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(pseudolocalise_file, sorted(sources), destinations, [seed] * len(sources)))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    add = ap.add_argument
+    add("-v", "--verbose", default=False, action="store_true")
+    add("-s", "--seed", type=int, default=None, help="seed for choice of mangling characters [default random]")
+    add("-b", "--batch", default=False, action="store_true",
+        help="arguments are directories: pseudolocalise all files found in them, in place")
+    add("--source-locale", default="en-gb", help="in batch mode, locale to pseudolocalise [%(default)s]")
+    add("--target-locale", default="qps-ploc", help="in batch mode, locale of files written [%(default)s]")
+    add("-j", "--jobs", type=int, default=None, help="in batch mode, number of processes [default is CPU count]")
+    add("filename", nargs="+", help="translation file, or directories in batch mode")
+    args = ap.parse_args()
+
+    if args.batch:
+        seed = 0 if args.seed is None else args.seed
+        written = pseudolocalise_trees(args.filename, seed=seed, source_locale=args.source_locale,
+                                       target_locale=args.target_locale, processes=args.jobs)
+        for filename in written:
+            print("Wrote", filename, file=sys.stderr)
+        return
+
+    if len(args.filename) > 1:
+        ap.error("only one filename allowed unless in batch mode")
+    with open(args.filename[0]) as json_file:
+        string_dict = json.load(json_file)
+    pseudolocalise_dict(string_dict, ManglingMap(args.seed), verbose=args.verbose)
 
     print(json.dumps(string_dict, sort_keys=True, indent=2))
 
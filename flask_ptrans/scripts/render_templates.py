@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+  render_templates.py -t TEMPLATE_DIR -l LOCALISATION_DIR [-o OUTPUT_DIR] [--locale LOCALE ...] TEMPLATE ...
+
+  Render templates for many locales at once, e.g. for transactional email or static landing pages.
+  The work is shared out between processes, one locale at a time. Each process compiles the templates once
+  and uses them for every locale it renders.
+
+  Output for each locale goes in OUTPUT_DIR/LOCALE/TEMPLATE. Without --output, rendered templates are
+  written to stdout as JSON lines of {locale, template, text}, as soon as each locale is done.
+  Without --locale, every locale with a file in the localisation directory is rendered.
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+import jinja2
+
+from flask_ptrans import ptrans
+
+
+def make_environment(template_dir, localisation_dir):
+    """
+    :return: jinja2 environment loading templates from a directory, with its own string store
+    """
+    environment = jinja2.Environment(loader=jinja2.FileSystemLoader(template_dir), autoescape=True,
+                                     extensions=[ptrans.PootleTranslationExtension,
+                                                 "flask_ptrans.fragments.ptranscache"])
+    ptrans.bind_environment(environment, ptrans.LazyLocalisedStringStore(localisation_dir))
+    return environment
+
+
+def _init_worker(template_dir, localisation_dir, template_names, context, output_dir):
+    global _environment, _templates, _context, _output_dir
+    _environment = make_environment(template_dir, localisation_dir)
+    _templates = [(name, _environment.get_template(name)) for name in template_names]    # compile once
+    _context = context
+    _output_dir = output_dir
+
+
+def render_locale(locale):
+    """
+    Render all the templates for one locale, in a worker process
+    :return: list of (locale, template_name, text), or (locale, template_name, filename) if writing files
+    """
+    string_store = _environment.ptrans_store
+    results = []
+    with string_store.using_locale(locale):
+        for name, template in _templates:
+            text = template.render(_context, locale=locale)
+            if _output_dir:
+                filename = os.path.join(_output_dir, locale, name)
+                if not os.path.isdir(os.path.dirname(filename)):
+                    os.makedirs(os.path.dirname(filename))
+                with open(filename, "w", encoding="utf-8") as output_file:
+                    output_file.write(text)
+                text = filename
+            results.append((locale, name, text))
+    string_store.reload()   # don't keep every locale rendered by this process in memory
+    return results
+
+
+def render_locales(template_dir, localisation_dir, template_names, locales, context=None, output_dir=None,
+                   processes=None):
+    """
+    Render templates for many locales, in a pool of processes
+    :param template_dir: directory containing the templates
+    :param localisation_dir: directory containing LOCALE.json files
+    :param template_names: names of the templates to render
+    :param locales: locales to render them in
+    :param context: dict of variables for the templates, as well as {{locale}}
+    :param output_dir: directory to write the output to, in LOCALE/TEMPLATE, or None to return it
+    :param processes: size of process pool [default is number of CPUs]
+    :return: iterator of (locale, template_name, text), or (locale, template_name, filename) if writing files,
+      in the order the locales are finished
+    """
+    initargs = (template_dir, localisation_dir, list(template_names), context or {}, output_dir)
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=initargs)
+    try:
+        for results in pool.imap_unordered(render_locale, locales):
+            for result in results:
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    add = ap.add_argument
+    add("-t", "--templates", default=".", help="directory containing templates [%(default)s]")
+    add("-l", "--localisation", required=True, help="directory containing LOCALE.json files")
+    add("-o", "--output", default=None, help="directory to write LOCALE/TEMPLATE files [default stdout]")
+    add("--locale", default=[], action="append", help="locale to render [default all in localisation directory]")
+    add("-c", "--context", default=None, help="JSON file of variables for the templates")
+    add("-j", "--jobs", type=int, default=None, help="number of processes [default is CPU count]")
+    add("template", nargs="+", help="name of template to render")
+    args = ap.parse_args()
+
+    locales = args.locale
+    if not locales:
+        locales = sorted(locale for locale in ptrans.LazyLocalisedStringStore(args.localisation).known_locales
+                         if "-" in locale)
+    context = None
+    if args.context:
+        with open(args.context, encoding="utf-8") as context_file:
+            context = json.load(context_file)
+    for locale, name, text in render_locales(args.templates, args.localisation, args.template, locales,
+                                             context=context, output_dir=args.output, processes=args.jobs):
+        if args.output:
+            print("Wrote", text, file=sys.stderr)
+        else:
+            print(json.dumps({"locale": locale, "template": name, "text": text}))
+
+if __name__ == '__main__':
+    main()
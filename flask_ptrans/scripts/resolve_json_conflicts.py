@@ -8,6 +8,12 @@
 
     It can save the corrected file back if all changes are resolved. Then you can git add and continue your merge.
 
+    In three-way mode it also uses the common ancestor of the two versions (from git's index, or
+    a file), so a key added, changed or deleted on only one side is resolved automatically.
+
+    In batch mode it finds all the conflicted JSON files (unmerged paths in git, or files containing conflict
+    markers under a directory) and resolves them in parallel, then lists which need interactive resolution.
+
 Copyright 2015 Skyscanner Ltd
 
 Licensed under the Apache License, Version 2.0 (the "License");
@@ -25,10 +31,13 @@ See the License for the specific language governing permissions and limitations
 from __future__ import print_function, unicode_literals
 
 import argparse
-import copy
+import hashlib
 import json
+import os
 import pprint
 import re
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
 
 # Python3 compatibility fixes
 if not hasattr(__builtins__, 'raw_input'):
@@ -83,44 +92,140 @@ def merge_objects(object_a, object_b, interactive=False):
 
     Can merge in any keys that are different between the two,
     but not any keys that are the same with different values.
+
+    The result shares its values with the two objects rather than copying them.
     """
     if type(object_a) is not dict or type(object_b) is not dict:
         raise TypeError("both objects must be dict")
-    result = copy.deepcopy(object_a)
+    result = dict(object_a)
     for k, v in object_b.items():
         if k not in result:
-            result[k] = copy.deepcopy(v)
+            result[k] = v
         elif v != result[k]:
-            resolved = False
-            if interactive:
-                while not resolved:
-                    print("Need to resolve value of key [{0}]".format(k))
-                    print("<<<<<<< (1)")
-                    pprint.pprint(result[k])
-                    print("=======")
-                    pprint.pprint(v)
-                    print(">>>>>>> (2)")
-                    answer = raw_input("Choose 1, 2, (A)bandon: ?")
-                    if answer == "2":
-                        result[k] = copy.deepcopy(v)
-                    elif answer in ("a", "A"):
-                        break
-                    resolved = answer in ("1", "2")
-            if not resolved:
+            choice = choose_interactively(k, result[k], v) if interactive else None
+            if choice is None:
                 raise UnableToResolveError(k)
+            if choice == 2:
+                result[k] = v
     return result
 
 
-def resolve_json_file(filename, interactive=False, update=False):
+_DELETED = object()     # marks a key missing from one version of an object
+
+
+def choose_interactively(k, value_1, value_2):
     """
-    Resolve conflicts in named JSON file
+    Ask the user which of two values a key should have
+    :return: 1 or 2, or None if the user abandons the merge
+    """
+    while True:
+        print("Need to resolve value of key [{0}]".format(k))
+        print("<<<<<<< (1)")
+        pprint.pprint("(deleted)" if value_1 is _DELETED else value_1)
+        print("=======")
+        pprint.pprint("(deleted)" if value_2 is _DELETED else value_2)
+        print(">>>>>>> (2)")
+        answer = raw_input("Choose 1, 2, (A)bandon: ?")
+        if answer in ("1", "2"):
+            return int(answer)
+        elif answer in ("a", "A"):
+            return None
+
+
+def value_digests(obj):
+    """
+    :param obj: dictionary from a JSON file
+    :return: {key:digest} where the digest of each value is a hash of its canonical JSON
+    """
+    return {k: hashlib.sha1(json.dumps(v, sort_keys=True).encode("utf-8")).digest() for k, v in obj.items()}
+
+
+def merge_objects_3way(base, ours, theirs, interactive=False):
+    """
+    Merge two dictionaries known to be from JSON files, using their common ancestor.
+
+    A key added, changed or deleted in only one version takes the value from that version.
+    Only keys changed in different ways in both versions need to be resolved interactively.
+    Values are compared by hash, so each is only serialised once, and shared rather than copied.
+    """
+    if type(base) is not dict or type(ours) is not dict or type(theirs) is not dict:
+        raise TypeError("all objects must be dict")
+    base_digests = value_digests(base)
+    our_digests = value_digests(ours)
+    their_digests = value_digests(theirs)
+    result = dict(ours)
+    for k in set(our_digests).union(their_digests, base_digests):
+        base_digest = base_digests.get(k)
+        our_digest = our_digests.get(k)
+        their_digest = their_digests.get(k)
+        if our_digest == their_digest or their_digest == base_digest:
+            continue    # same in both, or only we changed it: keep ours
+        if our_digest == base_digest:
+            choice = 2  # only they changed it: take theirs
+        elif interactive:
+            choice = choose_interactively(k, ours.get(k, _DELETED), theirs.get(k, _DELETED))
+        else:
+            choice = None
+        if choice is None:
+            raise UnableToResolveError(k)
+        if choice == 2:
+            if their_digest is None:
+                result.pop(k, None)
+            else:
+                result[k] = theirs[k]
+    return result
+
+
+def git_stage_texts(filename):
+    """
+    given an unmerged file, return the text of the base, our and their versions of it from git's index
+    (an empty object stands in for a version that doesn't exist, e.g. if the file was added on both sides)
+    """
+    path = os.path.relpath(filename)
+    texts = []
+    for stage in (1, 2, 3):
+        try:
+            text = subprocess.check_output(["git", "show", ":{0}:./{1}".format(stage, path)],
+                                           stderr=subprocess.DEVNULL).decode("utf-8")
+        except subprocess.CalledProcessError:
+            text = "{}"
+        texts.append(text)
+    return texts
+
+
+def merge_3way_texts(base_json, our_json, their_json, interactive=False):
+    """
+    Merge the text of two versions of a JSON file, given the text of their common ancestor
+    :return: text of merged JSON
+    :raises UnableToResolveError: if a key was changed differently in each version
     """
+    merged = merge_objects_3way(json.loads(base_json), json.loads(our_json), json.loads(their_json),
+                                interactive=interactive)
+    return json.dumps(merged, indent=0, sort_keys=True)
+
+
+def merge_conflicted_file(filename, interactive=False, three_way=False):
+    """
+    Merge the two versions of a JSON file with conflict markers
+    :param three_way: take the versions from git's index, and merge using the common ancestor
+    :return: text of merged JSON
+    :raises UnableToResolveError: if a key has different values in each version
+    """
+    if three_way:
+        return merge_3way_texts(*git_stage_texts(filename), interactive=interactive)
     json_a, json_b = conflicting_file_texts(filename)
     object_a = json.loads(json_a)
     object_b = json.loads(json_b)
+    merged = merge_objects(object_a, object_b, interactive=interactive)
+    return json.dumps(merged, indent=0, sort_keys=True)
+
+
+def resolve_json_file(filename, interactive=False, update=False, three_way=False):
+    """
+    Resolve conflicts in named JSON file
+    """
     try:
-        merged = merge_objects(object_a, object_b, interactive=interactive)
-        merged_json = json.dumps(merged, indent=0, sort_keys=True)
+        merged_json = merge_conflicted_file(filename, interactive=interactive, three_way=three_way)
         if update:
             with open(filename, "w") as f:
                 f.write(merged_json)
@@ -129,18 +234,117 @@ def resolve_json_file(filename, interactive=False, update=False):
         print("Unable to Resolve key", err.args[0], "in", filename)
 
 
+def find_conflicted_files(directory=None):
+    """
+    Find JSON files with merge conflicts
+    :param directory: look for files containing conflict markers in this directory tree,
+      or if None, ask git for unmerged paths
+    :return: sorted list of file paths
+    """
+    if directory is None:
+        output = subprocess.check_output(["git", "ls-files", "-u"]).decode("utf-8")
+        # each line is "mode sha stage\tpath", with a line for each stage of each unmerged path
+        paths = set(line.split("\t", 1)[1] for line in output.splitlines() if "\t" in line)
+        return sorted(path for path in paths if path.endswith(".json"))
+    conflicted = []
+    for dirpath, dirnames, basenames in os.walk(directory):
+        for basename in basenames:
+            if basename.endswith(".json"):
+                filename = os.path.join(dirpath, basename)
+                with open(filename, "r") as f:
+                    if any(line.startswith("<<<<<<< ") for line in f):
+                        conflicted.append(filename)
+    return sorted(conflicted)
+
+
+def resolve_quietly(filename, update=False, three_way=False):
+    """
+    Resolve conflicts in named JSON file without any interaction or output
+    :return: (filename, reason) where reason is None if resolved, else why it needs interactive resolution
+    """
+    try:
+        merged_json = merge_conflicted_file(filename, three_way=three_way)
+    except UnableToResolveError as err:
+        return filename, "different values for key {0}".format(err.args[0])
+    except ValueError as err:
+        return filename, "invalid JSON: {0}".format(err)
+    if update:
+        with open(filename, "w") as f:
+            f.write(merged_json)
+    return filename, None
+
+
+def resolve_json_files(filenames, update=False, processes=None, three_way=False):
+    """
+    Resolve conflicts in many JSON files in parallel
+    :param filenames: list of file paths
+    :param update: write back each file that is resolved
+    :param processes: size of process pool [default is number of CPUs]
+    :param three_way: take the versions from git's index, and merge using the common ancestor
+    :return: (list of resolved files, list of (file, reason) that were not)
+    """
+    resolved = []
+    unresolved = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = executor.map(resolve_quietly, filenames, [update] * len(filenames), [three_way] * len(filenames))
+        for filename, reason in results:
+            if reason is None:
+                resolved.append(filename)
+            else:
+                unresolved.append((filename, reason))
+    return resolved, unresolved
+
+
 def main():
     """
     parse arguments and perform JSON conflict resolution
     """
     ap = argparse.ArgumentParser()
     add = ap.add_argument
-    add("filename", help="JSON file requiring conflict resolution", nargs='+')
+    add("filename", help="JSON file requiring conflict resolution", nargs='*')
     add("-i", "--interactive", default=False, action="store_true", help="prompt to resolve changed values")
     add("--update", default=False, action="store_true", help="overwrite file if resolved without errors")
+    add("-b", "--batch", default=False, action="store_true",
+        help="resolve files in parallel and summarise [default is all unmerged JSON files in git]")
+    add("-d", "--directory", help="in batch mode, find files with conflict markers in this directory")
+    add("-j", "--jobs", type=int, default=None, help="in batch mode, number of processes [default is CPU count]")
+    add("-3", "--three-way", default=False, action="store_true",
+        help="merge using the common ancestor, taking all versions from git's index")
+    add("--files", nargs=3, metavar=("BASE", "OURS", "THEIRS"),
+        help="three-way merge of these files (with --update, the result is written to OURS)")
     args = ap.parse_args()
+    if args.files:
+        texts = []
+        for filename in args.files:
+            with open(filename, "r") as f:
+                texts.append(f.read())
+        try:
+            merged_json = merge_3way_texts(*texts, interactive=args.interactive)
+        except UnableToResolveError as err:
+            print("Unable to Resolve key", err.args[0], "in", args.files[1])
+            raise SystemExit(1)
+        if args.update:
+            with open(args.files[1], "w") as f:
+                f.write(merged_json)
+        else:
+            print(merged_json)
+        return
+    if args.batch:
+        filenames = args.filename or find_conflicted_files(args.directory)
+        resolved, unresolved = resolve_json_files(filenames, update=args.update, processes=args.jobs,
+                                                  three_way=args.three_way)
+        for filename in resolved:
+            print("Resolved", filename)
+        for filename, reason in unresolved:
+            print("Needs interactive resolution", filename, reason)
+        print("{0} resolved, {1} need interactive resolution".format(len(resolved), len(unresolved)))
+        if unresolved:
+            raise SystemExit(1)
+        return
+    if not args.filename:
+        ap.error("filename required unless in batch mode")
     for filename in args.filename:
-        resolve_json_file(filename, interactive=args.interactive, update=args.update)
+        resolve_json_file(filename, interactive=args.interactive, update=args.update, three_way=args.three_way)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
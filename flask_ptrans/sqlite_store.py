@@ -0,0 +1,184 @@
+"""
+    String store backed by a SQLite database written by ptrans_aggregate --sqlite
+
+    Strings are read from the database one at a time as they are looked up, with a small LRU cache
+    in front, so a process only holds the strings it actually uses rather than whole locales.
+    The database file is opened read-only, so all worker processes share it through the OS page cache.
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import urllib.request
+
+from flask_ptrans.ptrans import LazyLocalisedStringStore
+
+
+class SqliteLocalisedStringStore(LazyLocalisedStringStore):
+    """
+    String store with the same interface as LazyLocalisedStringStore, that looks up strings in a
+    SQLite database instead of loading dictionaries from JSON files.
+    Locales are matched the same way: exactly if possible, otherwise the default for the same language.
+    """
+
+    def __init__(self, database, allow_empty=False, cache_size=4096, pseudo_locale=None, pseudo_base_locale="en-GB",
+                 problem_reporter=None):
+        LazyLocalisedStringStore.__init__(self, allow_empty=allow_empty, pseudo_locale=pseudo_locale,
+                                          pseudo_base_locale=pseudo_base_locale, problem_reporter=problem_reporter)
+        self.database = database    # path to database file
+        self._local = threading.local()     # a connection for each thread
+        self._db_locales = None     # {locale:hash} from the database
+        self._db_aliases = None     # {language:locale} from the database
+        self.cached_value = functools.lru_cache(maxsize=cache_size)(self.query_value)
+
+    @property
+    def connection(self):
+        """ read-only connection to the database for the current thread """
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.generation != self.generation:
+            if connection is not None:
+                connection.close()  # reloaded since it was opened, the file may have been replaced
+            uri = "file:{0}?mode=ro".format(urllib.request.pathname2url(os.path.abspath(self.database)))
+            connection = self._local.connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            self._local.generation = self.generation
+        return connection
+
+    def query_value(self, locale, strid):
+        """ :return: string for locale and string ID from the database, or None """
+        row = self.connection.execute(
+            "SELECT value FROM strings WHERE locale = ? AND strid = ?", (locale, strid)).fetchone()
+        return row[0] if row else None
+
+    def query_prefixes(self, locale, prefixes):
+        """ :return: dict of strings for the locale whose string IDs begin with any of the prefixes """
+        strings = {}
+        for prefix in prefixes:
+            if prefix:
+                # everything beginning with the prefix sorts between it and the prefix with its last char incremented
+                upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                rows = self.connection.execute(
+                    "SELECT strid, value FROM strings WHERE locale = ? AND strid >= ? AND strid < ?",
+                    (locale, prefix, upper))
+            else:
+                rows = self.connection.execute("SELECT strid, value FROM strings WHERE locale = ?", (locale,))
+            strings.update(rows)
+        return strings
+
+    def _read_locales(self):
+        self._db_locales = dict(self.connection.execute("SELECT locale, hash FROM locales"))
+        self._db_aliases = dict(self.connection.execute("SELECT alias, locale FROM aliases"))
+
+    def load_locale(self, locale, strid=None, prefixes=None):  # -> SqliteStrings or dict
+        """
+        Find best match for requested locale in the database. Nothing is loaded yet, just a view of its strings.
+        """
+        locale = self.canonical_locale(locale)
+        if self.pseudo_locale and locale.lower() == self.pseudo_locale.lower():
+            return LazyLocalisedStringStore.load_locale(self, locale, strid, prefixes)
+        if self._db_locales is None:
+            self._read_locales()
+        lower = locale.lower()
+        actual_locale = lower if lower in self._db_locales else self._db_aliases.get(lower.partition('-')[0])
+        if not actual_locale:
+            self.problems.report("no-translations", locale, None, logging.WARNING,
+                                 "ptrans no translations for locale %s", locale)
+            self.locales[locale] = {}  # give up, always fall back to untranslated text
+            return {}
+        actual_key = self.canonical_locale(actual_locale)
+        string_dict = self.locales.get(actual_key)
+        if string_dict is None:
+            string_dict = SqliteStrings(self, actual_locale)
+        self.locales[locale] = self.locales[actual_key] = string_dict
+        self._versions[locale] = self._versions[actual_key] = self._db_locales.get(actual_locale) or ""
+        return string_dict
+
+    def reload(self):
+        """
+        Forget everything read from the database, e.g. after it has been replaced by a new one
+        """
+        LazyLocalisedStringStore.reload(self)
+        self._db_locales = self._db_aliases = None
+        self.cached_value.cache_clear()
+
+    def reload_locale(self, locale):
+        """
+        Reload everything from the database, which is all one catalog
+        :return: the strings for the locale
+        """
+        self.reload()
+        return self.load_locale(locale)
+
+    def subset(self, locale, *prefixes):
+        """
+        Return a subset of the string store for a specified locale, where the string IDs match any of the
+        given prefixes, found with a range query for each prefix.
+        """
+        if isinstance(locale, (str, type(u''))):
+            locale_dict = self.locales.get(self.canonical_locale(locale)) or self.load_locale(locale)
+            if isinstance(locale_dict, SqliteStrings):
+                return self.query_prefixes(locale_dict.locale, prefixes)
+        return LazyLocalisedStringStore.subset(self, locale, *prefixes)
+
+    @property
+    def known_locales(self):
+        """
+        Set of the locales in the database (including generic languages of specific locales)
+        """
+        if self._known_locales is None:
+            if self._db_locales is None:
+                self._read_locales()
+            known_locales = set(self._db_locales)
+            known_locales.update(self._db_aliases)
+            if self.pseudo_locale:
+                known_locales.add(self.pseudo_locale)
+            self._known_locales = known_locales
+        return self._known_locales
+
+
+class SqliteStrings(object):
+    """
+    Read-only dict-like view of the strings of one locale in a SqliteLocalisedStringStore
+    """
+
+    def __init__(self, store, locale):
+        self.store = store
+        self.locale = locale    # locale as named in the database
+
+    def get(self, strid, default=None):
+        value = self.store.cached_value(self.locale, strid)
+        return default if value is None else value
+
+    def __getitem__(self, strid):
+        value = self.store.cached_value(self.locale, strid)
+        if value is None:
+            raise KeyError(strid)
+        return value
+
+    def __contains__(self, strid):
+        return self.store.cached_value(self.locale, strid) is not None
+
+    def __bool__(self):
+        return True     # don't count rows just to find out if it is empty
+
+    __nonzero__ = __bool__
+
+    def items(self):
+        return self.store.query_prefixes(self.locale, [""]).items()
+
+    def keys(self):
+        return self.store.query_prefixes(self.locale, [""]).keys()
@@ -0,0 +1,124 @@
+"""
+    tests for the PTrans flask extension object
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+
+import jinja2
+import pytest
+
+from flask_ptrans import ptrans
+
+flask = pytest.importorskip("flask")
+
+
+FAKE_TEMPLATES = {
+    "hello.html": "{{ locale }}: {% ptrans hello %}Hello{% endptrans %}",
+}
+
+
+def fake_app(strings, **config):
+    """
+    make a flask app with the PTrans extension, whose strings come from a locale hook returning
+    the dict in strings for each locale
+    """
+    app = flask.Flask(__name__)
+    app.jinja_loader = jinja2.DictLoader(FAKE_TEMPLATES)
+    app.config.update(config)
+    app.config["PTRANS_LOCALE_HOOK"] = strings.get
+    extension = ptrans.PTrans(app)
+
+    @app.route("/")
+    def hello():
+        return flask.render_template("hello.html")
+
+    @app.route("/bound")
+    def bound():
+        return extension.string_store.lookup_current("hello", "Hello")
+
+    @app.route("/cached")
+    def cached():
+        return extension.make_conditional(flask.render_template("hello.html"))
+
+    @app.route("/twice")
+    def twice():
+        return "{0} {1}".format(extension.get_locale(), extension.get_locale())
+
+    return app, extension
+
+
+def test_locale_negotiated_once_per_request():
+    """
+    the locale is chosen once per request, kept on flask.g, and passed to templates
+    """
+    app, extension = fake_app({"fr-FR": {"hello": "Bonjour"}})
+    calls = []
+
+    @extension.localeselector
+    def select():
+        calls.append(flask.request.args.get("locale"))
+        return flask.request.args.get("locale")
+
+    client = app.test_client()
+    assert client.get("/?locale=fr-FR").data == b"fr-FR: Bonjour"
+    assert client.get("/twice?locale=fr-FR").data == b"fr-FR fr-FR"
+    assert calls == ["fr-FR", "fr-FR"]
+    assert client.get("/twice").data == b"en-GB en-GB"     # default if selector doesn't choose
+
+
+def test_locale_bound_for_request():
+    """
+    the locale for the request is bound to the string store while the request is handled
+    """
+    app, extension = fake_app({"fr-FR": {"hello": "Bonjour"}}, PTRANS_DEFAULT_LOCALE="fr-FR")
+    client = app.test_client()
+    assert client.get("/bound").data == b"Bonjour"
+    assert app.extensions["ptrans"].current_locale is None
+
+
+def test_separate_stores_for_separate_apps():
+    """
+    each app has its own string store, config, and template functions
+    """
+    app1, extension1 = fake_app({"fr-FR": {"hello": "Bonjour"}}, PTRANS_DEFAULT_LOCALE="fr-FR")
+    app2, extension2 = fake_app({"fr-FR": {"hello": "Salut"}}, PTRANS_DEFAULT_LOCALE="fr-FR")
+    assert app1.extensions["ptrans"] is not app2.extensions["ptrans"]
+    assert app1.test_client().get("/").data == b"fr-FR: Bonjour"
+    assert app2.test_client().get("/").data == b"fr-FR: Salut"
+    assert app1.jinja_env.ptrans_store is app1.extensions["ptrans"]
+
+
+def test_conditional_response():
+    """
+    localised responses get an ETag depending on the locale and its strings, and 304 if it matches
+    """
+    strings = {"fr-FR": {"hello": "Bonjour"}, "de-DE": {"hello": "Hallo"}}
+    app, extension = fake_app(strings, PTRANS_DEFAULT_LOCALE="fr-FR")
+    extension.localeselector(lambda: flask.request.headers.get("Accept-Language"))
+    client = app.test_client()
+    response = client.get("/cached")
+    etag = response.headers["ETag"]
+    assert response.status_code == 200 and response.data == b"fr-FR: Bonjour"
+    assert "Accept-Language" in response.headers["Vary"]
+    assert client.get("/cached", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/cached", headers={"If-None-Match": etag, "Accept-Language": "de-DE"}).status_code == 200
+    strings["fr-FR"] = {"hello": "Salut"}
+    app.extensions["ptrans"].reload_locale("fr-FR")
+    response = client.get("/cached", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.data == b"fr-FR: Salut"
+
+
+# stop "import *" from taking anything except test cases
+__all__ = [name for name in dir() if name.startswith("test_")]
@@ -19,6 +19,7 @@ See the License for the specific language governing permissions and limitations
 import os
 import json
 import tempfile
+import threading
 
 import pytest
 
@@ -121,14 +122,155 @@ def test_failed_match():
         assert store.locales["jp-JP"] == {}
 
 
+def test_canonical_locale_keys():
+    """
+    different spellings of a locale share one key
+    """
+    with temporary_string_store(FAKE_LOCALES) as store:
+        for spelling in ("es-ES", "es_es", "ES-es", " es-ES "):
+            assert store.lookup(spelling, "hello", "FAIL") == "hola"
+        assert list(store.locales) == ["es-ES"]
+    assert ptrans.format_locale("ZH_hant_tw") == "zh-Hant-TW"
+    assert ptrans.format_locale("es-419") == "es-419"
+
+
+def test_unknown_locales_bounded(monkeypatch):
+    """
+    only a limited number of unknown locales get keys of their own, and each is only searched for once
+    """
+    globbed = []
+
+    def counting_glob(pattern):
+        globbed.append(pattern)
+        return real_glob(pattern)
+
+    real_glob = ptrans.glob.glob
+    monkeypatch.setattr(ptrans.glob, "glob", counting_glob)
+    with temporary_string_store(FAKE_LOCALES) as store:
+        store.max_unknown_locales = 3
+        for i in range(100):
+            store.lookup("xx-X{0}".format(i), "hello", "hello")
+            store.lookup("es-X{0}".format(i), "hello", "FAIL")
+        assert store.lookup("es-X99", "hello", "FAIL") == "hola"
+        assert set(store.locales) == {"xx-X0", "es-X0", "xx-X1", "es", "es-ES", ptrans.UNKNOWN_LOCALE}
+        searches = len(globbed)
+        store.lookup("xx-X50", "hello", "hello")
+        store.lookup("xx-X0", "hello", "hello")
+        assert len(globbed) == searches
+
+
 def test_broken_json():
     """
     when JSON files are broken in some way, always get empty dict
     """
     with temporary_string_store(FAKE_LOCALES, broken=True) as store:
         store.lookup("en-gb", "hello", "hello")
-        assert "en-gb" in store.locales
-        assert store.locales["en-gb"] == {}
+        assert "en-GB" in store.locales
+        assert store.locales["en-GB"] == {}
+
+
+def test_manifest_used_instead_of_directory():
+    """
+    when there is a manifest, locales are resolved from it without searching the directory
+    """
+    manifest = {"locales": {
+        "es-es": {"file": "es-ES.json", "hash": "0", "strings": 1, "bytes": 16, "aliases": ["es"]},
+    }}
+    with temporary_string_store(dict(FAKE_LOCALES, _manifest=manifest)) as store:
+        assert store.known_locales == {"es-es", "es"}
+        assert store.lookup("es-MX", "hello", "FAIL") == "hola"
+        assert store.lookup("en-US", "hello", "hello") == "hello"  # on disk, but not in the manifest
+        assert store.locales["en-US"] == {}
+        assert store.catalog_version("es-MX") == "0"     # hash from the manifest
+
+
+def test_catalog_version_changes_on_reload():
+    """
+    each loaded locale has a version, which changes when it is reloaded after its file has changed
+    """
+    with temporary_string_store(FAKE_LOCALES) as store:
+        assert store.catalog_version("es-ES") is None
+        store.lookup("es-MX", "hello", "FAIL")
+        version = store.catalog_version("es-MX")
+        assert version and store.catalog_version("es-ES") == version
+        with open(os.path.join(store.localisation_dir, "es-ES.json"), "w", encoding="utf-8") as f:
+            json.dump({"hello": "buenos dias"}, f)
+        assert store.reload_locale("es-MX") == {"hello": "buenos dias"}
+        assert store.catalog_version("es-MX") != version
+        assert store.lookup("es-ES", "hello", "FAIL") == "buenos dias"
+        with store.using_locale("es-ES"):
+            assert store.catalog_version() == store.catalog_version("es-MX")
+        store.reload()
+        assert not store.locales and store.catalog_version("es-ES") is None
+
+
+def test_memory_stats():
+    """
+    memory_stats reports each loaded locale, with locales sharing the strings of another as aliases
+    """
+    with temporary_string_store(FAKE_LOCALES) as store:
+        store.lookup("es-MX", "hello", "FAIL")
+        stats = store.memory_stats()
+        assert sorted(stats) == ["es-ES", "es-MX"]
+        assert stats["es-MX"]["alias_of"] == "es-ES" and stats["es-ES"]["alias_of"] is None
+        assert stats["es-MX"]["keys"] == stats["es-ES"]["keys"] == 1
+        assert stats["es-ES"]["value_bytes"] == 4 and stats["es-ES"]["duplicated_keys"] == 0
+        assert stats["es-ES"]["deep_size"] > 4 and stats["es-ES"]["type"] == "dict"
+        stats = store.memory_stats(load_all=True)
+        assert stats["bg-BG"]["value_bytes"] == len("Здравейте".encode("utf-8"))
+        assert stats["bg-BG"]["duplicated_keys"] == 1
+
+
+@pytest.mark.parametrize("strings, expected", [
+    ({"a": "A", "b": {"value": "B", "comment": "bee"}}, {"a": "A", "b": "B"}),
+    ({"value": "V", "b": {"value": "B"}}, {"value": "V", "b": "B"}),    # string ID "value" at top level
+    ({"value": {"value": "V"}}, {"value": "V"}),
+    ({"a": {"comment": "no value"}}, {"a": None}),
+])
+def test_load_strings_file(strings, expected):
+    """
+    both Pootle JSON formats are flattened as they are loaded
+    """
+    with temporary_string_store({"en-gb": strings}) as store:
+        assert ptrans.load_strings_file(os.path.join(store.localisation_dir, "en-gb.json")) == expected
+
+
+def test_background_loading():
+    """
+    with background loading, lookups don't wait for a locale to load, and get the fallback until it is ready
+    """
+    loading = threading.Event()
+
+    def slow_hook(locale):
+        loading.wait()
+        return {"hello": "hola"} if locale.startswith("es") else {}
+
+    store = ptrans.LazyLocalisedStringStore(locale_hook=slow_hook, background_loading=True)
+    assert store.lookup("es-ES", "hello", "hello") == "hello"
+    assert store.lookup("es-ES", "hello", "hello") == "hello"   # still loading, not loaded twice
+    assert list(store._pending) == ["es-ES"]
+    loading.set()
+    store.wait_for_loading()
+    assert store.lookup("es-ES", "hello", "FAIL") == "hola"
+
+
+def test_background_loading_siblings():
+    """
+    with background loading, other locales of the same language are loaded too
+    """
+    with temporary_string_store(FAKE_LOCALES) as store:
+        store.background_loading = True
+        assert store.lookup("en-US", "hello", "hello") == "hello"
+        store.wait_for_loading()
+        assert store.lookup("en-US", "hello", "FAIL") == "howdy"
+        assert store.locales["en-GB"] == {"hello": "hello"}
+        assert "en-XX" in store.locales
+        assert "es-ES" not in store.locales
+        store.lookup("es-MX", "hello", "hello")
+        store.wait_for_loading()
+        # a new variant gets strings for the same language straight away, even while it is loading
+        assert store.lookup("es-AR", "hello", "FAIL") == "hola"
+        store.wait_for_loading()
 
 
 def test_set_no_directory():
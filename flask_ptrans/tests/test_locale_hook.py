@@ -1,3 +1,7 @@
+import asyncio
+
+import jinja2
+
 from flask_ptrans import ptrans
 
 from pytest import raises
@@ -65,3 +69,73 @@ def test_fallback_to_base_language():
     assert string_store.lookup("fr-FR", "hello", "FAIL") == "bonjour"    # fr-FR is OK
     assert string_store.lookup("fr", "hello", "FAIL") == "bonjour"       # base fr language works now
     assert string_store.lookup("fr-CH", "hello", "FAIL") == "bonjour"    # so does fr-CH which falls back to it
+
+
+def async_locale_hook(calls):
+    async def fetch(locale):
+        calls.append(locale)
+        await asyncio.sleep(0.01)
+        return locale_hook(locale)
+    return fetch
+
+
+def test_async_locale_hook_fetches_once():
+    calls = []
+    string_store = ptrans.LazyLocalisedStringStore(locale_hook=async_locale_hook(calls))
+
+    async def lookups():
+        return await asyncio.gather(*[string_store.lookup_tag_async("es-ES", "hello", "FAIL") for _ in range(5)])
+
+    assert asyncio.run(lookups()) == ["hola"] * 5
+    assert calls == ["es-ES"]
+    assert string_store.lookup_tag_async("es-ES", "hello", "FAIL") == "hola"    # loaded, so not awaitable
+    assert string_store.lookup("en_gb", "hello", "FAIL") == "hello"     # no event loop, so runs the hook
+    assert calls == ["es-ES", "en-GB"]
+
+
+def test_async_locale_hook_in_event_loop():
+    calls = []
+    string_store = ptrans.LazyLocalisedStringStore(locale_hook=async_locale_hook(calls))
+
+    async def lookups():
+        first = string_store.lookup("fr-FR", "hello", "hello?")    # can't block, so fetched in the background
+        second = string_store.lookup("fr-FR", "hello", "hello?")
+        await string_store.load_locale_async("fr-FR")
+        return first, second, string_store.lookup("fr-FR", "hello", "hello?")
+
+    assert asyncio.run(lookups()) == ("hello?", "hello?", "bonjour")
+    assert calls == ["fr-FR"]
+
+
+def test_async_environment():
+    calls = []
+    string_store = ptrans.LazyLocalisedStringStore(locale_hook=async_locale_hook(calls))
+    env = jinja2.Environment(enable_async=True, extensions=[ptrans.ptrans, "flask_ptrans.fragments.ptranscache"])
+    ptrans.bind_environment(env, string_store)
+    template = env.from_string('{% ptranscache "greeting" %}{% ptrans hello %}Hello{% endptrans %}'
+                               '{% endptranscache %} {{ ptrans_get_async(locale, "hello") }}')
+
+    assert asyncio.run(template.render_async(locale="es-MX")) == "hola hola"
+    assert asyncio.run(template.render_async(locale="de-DE")) == "Hello hello"
+    assert calls.count("es-MX") == calls.count("en-GB") == 1    # no strings for de-DE, so it is asked again
+
+
+def test_locale_hook_asked_beyond_unknown_locale_limit():
+    """
+    with a locale hook, made-up locales don't use up the limit of unknown locales before the hook is asked,
+    so real ones still get their strings, and the hook is never asked for UNKNOWN_LOCALE
+    """
+    calls = []
+
+    def recording_hook(locale):
+        calls.append(locale)
+        return locale_hook(locale)
+
+    string_store = ptrans.LazyLocalisedStringStore(locale_hook=recording_hook, max_unknown_locales=2)
+    for i in range(3):
+        assert string_store.lookup("zz-Q{0}".format(i), "hello", "fallback") == "fallback"
+    assert string_store.lookup("fr-FR", "hello", "FAIL") == "bonjour"
+    assert string_store.lookup("fr-CA", "hello", "FAIL") == "bonjour"    # falls back to fr, without a key of its own
+    assert calls == ["zz-Q0", "zz-Q1", "zz-Q2", "fr-FR", "fr-CA"]
+    assert string_store._unknown_locales == {"zz-Q0", "zz-Q1"}
+    assert set(string_store.locales) == {"fr-FR", "fr"}
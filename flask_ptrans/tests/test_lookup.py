@@ -16,7 +16,10 @@ See the License for the specific language governing permissions and limitations
 
 """
 
+import threading
+
 from flask_ptrans import ptrans
+from flask_ptrans.scripts import pseudolocalise
 
 FAKE_LOCALES = {
     "en-GB": {"hello": "hello",
@@ -157,5 +160,77 @@ def test_subset():
     assert store.subset(None, 'hello') == {}
 
 
+def test_pseudo_locale():
+    """
+    pseudo-locale strings are pseudo-localised from the base locale on demand, and cached
+    """
+    store = fake_string_store(FAKE_LOCALES)
+    store.pseudo_locale = "qps-ploc"
+    mangling_map = pseudolocalise.ManglingMap(0)
+    expected = pseudolocalise.mangle_string("Hello, {who}!", mangling_map).format(who="World")
+    assert store.lookup("qps-ploc", "hello-who", "FAIL", who="World") == expected
+    assert store.lookup("qps-PLOC", "hello-who", "FAIL", who="World") == expected
+    assert "qps-PLOC" not in store.locales     # same key as qps-ploc
+    cached = store.lookup("qps-ploc", "hello", "FAIL")
+    assert cached == pseudolocalise.mangle_string("hello", mangling_map)
+    assert store.lookup("qps-ploc", "hello", "FAIL") is cached
+    assert store.lookup("qps-ploc", "goodbye", "Goodbye") == pseudolocalise.mangle_string("Goodbye", mangling_map)
+    assert set(store.subset("qps-ploc", "other-")) == {"other-water"}
+
+
+
+def test_pseudo_locale_base_spelling():
+    """
+    the base locale may be given in any spelling, and subsets only pseudo-localise the strings they include
+    """
+    calls = []
+
+    def hook(locale):
+        calls.append(locale)
+        return FAKE_LOCALES.get(locale, {})
+
+    store = ptrans.LazyLocalisedStringStore(locale_hook=hook, pseudo_locale="qps-ploc", pseudo_base_locale="en-gb")
+    for _ in range(5):
+        assert store.lookup("qps-ploc", "hello", "FAIL") != "FAIL"
+    assert calls == ["en-GB"]
+    assert set(store.subset("qps-ploc", "other-")) == {"other-water"}
+    assert set(store.locales["qps-ploc"].cache) == {"hello", "other-water"}
+
+
+def test_lookup_current():
+    """
+    lookup_current uses the locale bound to the context, with the same fallbacks as lookup_cascade
+    """
+    store = fake_string_store(FAKE_LOCALES)
+    assert store.current_locale is None
+    assert store.lookup_current("hello") == "hello"     # nothing bound, so en-GB
+    with store.using_locale("es-ES"):
+        assert store.current_locale == "es-ES"
+        assert store.lookup_current("hello") == "hola"
+        assert store.lookup_current("hello-who", who="Mundo") == "Hola, Mundo!"
+        assert store.lookup_current("empty", "NOT EMPTY") == "NOT EMPTY"
+        assert store.lookup_current("only-english") == "only english"
+        assert store.lookup_current("goodbye", "Adios") == "Adios"
+        assert store.lookup(None, "hello", "FAIL") == "hola"    # no locale given, so the bound one is used
+        with store.using_locale("fr-FR"):
+            assert store.lookup_current("hello") == "bonjour"
+        assert store.lookup_current("hello") == "hola"
+    assert store.current_locale is None
+
+
+def test_bound_locale_is_per_thread():
+    """
+    a locale bound in one thread is not seen by another
+    """
+    store = fake_string_store(FAKE_LOCALES)
+    seen = []
+    with store.using_locale("es-ES"):
+        thread = threading.Thread(target=lambda: seen.append(store.lookup_current("hello")))
+        thread.start()
+        thread.join()
+        assert store.lookup_current("hello") == "hola"
+    assert seen == ["hello"]
+
+
 # stop "import *" from taking anything except test cases
 __all__ = [name for name in dir() if name.startswith("test_")]
@@ -0,0 +1,135 @@
+"""
+    tests for ICU-style plural and select messages
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+
+import pytest
+
+from flask_ptrans import ptrans
+from flask_ptrans.messageformat import compile_message, MessageSyntaxError
+
+
+FLIGHTS = "{count, plural, =0 {No flights} one {# flight} other {# flights}} to {city}"
+
+
+@pytest.mark.parametrize("count, expected", [
+    (0, "No flights to Oslo"),
+    (1, "1 flight to Oslo"),
+    (7, "7 flights to Oslo"),
+])
+def test_plural(count, expected):
+    """
+    exact matches come first, then the plural category of the number
+    """
+    assert compile_message(FLIGHTS, "en-GB")(count=count, city="Oslo") == expected
+
+
+def test_plural_rules_per_language():
+    """
+    each language has its own plural categories
+    """
+    books = compile_message("{n, plural, one {# knjiga} few {# knjige} other {# knjiga!}}", "hr-HR")
+    assert [books(n=n) for n in (1, 3, 5, 21, 12)] == ["1 knjiga", "3 knjige", "5 knjiga!", "21 knjiga", "12 knjiga!"]
+    french = compile_message("{n, plural, one {# vol} other {# vols}}", "fr-FR")
+    assert [french(n=n) for n in (0, 1, 2)] == ["0 vol", "1 vol", "2 vols"]
+    japanese = compile_message("{n, plural, one {ONE} other {#便}}", "ja-JP")
+    assert japanese(n=1) == "1便"
+
+
+def test_select_offset_and_quoting():
+    """
+    select chooses by value, # is the number less the offset, and apostrophes quote braces
+    """
+    message = compile_message("{who} {n, plural, offset:1 =1 {} other {and # more }}liked {g, select, "
+                              "female {her} male {his} other {their}} post. It''s '{'quoted'}'", "en")
+    assert message(who="Ana", n=1, g="female") == "Ana liked her post. It's {quoted}"
+    assert message(who="Bo", n=3, g="x") == "Bo and 2 more liked their post. It's {quoted}"
+    with pytest.raises(KeyError):
+        message(who="Cy", n=2)
+
+
+def test_plural_argument_as_string():
+    """
+    a plural argument can be a string of digits, e.g. from a query string, but not any other string
+    """
+    message = compile_message(FLIGHTS, "en-GB")
+    assert message(count="0", city="Oslo") == "No flights to Oslo"
+    assert message(count="3", city="Oslo") == "3 flights to Oslo"
+    assert message(count="1.5", city="Oslo") == "1.5 flights to Oslo"
+    with pytest.raises(ValueError):
+        message(count="three", city="Oslo")
+    with pytest.raises(TypeError):
+        message(count=None, city="Oslo")
+
+
+@pytest.mark.parametrize("source", [
+    "{n, plural, one {x}}",
+    "{n, select, a {x} other {y}",
+    "{n",
+    "unmatched }",
+])
+def test_invalid_messages(source):
+    with pytest.raises(MessageSyntaxError):
+        compile_message(source)
+
+
+def test_lookup_message_cached_until_reload():
+    """
+    the store parses each message once per locale, and again after the locale is reloaded
+    """
+    strings = {"de-DE": {"flights": "{count, plural, one {# Flug} other {# Flüge}} nach {city}"}}
+    store = ptrans.LazyLocalisedStringStore(locale_hook=lambda locale: strings.get(locale, {}))
+    assert store.lookup_message("de-DE", "flights", FLIGHTS, count=1, city="Wien") == "1 Flug nach Wien"
+    message = store._messages[("de-DE", "flights")][1]
+    assert store.lookup_message("de-DE", "flights", FLIGHTS, count=2, city="Wien") == "2 Flüge nach Wien"
+    assert store._messages[("de-DE", "flights")][1] is message
+    assert store.lookup_message("it-IT", "flights", FLIGHTS, count=0, city="Roma") == "No flights to Roma"
+    with store.using_locale("de-DE"):
+        assert store.lookup_message(None, "flights", FLIGHTS, count=3, city="Bonn") == "3 Flüge nach Bonn"
+    strings["de-DE"] = {"flights": "{count, plural, one {ein Flug} other {# Flüge}}"}
+    store.reload_locale("de-DE")
+    assert ("de-DE", "flights") not in store._messages
+    assert store.lookup_message("de-DE", "flights", FLIGHTS, count=1) == "ein Flug"
+
+
+def test_lookup_message_cache_bounded(monkeypatch):
+    """
+    beyond MAX_MESSAGES, the least recently used compiled messages make way for new ones, so made-up locales
+    can't make the store grow without limit
+    """
+    monkeypatch.setattr(ptrans, "MAX_MESSAGES", 3)
+    store = ptrans.LazyLocalisedStringStore(locale_hook=lambda locale: {})
+    assert store.lookup_message("en-GB", "flights", FLIGHTS, count=1, city="Oslo") == "1 flight to Oslo"
+    for i in range(100):
+        store.lookup_message("zz-Q{0}".format(i), "flights", FLIGHTS, count=2, city="Oslo")
+        assert store.lookup_message("en-GB", "flights", FLIGHTS, count=3, city="Oslo") == "3 flights to Oslo"
+    assert list(store._messages) == [(store.canonical_locale("zz-Q98"), "flights"),
+                                     (store.canonical_locale("zz-Q99"), "flights"), ("en-GB", "flights")]
+
+
+def test_lookup_invalid_message():
+    """
+    invalid messages, or missing arguments, give the string as it is
+    """
+    store = ptrans.LazyLocalisedStringStore(locale_hook=lambda locale: {"bad": "{n, plural, one {x}}"})
+    assert store.lookup_message("en-GB", "bad", "FAIL", n=1) == "{n, plural, one {x}}"
+    assert store.lookup_message("en-GB", "missing", FLIGHTS, count=1) == FLIGHTS
+    assert store.lookup_message("en-GB", "missing", FLIGHTS, count="many", city="Oslo") == FLIGHTS
+    assert store.lookup_message("en-GB", "missing", FLIGHTS, count=None, city="Oslo") == FLIGHTS
+
+
+# stop "import *" from taking anything except test cases
+__all__ = [name for name in dir() if name.startswith("test_")]
@@ -0,0 +1,63 @@
+"""
+    tests for deduplicated reporting of translation problems
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+
+import logging
+
+from flask_ptrans import ptrans
+from flask_ptrans.problems import ProblemReporter
+
+
+def test_problems_logged_once_then_counted(caplog):
+    """
+    the first occurrence of a problem is logged straight away, and repeats are counted until flushed
+    """
+    reporter = ProblemReporter(logging.getLogger("ptrans-test"), interval=3600)
+    store = ptrans.LazyLocalisedStringStore(locale_hook=lambda locale: {"hello": "Hello {who}"},
+                                            problem_reporter=reporter)
+    with caplog.at_level(logging.WARNING, logger="ptrans-test"):
+        for i in range(100):
+            assert store.lookup("en-GB", "hello", "Hi", name="Sam") == "Hello {who}"
+        store.lookup(None, "hello", "Hi")
+        assert [record.getMessage() for record in caplog.records] == [
+            "No {who} in string hello, locale en-GB",
+            "locale is a NoneType for hello",
+        ]
+        caplog.clear()
+        reporter.close()
+        assert [record.getMessage() for record in caplog.records] == [
+            "ptrans missing-argument for hello locale en-GB repeated 99 times"]
+    assert reporter.problems == {("missing-argument", "en-GB", "hello"), ("bad-locale", "NoneType", "hello")}
+
+
+def test_problems_bounded(caplog):
+    """
+    beyond the maximum number of different problems, they are only counted
+    """
+    reporter = ProblemReporter(logging.getLogger("ptrans-test"), interval=3600, max_problems=2)
+    with caplog.at_level(logging.WARNING, logger="ptrans-test"):
+        for i in range(5):
+            reporter.report("no-translations", "xx-{0}".format(i), None, logging.WARNING, "none for %s", i)
+        assert len(caplog.records) == 2
+        reporter.flush()
+        assert caplog.records[-1].getMessage() == "ptrans 3 more problems of other kinds, strings or locales"
+    assert len(reporter.problems) == 2
+    reporter.close()
+
+
+# stop "import *" from taking anything except test cases
+__all__ = [name for name in dir() if name.startswith("test_")]
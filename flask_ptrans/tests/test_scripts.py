@@ -19,14 +19,21 @@ See the License for the specific language governing permissions and limitations
 
 from __future__ import print_function, unicode_literals
 
+import hashlib
+import io
 import json
 import logging
 import os
+import subprocess
 import tempfile
 import textwrap
 from contextlib import contextmanager
 
-from flask_ptrans.scripts import aggregate_json, check_templates, resolve_json_conflicts, pseudolocalise
+import pytest
+
+from flask_ptrans import ptrans
+from flask_ptrans.scripts import aggregate_json, check_templates, resolve_json_conflicts, pseudolocalise, \
+    list_untranslated_strings, render_templates, catalog_stats
 
 
 @contextmanager
@@ -148,6 +155,143 @@ def test_aggregate_json():
         assert french == expected['fr-fr']
 
 
+def test_aggregate_json_minified_with_manifest():
+    """
+        aggregate_json can write minified files, and a manifest describing them
+    """
+    all_locales = {
+        "en-gb": {"key1": "hello", "key2": "goodbye"},
+        "en-us": {"key1": "howdy"},
+        "fr-fr": {"key1": "bonjour"},
+    }
+    with throwaway_dir() as dirpath:
+        manifest = aggregate_json.save_locale_files(dirpath, all_locales, minify=True)
+        aggregate_json.save_manifest(dirpath, manifest)
+        with open(os.path.join(dirpath, "en-gb.json"), "rb") as f:
+            data = f.read()
+        assert data == b'{"key1":"hello","key2":"goodbye"}'
+        assert manifest["en-gb"] == {
+            "file": "en-gb.json",
+            "hash": hashlib.sha1(data).hexdigest(),
+            "strings": 2,
+            "bytes": len(data),
+            "aliases": ["en"],  # first of the en-* locales is the default for the language
+        }
+        assert manifest["en-us"]["aliases"] == []
+        assert manifest["fr-fr"]["aliases"] == ["fr"]
+        with open(os.path.join(dirpath, "_manifest.json"), "r") as f:
+            assert json.load(f) == {"locales": manifest}
+
+
+def test_aggregate_json_shards_loaded_on_demand():
+    """
+        aggregate_json can split locales into shards by prefix, and the string store loads only the shards it needs
+    """
+    all_locales = {
+        "en-gb": {"flights_a": "flight", "flights_payment_b": "pay", "hotels_a": "hotel", "misc": "other"},
+    }
+    with throwaway_dir() as dirpath:
+        manifest = aggregate_json.save_locale_files(dirpath, all_locales,
+                                                    shard_prefixes=["flights_", "flights_payment_", "hotels_"])
+        aggregate_json.save_manifest(dirpath, manifest)
+        shards = manifest["en-gb"]["shards"]
+        assert {name: (shard["file"], shard["prefixes"], shard["strings"]) for name, shard in shards.items()} == {
+            "flights": ("_shards/en-gb/flights.json", ["flights_"], 1),
+            "flights_payment": ("_shards/en-gb/flights_payment.json", ["flights_payment_"], 1),
+            "hotels": ("_shards/en-gb/hotels.json", ["hotels_"], 1),
+            "_other": ("_shards/en-gb/_other.json", [], 1),
+        }
+        assert manifest["en-gb"]["strings"] == 4
+
+        store = ptrans.LazyLocalisedStringStore(dirpath)
+        assert store.lookup("en-GB", "hotels_a", "FAIL") == "hotel"
+        assert store.locales["en-GB"] == {"hotels_a": "hotel"}
+        assert store.subset("en-GB", "flights_") == {"flights_a": "flight", "flights_payment_b": "pay"}
+        assert store._loaded_shards["en-gb"] == {"hotels", "flights", "flights_payment"}
+        assert "en-GB" in store._partial_locales
+        assert store.lookup("en-GB", "misc", "FAIL") == "other"
+        assert not store._partial_locales   # all loaded now
+
+
+
+def test_aggregate_json_loaded_shards_not_searched_again(monkeypatch):
+    """
+        once the shards holding a string or prefix are loaded, lookups and subsets don't go back to load_shards
+    """
+    all_locales = {"en-gb": {"flights_a": "flight", "hotels_a": "hotel", "misc": "other"}}
+    with throwaway_dir() as dirpath:
+        manifest = aggregate_json.save_locale_files(dirpath, all_locales, shard_prefixes=["flights_", "hotels_"])
+        aggregate_json.save_manifest(dirpath, manifest)
+        store = ptrans.LazyLocalisedStringStore(dirpath)
+        assert store.lookup("en-GB", "hotels_a", "FAIL") == "hotel"
+        assert store.subset("en-GB", "flights_") == {"flights_a": "flight"}
+        calls = []
+        monkeypatch.setattr(store, "load_shards", lambda *args: calls.append(args))
+        assert store.lookup("en-GB", "hotels_a", "FAIL") == "hotel"
+        assert store.lookup("en-GB", "hotels_missing", "fallback") == "fallback"
+        assert store.subset("en-GB", "flights_") == {"flights_a": "flight"}
+        assert calls == []
+        assert "en-GB" in store._partial_locales
+
+def test_aggregate_json_shard_by_owner():
+    """
+        aggregate_json can split locales into shards by the directory strings came from
+    """
+    test_files = {
+        "hotels/": {"en-gb.json": {"hotels_a": "hotel", "hotels_b": "inn"}},
+        "shared/": {"en-gb.json": {"shared_x": "x", "title": "Title"}},
+    }
+    with throwaway_dir() as dirpath:
+        populate_with_fake_files(dirpath, test_files)
+        key_owners = {}
+        all_locales = aggregate_json.extract_all_locales([dirpath], pattern="*/*.json", key_owners=key_owners)
+        assert key_owners == {"hotels_a": "hotels", "hotels_b": "hotels", "shared_x": "shared", "title": "shared"}
+        manifest = aggregate_json.save_locale_files(dirpath, all_locales, key_owners=key_owners)
+        shards = manifest["en-gb"]["shards"]
+        assert shards["hotels"]["prefixes"] == ["hotels_"]
+        assert shards["shared"]["prefixes"] == ["shared_", "title"]
+
+
+def test_aggregate_json_shard_names_unique():
+    """
+        prefixes that would share a shard name get shards named by the prefix itself, so no strings are lost
+    """
+    shards = aggregate_json.shard_strings({"flights_a": "1", "flights-b": "2", "hotels_c": "3", "x": "4"},
+                                          ["flights_", "flights-", "hotels_"])
+    assert shards == {
+        "flights_": (["flights_"], {"flights_a": "1"}),
+        "flights-": (["flights-"], {"flights-b": "2"}),
+        "hotels": (["hotels_"], {"hotels_c": "3"}),
+        "_other": ([], {"x": "4"}),
+    }
+    with pytest.raises(ValueError):
+        aggregate_json.shard_names(["other", "_other"])
+
+
+def test_aggregate_json_shards_not_read_back(monkeypatch):
+    """
+        aggregating into the same directory again ignores the shards written the first time
+    """
+    test_files = {
+        "hotels/": {"en-gb.json": {"hotels_a": "hotel"}},
+        "flights/": {"en-gb.json": {"flights_a": "flight"}, "fr-fr.json": {"flights_a": "vol"}},
+    }
+    with throwaway_dir() as dirpath:
+        populate_with_fake_files(dirpath, test_files)
+        monkeypatch.setattr("sys.argv", ["ptrans_aggregate", "--shard-by-owner", dirpath])
+        aggregate_json.main()
+        with open(os.path.join(dirpath, "_manifest.json"), encoding="utf-8") as f:
+            first = json.load(f)
+        aggregate_json.main()
+        with open(os.path.join(dirpath, "_manifest.json"), encoding="utf-8") as f:
+            second = json.load(f)
+        assert second == first
+        assert sorted(second["locales"]) == ["en-gb", "fr-fr"]
+        assert sorted(os.listdir(os.path.join(dirpath, "hotels"))) == ["en-gb.json"]
+        with open(os.path.join(dirpath, "hotels", "en-gb.json"), encoding="utf-8") as f:
+            assert json.load(f) == {"hotels_a": "hotel"}
+
+
 def test_check_templates_find_strings():
     """
         check_templates finds translatable strings embedded in various ways
@@ -284,6 +428,146 @@ def test_resolve_json_conflicts():
         assert updated == expected
 
 
+def test_resolve_json_conflicts_batch():
+    """
+        can find and resolve conflicted JSON files in bulk, listing those that need interactive resolution
+    """
+    test_files = {
+        "ok/": {
+            "en-gb.json": textwrap.dedent("""
+            {
+            <<<<<<< ours
+            "key1": {"value": "value1"}
+            =======
+            "key2": "value2"
+            >>>>>>> theirs
+            }"""),
+            "fr-fr.json": {"key1": "not conflicted"},
+        },
+        "clash.json": textwrap.dedent("""
+        {
+        <<<<<<< ours
+        "key1": "value1"
+        =======
+        "key1": "other"
+        >>>>>>> theirs
+        }"""),
+    }
+    with throwaway_dir() as dirpath:
+        populate_with_fake_files(dirpath, test_files)
+        ok_path = os.path.join(dirpath, "ok", "en-gb.json")
+        clash_path = os.path.join(dirpath, "clash.json")
+        filenames = resolve_json_conflicts.find_conflicted_files(dirpath)
+        assert filenames == sorted([ok_path, clash_path])
+        resolved, unresolved = resolve_json_conflicts.resolve_json_files(filenames, update=True, processes=2)
+        assert resolved == [ok_path]
+        assert unresolved == [(clash_path, "different values for key key1")]
+        with open(ok_path, "r") as f:
+            assert json.load(f) == {"key1": {"value": "value1"}, "key2": "value2"}
+
+
+def test_merge_objects_shares_values():
+    """
+        merged object shares values with its inputs instead of copying them
+    """
+    a = {"key1": {"value": "value1"}}
+    b = {"key2": {"value": "value2"}}
+    merged = resolve_json_conflicts.merge_objects(a, b)
+    assert merged["key1"] is a["key1"]
+    assert merged["key2"] is b["key2"]
+    assert merged is not a
+
+
+def test_merge_objects_3way():
+    """
+        three-way merge takes changes made on only one side, and only fails on keys changed differently on both
+    """
+    base = {"same": "s", "ours-changed": "a", "theirs-changed": "b", "ours-deleted": "c", "theirs-deleted": "d",
+            "both-changed": "e"}
+    ours = {"same": "s", "ours-changed": "A", "theirs-changed": "b", "theirs-deleted": "d", "ours-added": "f",
+            "both-changed": "E1"}
+    theirs = {"same": "s", "ours-changed": "a", "theirs-changed": {"value": "B"}, "ours-deleted": "c",
+              "theirs-added": "g", "both-changed": "E2"}
+    with pytest.raises(resolve_json_conflicts.UnableToResolveError) as excinfo:
+        resolve_json_conflicts.merge_objects_3way(base, ours, theirs)
+    assert excinfo.value.args[0] == "both-changed"
+    theirs["both-changed"] = "E1"   # changed the same way on both sides is fine
+    merged = resolve_json_conflicts.merge_objects_3way(base, ours, theirs)
+    assert merged == {"same": "s", "ours-changed": "A", "theirs-changed": {"value": "B"}, "ours-added": "f",
+                      "theirs-added": "g", "both-changed": "E1"}
+    assert merged["theirs-changed"] is theirs["theirs-changed"]
+
+
+def test_resolve_json_conflicts_three_way_from_git(tmpdir, monkeypatch):
+    """
+        three-way resolution reads the base, ours and theirs versions from git's index
+    """
+    def git(*args):
+        subprocess.check_call(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def write(strings):
+        with open("en-gb.json", "w") as f:
+            json.dump(strings, f, indent=0, sort_keys=True)
+
+    monkeypatch.chdir(str(tmpdir))
+    git("init", "-q", "-b", "main")
+    write({"key1": "one", "key2": "two"})
+    git("add", "en-gb.json")
+    git("commit", "-q", "-m", "base")
+    git("checkout", "-q", "-b", "other")
+    write({"key1": "one", "key2": "TWO", "key3": "three"})
+    git("commit", "-q", "-am", "theirs")
+    git("checkout", "-q", "main")
+    write({"key1": "ONE"})
+    git("commit", "-q", "-am", "ours")
+    with pytest.raises(subprocess.CalledProcessError):
+        git("merge", "other")
+    # two-way merge can't tell key2 was deleted on our side, not changed, and says so
+    assert resolve_json_conflicts.resolve_quietly("en-gb.json") == ("en-gb.json", "different values for key key1")
+    resolved, unresolved = resolve_json_conflicts.resolve_json_files(["en-gb.json"], update=True, three_way=True)
+    assert unresolved == [("en-gb.json", "different values for key key2")]    # deleted by us, changed by them
+    base, ours, theirs = resolve_json_conflicts.git_stage_texts("en-gb.json")
+    assert json.loads(base) == {"key1": "one", "key2": "two"}
+    theirs = json.dumps({"key1": "one", "key2": "two", "key3": "three"})    # as if they hadn't changed key2
+    merged = resolve_json_conflicts.merge_3way_texts(base, ours, theirs)
+    assert json.loads(merged) == {"key1": "ONE", "key3": "three"}
+
+
+def test_untranslated_coverage_matrix():
+    """
+        list_untranslated_strings compares all locales in all directories, in either format
+    """
+    test_files = {
+        "flights/": {
+            "en-gb.json": {"f1": {"value": "one"}, "f2": {"value": "two"}, "f3": {"value": ""}},
+            "fr-fr.json": {"f1": {"value": "un"}, "f2": {"value": ""}},
+            "de-de.json": {"f1": "eins", "f2": "zwei"},    # simple format
+        },
+        "hotels/": {
+            "en-gb.json": {"h1": "hotel"},
+            "fr-fr.json": {"h1": "hôtel"},
+        },
+    }
+    with throwaway_dir() as dirpath:
+        populate_with_fake_files(dirpath, test_files)
+        dirs = [os.path.join(dirpath, "flights"), os.path.join(dirpath, "hotels")]
+        totals, missing = list_untranslated_strings.coverage_matrix(dirs, processes=2)
+        flights, hotels = dirs
+        assert totals == {flights: 2, hotels: 1}
+        assert missing == {
+            "de-de": {flights: [], hotels: ["h1"]},
+            "fr-fr": {flights: ["f2"], hotels: []},
+        }
+        out = io.StringIO()
+        list_untranslated_strings.write_matrix(totals, missing, out, output_format="csv")
+        assert out.getvalue().splitlines() == [
+            "locale,{0},{1},all".format(flights, hotels),
+            "de-de,100.0,0.0,66.7",
+            "fr-fr,50.0,100.0,66.7",
+        ]
+
+
 def test_pseudolocalise_with_placeholders():
     """
     pseudolocalise.mangle_string preserves placeholders
@@ -295,3 +579,100 @@ def test_pseudolocalise_with_placeholders():
     assert "{not}" in result
     assert "{n: >+3,.7f}" in result  # more extreme formatting than will ever be used, still survives mangling
     assert result.startswith("[") and result.endswith("]")
+
+
+def test_pseudolocalise_deterministic():
+    """
+    pseudolocalise.mangle_string gives the same result for the same seed
+    """
+    translatable_string = "Ünïcode {n} and ASCII ☃"
+    result = pseudolocalise.mangle_string(translatable_string, pseudolocalise.ManglingMap(42))
+    assert result == pseudolocalise.mangle_string(translatable_string, pseudolocalise.ManglingMap(42))
+    assert "{n}" in result
+    assert "☃" in result
+
+
+def test_pseudolocalise_trees():
+    """
+    pseudolocalise_trees writes a pseudo-localised file beside each English one, the same every time
+    """
+    test_files = {
+        "en-gb.json": {"key1": "top"},
+        "flights/": {
+            "en-gb.json": {"key2": {"value": "Hello {who}", "comment": "greeting"}},
+            "deep/": {"en-gb.json": {"key3": "deep"}},
+        },
+        "hotels/": {"fr-fr.json": {"key4": "pas anglais"}},
+    }
+    with throwaway_dir() as dirpath:
+        populate_with_fake_files(dirpath, test_files)
+        written = pseudolocalise.pseudolocalise_trees([dirpath], seed=1, processes=2)
+        expected = sorted(os.path.join(dirpath, path, "qps-ploc.json") for path in ["", "flights", "flights/deep"])
+        assert sorted(written) == expected
+        with open(os.path.join(dirpath, "flights", "qps-ploc.json"), encoding="utf-8") as f:
+            first = f.read()
+        pseudolocalise.pseudolocalise_trees([dirpath], seed=1, processes=2)
+        with open(os.path.join(dirpath, "flights", "qps-ploc.json"), encoding="utf-8") as f:
+            assert f.read() == first
+        entry = json.loads(first)["key2"]
+        assert entry["comment"] == "greeting"
+        assert entry["value"] == pseudolocalise.mangle_string("Hello {who}", pseudolocalise.ManglingMap(1))
+
+
+def test_render_templates_for_many_locales():
+    """
+    render_locales renders each template in each locale, returning the text or writing files
+    """
+    test_files = {
+        "templates/": {
+            "email/": {"welcome.html": "{% ptrans greeting %}Hello{% endptrans %}, {{ name }}!"},
+            "footer.html": "{{ locale }} {{ ptrans_current('footer') }}",
+        },
+        "strings/": {
+            "en-gb.json": {"greeting": "Hello", "footer": "Goodbye"},
+            "fr-fr.json": {"greeting": "Bonjour"},
+            "de-de.json": {"greeting": "Hallo", "footer": "Tschuss"},
+        },
+    }
+    with throwaway_dir() as dirpath:
+        populate_with_fake_files(dirpath, test_files)
+        template_dir, strings_dir = os.path.join(dirpath, "templates"), os.path.join(dirpath, "strings")
+        templates = ["email/welcome.html", "footer.html"]
+        rendered = render_templates.render_locales(template_dir, strings_dir, templates, ["fr-FR", "de-DE"],
+                                                   context={"name": "Sam"}, processes=2)
+        assert sorted(rendered) == [
+            ("de-DE", "email/welcome.html", "Hallo, Sam!"),
+            ("de-DE", "footer.html", "de-DE Tschuss"),
+            ("fr-FR", "email/welcome.html", "Bonjour, Sam!"),
+            ("fr-FR", "footer.html", "fr-FR Goodbye"),
+        ]
+        output_dir = os.path.join(dirpath, "out")
+        written = render_templates.render_locales(template_dir, strings_dir, templates, ["fr-FR"],
+                                                  output_dir=output_dir, processes=1)
+        welcome = os.path.join(output_dir, "fr-FR", "email", "welcome.html")
+        assert sorted(filename for locale, name, filename in written) == [
+            welcome, os.path.join(output_dir, "fr-FR", "footer.html")]
+        with open(welcome, encoding="utf-8") as f:
+            assert f.read() == "Bonjour, !"
+
+
+def test_catalog_stats():
+    """
+    catalog_stats loads every locale in a directory and reports their sizes, counting aliases once in the total
+    """
+    test_files = {
+        "en-gb.json": {"greeting": "Hello", "footer": "Goodbye"},
+        "fr-fr.json": {"greeting": "Bonjour", "fr_only": "Ça va"},
+    }
+    with throwaway_dir() as dirpath:
+        populate_with_fake_files(dirpath, test_files)
+        stats, traced = catalog_stats.directory_stats(dirpath)
+    assert sorted(stats) == ["en", "en-GB", "fr", "fr-FR"]
+    assert stats["fr"]["alias_of"] == "fr-FR" and stats["fr-FR"]["alias_of"] is None
+    assert stats["fr-FR"]["keys"] == 2 and stats["fr-FR"]["duplicated_keys"] == 1
+    assert stats["fr-FR"]["value_bytes"] == len("Bonjour") + len("Ça va".encode("utf-8"))
+    assert catalog_stats.totals(stats)["keys"] == 4
+    assert traced > 0
+    out = io.StringIO()
+    catalog_stats.write_table(stats, traced, out, sort="keys")
+    assert out.getvalue().splitlines()[-2].split()[:2] == ["total", "4"]
@@ -0,0 +1,116 @@
+"""
+    tests for the SQLite-backed string store
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+
+import logging
+import threading
+
+import pytest
+
+from flask_ptrans.scripts import aggregate_json
+from flask_ptrans.sqlite_store import SqliteLocalisedStringStore, SqliteStrings
+
+
+FAKE_LOCALES = {
+    "en-gb": {"hello": "hello", "hello-who": "Hello, {who}!", "js_a": "A", "js_b": "B", "jsx": "X"},
+    "es-es": {"hello": "hola", "hello-who": "Hola, {who}!", "js_a": "a"},
+}
+
+
+def setup_module():
+    aggregate_json.logger = logging.getLogger('agg')
+
+
+@pytest.fixture
+def store(tmpdir):
+    filename = str(tmpdir.join("catalog.sqlite"))
+    aggregate_json.save_sqlite_catalog(filename, FAKE_LOCALES)
+    return SqliteLocalisedStringStore(filename, cache_size=16)
+
+
+def test_lookup(store):
+    """
+    strings are looked up in the database, including the default locale for a language
+    """
+    assert store.lookup("es-ES", "hello", "FAIL") == "hola"
+    assert store.lookup("es-MX", "hello-who", "FAIL", who="Mundo") == "Hola, Mundo!"
+    assert store.lookup("es-ES", "goodbye", "Adios") == "Adios"
+    assert store.lookup_cascade("es-ES", "js_b") == "B"
+    assert store.lookup("jp-JP", "hello", "FAIL-JP") == "FAIL-JP"
+    assert isinstance(store.locales["es-MX"], SqliteStrings)
+    assert store.locales["es-MX"] is store.locales["es-ES"]
+    assert store.known_locales == {"en-gb", "en", "es-es", "es"}
+
+
+def test_catalog_version(store):
+    """
+    each locale's version is its content hash from the database
+    """
+    store.lookup("es-MX", "hello", "FAIL")
+    version = store.catalog_version("es-MX")
+    assert len(version) == 40 and version == store.catalog_version("es-es")
+    assert store.catalog_version("en-GB") is None
+    store.reload_locale("en-GB")
+    assert store.catalog_version("es-MX") is None
+    assert store.lookup("en-GB", "hello", "FAIL") == "hello"
+    assert store.catalog_version("en-GB") not in (None, version)
+
+
+def test_lookups_cached(store):
+    """
+    repeated lookups come from the cache, not the database
+    """
+    store.lookup("en-GB", "hello", "FAIL")
+    store.lookup("en-GB", "hello", "FAIL")
+    info = store.cached_value.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+
+
+def test_subset(store):
+    """
+    subset finds strings by prefix with range queries
+    """
+    assert store.subset("en-GB", "js_") == {"js_a": "A", "js_b": "B"}
+    assert store.subset("en-GB", "js") == {"js_a": "A", "js_b": "B", "jsx": "X"}
+    assert store.subset("es-ES", "js_", "hello-") == {"js_a": "a", "hello-who": "Hola, {who}!"}
+    assert store.subset("jp-JP", "js_") == {}
+    assert store.subset(None, "js_") == {}
+
+
+def test_connection_per_thread(store):
+    """
+    each thread has its own connection
+    """
+    found = []
+    thread = threading.Thread(target=lambda: found.append(store.lookup("es-ES", "js_a", "FAIL")))
+    thread.start()
+    thread.join()
+    assert found == ["a"]
+
+
+def test_path_quoted_in_uri(tmpdir):
+    """
+    characters with a meaning in URIs, such as # and ?, can be in the path of the database
+    """
+    filename = str(tmpdir.mkdir("a#b?c d").join("catalog%.sqlite"))
+    aggregate_json.save_sqlite_catalog(filename, FAKE_LOCALES)
+    store = SqliteLocalisedStringStore(filename)
+    assert store.lookup("es-ES", "hello", "FAIL") == "hola"
+
+
+# stop "import *" from taking anything except test cases
+__all__ = [name for name in dir() if name.startswith("test_")]
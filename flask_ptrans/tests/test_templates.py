@@ -19,7 +19,9 @@ See the License for the specific language governing permissions and limitations
 from pytest import raises
 import jinja2
 import json
+from flask_ptrans import ptrans
 from flask_ptrans.ptrans import _global_string_store as string_store
+from flask_ptrans.fragments import LRUFragmentCache, MappingFragmentCache
 
 
 def fake_jinja(template_dict):
@@ -29,6 +31,7 @@ def fake_jinja(template_dict):
     """
     jinja_env = jinja2.Environment(loader=jinja2.DictLoader(template_dict))
     jinja_env.add_extension("flask_ptrans.ptrans.ptrans")
+    jinja_env.add_extension("flask_ptrans.fragments.ptranscache")
     jinja_env.filters['tojson'] = json.dumps
     return jinja_env
 
@@ -37,7 +40,14 @@ FAKE_TEMPLATES = {
     "trivial.html": "<html></html>",
     "simple.html": "<p>{% ptrans test-simple %}Unknown{% endptrans %}</p>",
     "broken.html": "<p>{% ptrans test-broken %}{% for i in [1,2,3] %}{% end %}{% endptrans %}</p>",
-    "script.html": "<script> strings = {{ ptrans_subset(locale, 'prefix-')|tojson|safe }}; </script>"
+    "script.html": "<script> strings = {{ ptrans_subset(locale, 'prefix-')|tojson|safe }}; </script>",
+    "page.html": "{% extends 'base.html' %}{% block main %}{% include ['missing.html', 'simple.html'] %}"
+                 "{% ptrans test-page %}Page{% endptrans %}{% endblock %}",
+    "base.html": "{% ptrans test-base %}Base{% endptrans %}{% block main %}{% endblock %}{% include footer %}",
+    "script_json.html": "<script> strings = {{ ptrans_subset_json(locale, 'prefix-') }}; </script>",
+    "version.html": "<html data-strings='{{ ptrans_version(locale) }}'></html>",
+    "cached.html": "{% ptranscache 'footer' %}<p>{{ n }} {% ptrans test-simple %}Unknown{% endptrans %}</p>"
+                   "{% endptranscache %}",
 }
 
 
@@ -88,5 +98,137 @@ def test_script_template():
         ]   # can't be sure of order, since it's from a dict
 
 
+def test_script_json_template():
+    """
+    ptrans_subset_json() inserts the same strings as safe JSON, serialised once per catalog version
+    """
+    strings = {'en-GB': {"prefix-b": "</script>", "prefix-a": "A & B", "other-z": "Z"}}
+    store = ptrans.LazyLocalisedStringStore(locale_hook=lambda locale: strings.get(locale, {}))
+    env = fake_jinja(FAKE_TEMPLATES)
+    env.autoescape = True
+    ptrans.bind_environment(env, store)
+    t = env.get_template("script_json.html")
+    assert t.render(locale='en-GB') == \
+        '<script> strings = {"prefix-a": "A \\u0026 B", "prefix-b": "\\u003c/script\\u003e"}; </script>'
+    assert t.render(locale='es-ES') == '<script> strings = {}; </script>'
+    cached = store.subset_json('en-GB', 'prefix-')
+    assert store.subset_json('en_gb', 'prefix-') is cached
+    strings['en-GB'] = {"prefix-a": "A"}
+    store.reload_locale('en-GB')
+    assert store.subset_json('en-GB', 'prefix-') == '{"prefix-a": "A"}'
+    with store.using_locale('en-GB'):
+        assert t.render() == '<script> strings = {"prefix-a": "A"}; </script>'
+
+
+def test_script_json_least_recently_used(monkeypatch):
+    """
+    beyond MAX_SUBSET_JSON, the least recently used serialised subsets make way for new ones
+    """
+    monkeypatch.setattr(ptrans, "MAX_SUBSET_JSON", 2)
+    strings = {'en-GB': {"a-1": "A", "b-1": "B", "c-1": "C"}}
+    store = ptrans.LazyLocalisedStringStore(locale_hook=lambda locale: strings.get(locale, {}))
+    first = store.subset_json('en-GB', 'a-')
+    store.subset_json('en-GB', 'b-')
+    assert store.subset_json('en-GB', 'a-') is first     # now more recently used than b-
+    store.subset_json('en-GB', 'c-')
+    assert [key[1] for key in store._subset_json] == [('a-',), ('c-',)]
+    assert store.subset_json('en-GB', 'a-') is first
+
+
+def test_bound_locale_template():
+    """
+    ptrans syntax uses the locale bound to the string store if the template isn't given one
+    """
+    env = fake_jinja(FAKE_TEMPLATES)
+    t = env.get_template("simple.html")
+    string_store.locales['fr-FR'] = {"test-simple": "Simple"}
+    with string_store.using_locale('fr-FR'):
+        assert t.render() == "<p>Simple</p>"
+        assert t.render(locale='es-ES') == "<p>Unknown</p>"     # but a locale given to the template wins
+    assert t.render() == "<p>Unknown</p>"
+
+
+def test_template_manifest():
+    """
+    the strings in each template are recorded as it is parsed, and the manifest follows includes and extends
+    """
+    env = fake_jinja(FAKE_TEMPLATES)
+    registry = env.ptrans_registry
+    env.get_template("simple.html")
+    assert registry.strings["simple.html"] == {"test-simple": "Unknown"}
+    assert "base.html" not in registry.strings
+    assert registry.manifest("page.html") == {"test-page": "Page", "test-base": "Base", "test-simple": "Unknown"}
+    assert registry.dependencies["page.html"] == ["base.html", "missing.html", "simple.html"]
+    assert registry.dependencies["base.html"] == []     # include of a variable can't be followed
+    assert registry.manifest("trivial.html") == {}
+
+
+def test_version_template():
+    """
+    can call ptrans_version() to insert the version of the strings for a locale
+    """
+    store = ptrans.LazyLocalisedStringStore(locale_hook=lambda locale: {"test-simple": "Simple"})
+    env = fake_jinja(FAKE_TEMPLATES)
+    ptrans.bind_environment(env, store)
+    store.load_locale('fr-FR')
+    assert env.get_template("version.html").render(locale='fr-FR') == "<html data-strings='hook-1'></html>"
+
+
+def test_cached_fragment_template():
+    """
+    ptranscache renders its body once per locale, until the catalog version changes
+    """
+    strings = {'de-DE': {"test-simple": "Einfach"}, 'fr-FR': {"test-simple": "Simple"}}
+    store = ptrans.LazyLocalisedStringStore(locale_hook=lambda locale: strings.get(locale, {}))
+    env = fake_jinja(FAKE_TEMPLATES)
+    ptrans.bind_environment(env, store)
+    t = env.get_template("cached.html")
+    assert t.render(locale='de-DE', n=1) == "<p>1 Einfach</p>"
+    assert t.render(locale='de-DE', n=2) == "<p>1 Einfach</p>"
+    assert t.render(locale='fr-FR', n=3) == "<p>3 Simple</p>"
+    with store.using_locale('fr-FR'):
+        assert t.render(n=4) == "<p>3 Simple</p>"
+    strings['de-DE'] = {"test-simple": "Schlicht"}
+    store.reload_locale('de-DE')
+    assert t.render(locale='de-DE', n=5) == "<p>5 Schlicht</p>"
+
+
+def test_cached_fragment_any_locale_spelling():
+    """
+    ptranscache canonicalises the locale, so spellings such as file names share one entry and one load
+    """
+    calls = []
+
+    def hook(locale):
+        calls.append(locale)
+        return {"test-simple": "Sencillo"} if locale == "es-ES" else {}
+
+    store = ptrans.LazyLocalisedStringStore(locale_hook=hook)
+    env = fake_jinja(FAKE_TEMPLATES)
+    ptrans.bind_environment(env, store)
+    t = env.get_template("cached.html")
+    assert [t.render(locale=locale, n=n) for n, locale in enumerate(['es-es', 'es_ES', 'es-ES', 'es-es'])] == \
+        ["<p>0 Sencillo</p>"] * 4
+    assert calls == ["es-ES"]
+    assert len(env.ptrans_fragment_cache) == 1
+
+
+def test_fragment_cache_backends():
+    """
+    the LRU cache is bounded, and any mapping can be used instead
+    """
+    cache = LRUFragmentCache(maxsize=2)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a") == "A"
+    cache.set("c", "C")
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("A", None, "C")
+    shared = {}
+    env = fake_jinja(FAKE_TEMPLATES)
+    env.ptrans_fragment_cache = MappingFragmentCache(shared)
+    env.get_template("cached.html").render(locale='es-ES', n=1)
+    assert list(shared.values()) == ["<p>1 Unknown</p>"]
+
+
 # stop "import *" from taking anything except test cases
 __all__ = [name for name in dir() if name.startswith("test_")]
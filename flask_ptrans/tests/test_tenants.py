@@ -0,0 +1,133 @@
+"""
+    tests for tenant overlays on top of the strings of each locale
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+
+import json
+
+import pytest
+
+from flask_ptrans import ptrans
+
+flask = pytest.importorskip("flask")
+
+
+def write_json(path, strings):
+    """ write a strings file, making its directory if need be """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(strings), encoding="utf-8")
+
+
+@pytest.fixture
+def store(tmp_path):
+    """ string store with locales en-GB and es-ES, and overlays for tenants acme and zenith """
+    write_json(tmp_path / "strings" / "en-gb.json", {"hello": "Hello", "flights": "Flights", "js_search": "Search"})
+    write_json(tmp_path / "strings" / "es-es.json", {"hello": "Hola", "flights": "Vuelos", "js_search": "Buscar"})
+    write_json(tmp_path / "overlays" / "acme" / "en-gb.json", {"flights": "Acme Flights", "js_search": "Go"})
+    write_json(tmp_path / "overlays" / "acme" / "es-mx.json", {"flights": "Vuelos Acme"})
+    write_json(tmp_path / "overlays" / "zenith" / "es-es.json", {"hello": {"value": "Hola Zenith", "comment": ""}})
+    return ptrans.LazyLocalisedStringStore(str(tmp_path / "strings"),
+                                           overlay_directory=str(tmp_path / "overlays"))
+
+
+def test_overlay_on_base_locale(store):
+    """
+    a bound tenant's overlay wins over the locale's strings, and an overlay for another locale of the same
+    language is used if there's none for the locale itself
+    """
+    assert store.lookup("en-GB", "flights", "FAIL") == "Flights"
+    with store.using_tenant("acme"):
+        assert store.lookup("en-GB", "flights", "FAIL") == "Acme Flights"
+        assert store.lookup("en-GB", "hello", "FAIL") == "Hello"
+        assert store.lookup("es-ES", "flights", "FAIL") == "Vuelos Acme"     # overlay for the same language
+        assert store.lookup_cascade("de-DE", "js_search") == "Go"    # via the fallback locale
+        assert store.subset("en-GB", "js_") == {"js_search": "Go"}
+    with store.using_tenant("zenith"):
+        assert store.lookup("es-ES", "hello", "FAIL") == "Hola Zenith"
+        assert store.lookup("en-GB", "flights", "FAIL") == "Flights"
+    assert store.lookup("es-ES", "hello", "FAIL") == "Hola"
+
+
+def test_overlays_share_base_strings(store):
+    """
+    each tenant and locale gets one LayeredCatalog over the locale's own strings, and none if there's no overlay
+    """
+    with store.using_tenant("acme"):
+        assert store.lookup("en-GB", "flights", "FAIL") == "Acme Flights"
+        acme = store.tenant_catalog("acme", "en-GB", store.locales["en-GB"])
+        assert isinstance(acme, ptrans.LayeredCatalog)
+        assert acme.base is store.locales["en-GB"]
+        assert store.tenant_catalog("acme", "en-GB", store.locales["en-GB"]) is acme
+        assert acme.flattened() is acme.flattened()
+    with store.using_tenant("zenith"):
+        store.lookup("es-ES", "hello", "FAIL")
+        assert store.tenant_catalog("zenith", "en-GB", store.locales["en-GB"]) is store.locales["en-GB"]
+
+
+def test_bound_locale_and_versions(store):
+    """
+    catalog_version includes the tenant and its overlay version, and a tenant that isn't a plain name is ignored
+    """
+    base_version = store.lookup("en-GB", "hello", "FAIL") and store.catalog_version("en-GB")
+    with store.using_tenant("acme"), store.using_locale("en-GB"):
+        assert store.lookup_current("flights") == "Acme Flights"
+        assert store.catalog_version().startswith(base_version + "+acme-")
+    with store.using_tenant("../strings"):
+        assert store.lookup("en-GB", "flights", "FAIL") == "Flights"
+    assert store.catalog_version("en-GB") == base_version
+
+
+def test_tenant_selected_per_request(store):
+    """
+    the PTrans extension binds the tenant chosen by the tenantselector for each request
+    """
+    app = flask.Flask(__name__)
+    app.config["PTRANS_LOCALISATION_DIR"] = store.localisation_dir
+    app.config["PTRANS_OVERLAY_DIR"] = store.overlay_dir
+    extension = ptrans.PTrans(app)
+
+    @extension.tenantselector
+    def select():
+        return flask.request.args.get("brand")
+
+    @app.route("/")
+    def index():
+        return flask.render_template_string("{% ptrans flights %}{% endptrans %}")
+
+    client = app.test_client()
+    assert client.get("/?brand=acme", headers={"Accept-Language": "en-GB"}).data == b"Acme Flights"
+    assert client.get("/", headers={"Accept-Language": "en-GB"}).data == b"Flights"
+    assert app.extensions["ptrans"].current_tenant is None
+
+
+def test_unknown_tenants_not_kept(store):
+    """
+    tenants without a directory of overlays, e.g. made up in requests, get no overlay entries
+    """
+    assert store.tenants == {"acme", "zenith"}
+    for i in range(10):
+        with store.using_tenant("brand{0}".format(i)):
+            assert store.lookup("en-GB", "flights", "FAIL") == "Flights"
+        with store.using_tenant("../brand{0}".format(i)):
+            assert store.lookup("en-GB", "flights", "FAIL") == "Flights"
+    with store.using_tenant("zenith"):
+        assert store.lookup("en-GB", "flights", "FAIL") == "Flights"
+    assert set(store._overlays) == {("zenith", "en-GB")}
+    assert not store._layered
+
+
+# stop "import *" from taking anything except test cases
+__all__ = [name for name in dir() if name.startswith("test_")]
@@ -0,0 +1,98 @@
+"""
+    tests for sampled string usage profiles and warming up from them
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+
+import logging
+import threading
+
+from flask_ptrans import ptrans
+from flask_ptrans.scripts import aggregate_json
+from flask_ptrans.usage import UsageRecorder, load_profile, hottest_locales
+
+
+ALL_LOCALES = {
+    "en-gb": {"flights_a": "flight", "hotels_a": "hotel", "misc": "other"},
+    "fr-fr": {"flights_a": "vol", "hotels_a": "hôtel", "misc": "autre"},
+}
+
+
+def setup_module():
+    aggregate_json.logger = logging.getLogger('agg')
+
+
+def test_usage_sampled_and_flushed(tmpdir):
+    """
+    one in every N lookups is counted, scaled up by N, and flushes add to the profile file
+    """
+    filename = str(tmpdir.join("usage.json"))
+    recorder = UsageRecorder(filename, sample_rate=0.5, interval=3600)
+    store = ptrans.LazyLocalisedStringStore(locale_hook=lambda locale: {"hello": "Hello"}, usage_recorder=recorder)
+    for i in range(10):
+        store.lookup("en-GB", "hello", "Hi")
+    store.subset("fr-FR", "js_")
+    store.subset("fr-FR", "js_")
+    with store.using_locale("de-DE"):
+        store.lookup_current("bye")
+        store.lookup_current("bye")
+    recorder.flush()
+    assert load_profile(filename) == {"en-GB": {"hello": 10}, "fr-FR": {"js_*": 2}, "de-DE": {"bye": 2}}
+    store.lookup("en-GB", "hello", "Hi")
+    store.lookup("en-GB", "hello", "Hi")
+    recorder.close()
+    assert load_profile(filename)["en-GB"] == {"hello": 12}
+
+
+def test_usage_flushed_while_recording(tmpdir):
+    """
+    counts recorded by other threads while a flush is writing are neither lost nor break the flush
+    """
+    filename = str(tmpdir.join("usage.json"))
+    recorder = UsageRecorder(filename, sample_rate=1, interval=3600)
+
+    def record_many(locale):
+        for i in range(2000):
+            recorder.record(locale, "string{0}".format(i % 50))
+
+    threads = [threading.Thread(target=record_many, args=(locale,)) for locale in ("en-GB", "fr-FR", "de-DE")]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        recorder.flush()
+    recorder.close()
+    profile = load_profile(filename)
+    assert {locale: sum(counts.values()) for locale, counts in profile.items()} == \
+        {"en-GB": 2000, "fr-FR": 2000, "de-DE": 2000}
+
+
+def test_warm_from_profile(tmpdir):
+    """
+    the most used locales are loaded first, and only the shards holding the strings used
+    """
+    dirpath = str(tmpdir)
+    manifest = aggregate_json.save_locale_files(dirpath, ALL_LOCALES, shard_prefixes=["flights_", "hotels_"])
+    aggregate_json.save_manifest(dirpath, manifest)
+    profile = {"en-gb": {"hotels_a": 5}, "fr-fr": {"flights_a": 40, "hotels_*": 20}}
+    assert hottest_locales(profile) == [("fr-fr", ["flights_a", "hotels_*"]), ("en-gb", ["hotels_a"])]
+    store = ptrans.LazyLocalisedStringStore(dirpath)
+    assert store.warm_from_profile(profile, max_locales=1) == ["fr-FR"]
+    assert store._loaded_shards == {"fr-fr": {"flights", "hotels"}}
+    assert store.warm_from_profile(profile) == ["fr-FR", "en-GB"]
+    assert store._loaded_shards["en-gb"] == {"hotels"}
+
+
+# stop "import *" from taking anything except test cases
+__all__ = [name for name in dir() if name.startswith("test_")]
@@ -0,0 +1,135 @@
+"""
+    Sampled recording of which strings are used, for warming up string stores and pruning catalogs
+
+    A UsageRecorder given to a string store counts one in every N lookups by (locale, strid), and a background
+    thread adds the counts to a JSON profile file once per interval:
+
+        {"locales": {"en-gb": {"strid": count, ...}, ...}}
+
+    Counts are scaled up by N, so they estimate the real number of lookups. ptrans_subset() calls are counted
+    under their prefixes with "*" added, e.g. "flights_payment_*".
+
+    At startup, LazyLocalisedStringStore.warm_from_profile() loads the locales (or, for sharded locales, the shards)
+    that the profile says were used, starting with the most used.
+
+Copyright 2015 Skyscanner Ltd
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and limitations under the License.
+
+"""
+import json
+import logging
+import os
+import threading
+
+
+class UsageRecorder(object):
+    """
+    Count a sample of string lookups in memory, and add them to a profile file periodically.
+    Several processes can share a profile file, though a flush may be lost if two happen at the same moment.
+    """
+
+    def __init__(self, filename, sample_rate=0.01, interval=300.0, max_keys=100000):
+        """
+        :param filename: JSON profile file to add counts to
+        :param sample_rate: fraction of lookups to count, e.g. 0.01 counts one in a hundred
+        :param interval: seconds between flushes to the file
+        :param max_keys: maximum number of (locale, strid) to count between flushes; more are ignored
+        """
+        self.filename = filename
+        self.every = max(1, int(round(1.0 / sample_rate)))
+        self.interval = interval
+        self.max_keys = max_keys
+        self._countdown = self.every
+        self._counts = {}       # {(locale, strid):estimated lookups since last flush}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None     # background thread flushing counts, started when first needed
+
+    def record(self, locale, strid):
+        """
+        Count a lookup, if it is one of the sample
+        """
+        self._countdown -= 1
+        if self._countdown > 0:
+            return
+        self._countdown = self.every
+        key = (locale, strid)
+        with self._lock:    # only for the sample, and flush() mustn't swap the counts out meanwhile
+            counts = self._counts
+            if key in counts:
+                counts[key] += self.every
+            elif len(counts) < self.max_keys:
+                counts[key] = self.every
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_periodically, name="ptrans-usage")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def flush(self):
+        """
+        Add the counts since the last flush to the profile file
+        """
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        if not counts:
+            return
+        profile = load_profile(self.filename)
+        for (locale, strid), count in counts.items():
+            locale_counts = profile.setdefault(locale, {})
+            locale_counts[strid] = locale_counts.get(strid, 0) + count
+        temp_filename = "{0}.{1}.tmp".format(self.filename, os.getpid())
+        with open(temp_filename, "w", encoding="utf-8") as profile_file:
+            json.dump({"locales": profile}, profile_file, sort_keys=True)
+        os.replace(temp_filename, self.filename)
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except (IOError, OSError) as err:
+                logging.error("ptrans could not write usage profile %s: %s", self.filename, err)
+            except Exception:   # keep recording whatever happened
+                logging.exception("ptrans could not flush usage profile %s", self.filename)
+
+    def close(self):
+        """
+        Stop the background thread, and write any counts not flushed yet
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+def load_profile(filename):
+    """
+    :param filename: JSON profile file written by a UsageRecorder
+    :return: {locale:{strid:count}}, empty if there is no valid profile
+    """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "r", encoding="utf-8") as profile_file:
+        try:
+            return json.load(profile_file)["locales"]
+        except (ValueError, KeyError):
+            logging.error("ptrans invalid usage profile %s", filename)
+            return {}
+
+
+def hottest_locales(profile):
+    """
+    :param profile: {locale:{strid:count}}
+    :return: list of (locale, [strid]) with the most used locales first, and their strings most used first
+    """
+    totals = sorted(((sum(counts.values()), locale) for locale, counts in profile.items()), reverse=True)
+    return [(locale, sorted(profile[locale], key=lambda strid: -profile[locale][strid])) for total, locale in totals]
@@ -10,6 +10,7 @@ setup(
     url='https://github.com/Skyscanner/flask-ptrans',
     download_url='https://github.com/Skyscanner/flask-ptrans/tarball/2.0.3',
     packages=find_packages(),
+    python_requires='>=3.7',
     install_requires=['jinja2'],
     extras_require={'test': 'pytest'},
     entry_points={
@@ -19,12 +20,16 @@ setup(
             'ptrans_check = flask_ptrans.scripts.check_templates:main',
             'ptrans_untranslated = flask_ptrans.scripts.list_untranslated_strings:main',
             'ptrans_pseudolocalise = flask_ptrans.scripts.pseudolocalise:main',
+            'ptrans_render = flask_ptrans.scripts.render_templates:main',
+            'ptrans_stats = flask_ptrans.scripts.catalog_stats:main',
         ]
         },
     classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',
         'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
         ],
     keywords=['localisation', 'jinja2', 'flask', 'pootle'],
     license='Apache License v2',